@@ -0,0 +1,307 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple, TypeVar
+from metrics_utils import metrics
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+import re
+import os
+from dotenv import load_dotenv
+import logging
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+ADMISSION_CONTROL_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "true").lower() == "true"
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+# 0 = learn the limits from OpenAI's x-ratelimit-* response headers
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "0"))
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "0"))
+# Successful calls before the concurrency limit grows back by one after a 429
+ADMISSION_RECOVERY_CALLS = int(os.getenv("ADMISSION_RECOVERY_CALLS", "20"))
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+_priority: ContextVar[int] = ContextVar("call_priority", default=INTERACTIVE)
+
+queue_wait_seconds = metrics.histogram(
+    "openai_queue_wait_seconds", "Time OpenAI calls waited for admission", ("model", "priority"))
+rate_limited_calls = metrics.counter("openai_rate_limited_total", "OpenAI calls answered with 429", ("model",))
+coalesced_calls = metrics.counter(
+    "coalesced_calls_total", "Calls that started an upstream call (leader) or joined one in flight (follower)",
+    ("flight", "role"))
+
+T = TypeVar("T")
+
+
+@contextmanager
+def background_calls():
+    """Queue the OpenAI calls made inside the block behind interactive traffic (e.g. ingestion embeddings)"""
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class SingleFlight:
+    """Share one in-flight call among concurrent callers with the same key.
+
+    The call runs in its own task, so a caller that goes away does not cancel
+    it for the others.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.create_task(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._calls.pop(key, None) if self._calls.get(key) is done else None)
+            coalesced_calls.inc(flight=self.name, role="leader")
+        else:
+            coalesced_calls.inc(flight=self.name, role="follower")
+        return await asyncio.shield(task)
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+
+class _Bucket:
+    """Token bucket refilled continuously at limit per minute; unlimited while limit is 0"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.level = float(limit)
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if self.limit:
+            self.level = min(self.limit, self.level + (now - self._updated) * self.limit / 60)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        if not self.limit:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.limit)
+        return 0.0 if self.level >= amount else (amount - self.level) * 60 / self.limit
+
+    def take(self, amount: float):
+        if self.limit:
+            self.level -= min(amount, self.limit)
+
+    def set_limit(self, limit: int, now: float):
+        self._refill(now)
+        if not self.limit:
+            self.level = float(limit)
+        self.limit = limit
+
+    def cap(self, remaining: float, now: float):
+        """Trust the server's count when it is lower than ours"""
+        if self.limit:
+            self._refill(now)
+            self.level = min(self.level, remaining)
+
+
+def _parse_duration(value: Optional[str]) -> float:
+    """Seconds in an OpenAI reset header such as "1s", "6m0s" or "120ms" """
+    if not value:
+        return 0.0
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(amount) * units[unit] for amount, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value))
+
+
+class ModelLimiter:
+    """Admission control for one OpenAI model: request and token buckets plus a concurrency limit.
+
+    Waiting calls are admitted in priority order (interactive before background),
+    then FIFO. Bucket sizes follow the x-ratelimit-* headers of each response; a
+    429 pauses admission until the reset time and halves the concurrency limit,
+    which then grows back by one every ADMISSION_RECOVERY_CALLS successful calls.
+    """
+
+    def __init__(self, model: str, max_concurrency: int = OPENAI_MAX_CONCURRENCY,
+                 requests_per_minute: int = OPENAI_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: int = OPENAI_TOKENS_PER_MINUTE):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.concurrency = max_concurrency
+        self.requests = _Bucket(requests_per_minute)
+        self.tokens = _Bucket(tokens_per_minute)
+        self.in_flight = 0
+        self.rate_limited = 0
+        self._paused_until = 0.0
+        self._successes = 0
+        self._waiters: List[Tuple[int, int, float, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def queue_depth(self, priority: Optional[int] = None) -> int:
+        return sum(1 for waiter in self._waiters
+                   if not waiter[3].done() and (priority is None or waiter[0] == priority))
+
+    async def acquire(self, tokens: float, priority: int = INTERACTIVE):
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), tokens, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted just as the caller went away
+                self.release()
+            raise
+        finally:
+            queue_wait_seconds.observe(time.perf_counter() - start, model=self.model,
+                                       priority=PRIORITY_NAMES.get(priority, str(priority)))
+
+    def release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self._waiters:
+            priority, _, tokens, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if self.in_flight >= self.concurrency:
+                return
+            delay = max(self._paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+            if delay > 0:
+                self._schedule(delay)
+                return
+            heapq.heappop(self._waiters)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _schedule(self, delay: float):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def observe(self, status: int, headers):
+        """Tune the limits from a response's status and x-ratelimit-* headers"""
+        now = time.monotonic()
+        for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            limit = headers.get(f"x-ratelimit-limit-{kind}")
+            if limit and limit.isdigit() and int(limit) != bucket.limit:
+                bucket.set_limit(int(limit), now)
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining and remaining.isdigit():
+                bucket.cap(int(remaining), now)
+
+        if status == 429:
+            self.rate_limited += 1
+            rate_limited_calls.inc(model=self.model)
+            reset = max(_parse_duration(headers.get("x-ratelimit-reset-requests")),
+                        _parse_duration(headers.get("x-ratelimit-reset-tokens")))
+            retry_after = headers.get("retry-after")
+            if retry_after and retry_after.replace(".", "", 1).isdigit():
+                reset = max(reset, float(retry_after))
+            self._paused_until = max(self._paused_until, now + (reset or 1.0))
+            self.concurrency = max(1, self.concurrency // 2)
+            self._successes = 0
+            logger.warning(f"OpenAI rate limited {self.model}; pausing {reset or 1.0:.1f}s, "
+                           f"concurrency limit {self.concurrency}")
+        elif status < 400 and self.concurrency < self.max_concurrency:
+            self._successes += 1
+            if self._successes >= ADMISSION_RECOVERY_CALLS:
+                self.concurrency += 1
+                self._successes = 0
+
+    def stats(self) -> Dict:
+        return {
+            "concurrency_limit": self.concurrency,
+            "in_flight": self.in_flight,
+            "queued": {name: self.queue_depth(priority) for priority, name in PRIORITY_NAMES.items()},
+            "requests_per_minute": self.requests.limit or None,
+            "tokens_per_minute": self.tokens.limit or None,
+            "rate_limited": self.rate_limited,
+        }
+
+
+_limiters: Dict[str, ModelLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(model: str) -> ModelLimiter:
+    limiter = _limiters.get(model)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.setdefault(model, ModelLimiter(model))
+    return limiter
+
+
+def limiter_stats() -> Dict[str, Dict]:
+    return {model: limiter.stats() for model, limiter in list(_limiters.items())}
+
+
+def admission_transport(model: str, transport):
+    """Wrap an httpx async transport so each request waits for the model's limiter.
+
+    The slot is held until the response body is closed, which covers streamed
+    completions; the request body size stands in for its token count.
+    """
+    if not ADMISSION_CONTROL_ENABLED:
+        return transport
+    import httpx
+
+    limiter = get_limiter(model)
+
+    class _ReleasingStream(httpx.AsyncByteStream):
+        def __init__(self, stream):
+            self._stream = stream
+            self._released = False
+
+        async def __aiter__(self):
+            async for chunk in self._stream:
+                yield chunk
+
+        async def aclose(self):
+            try:
+                await self._stream.aclose()
+            finally:
+                if not self._released:
+                    self._released = True
+                    limiter.release()
+
+    class AdmissionTransport(httpx.AsyncBaseTransport):
+        async def handle_async_request(self, request):
+            try:
+                tokens = len(request.content) / 4
+            except httpx.RequestNotRead:
+                tokens = 0
+            await limiter.acquire(tokens, _priority.get())
+            try:
+                response = await transport.handle_async_request(request)
+            except BaseException:
+                limiter.release()
+                raise
+            limiter.observe(response.status_code, response.headers)
+            if response.is_closed:
+                # Body already read by the transport
+                limiter.release()
+            else:
+                response.stream = _ReleasingStream(response.stream)
+            return response
+
+        async def aclose(self):
+            # The wrapped transport and its connection pool may be shared with other models
+            pass
+
+    return AdmissionTransport()
@@ -0,0 +1,229 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from langchain_utils import RETRIEVAL_K, chain_registry, get_retriever, get_standalone_question, source_metadata
+from context_utils import CONTEXT_ASSEMBLY_ENABLED, CONTEXT_FETCH_K, assemble_context
+from pinecone_utils import get_embeddings
+from cache_utils import semantic_cache
+from memory_utils import conversation_memory
+from log_sink_utils import application_log_sink
+from pydantic_models import BatchItemResult, BatchQuestion
+from metrics_utils import span, chain_callbacks
+import asyncio
+import time
+import uuid
+import os
+from dotenv import load_dotenv
+import logging
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+CHAT_BATCH_MAX_ITEMS = int(os.getenv("CHAT_BATCH_MAX_ITEMS", "100"))
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8"))
+CHAT_BATCH_MAX_CONCURRENCY = int(os.getenv("CHAT_BATCH_MAX_CONCURRENCY", "32"))
+
+
+def _elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+@dataclass
+class _Item:
+    question: str
+    session_id: str
+    # Sessions the caller did not name are new and have no history to load
+    new_session: bool = False
+    history: List[Dict] = field(default_factory=list)
+    standalone_question: str = ""
+    timings_ms: Dict[str, float] = field(default_factory=dict)
+    answer: Optional[str] = None
+    cached: bool = False
+    deduplicated: bool = False
+    error: Optional[str] = None
+
+    @property
+    def key(self) -> Tuple[str, Optional[str], Optional[str]]:
+        # Identical questions share one answer unless a conversation makes them differ; the lead's
+        # raw question is what gets answered, so within a conversation it has to match too
+        if not self.history:
+            return self.standalone_question.strip().lower(), None, None
+        return self.standalone_question.strip().lower(), self.session_id, self.question.strip().lower()
+
+
+@dataclass
+class _Group:
+    items: List[_Item]
+    embedding: List[float] = None
+    documents: List = None
+    answer: Optional[str] = None
+    cached: bool = False
+    error: Optional[str] = None
+    timings_ms: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def lead(self) -> _Item:
+        return self.items[0]
+
+
+def _rounds(items: List[_Item]) -> List[List[_Item]]:
+    """Split a batch so each session has at most one question per round, keeping the order within a session"""
+    rounds: List[List[_Item]] = []
+    turns: Dict[str, int] = {}
+    for item in items:
+        turn = turns.get(item.session_id, 0)
+        turns[item.session_id] = turn + 1
+        if turn == len(rounds):
+            rounds.append([])
+        rounds[turn].append(item)
+    return rounds
+
+
+async def answer_batch(questions: List[BatchQuestion], model: str,
+                       max_concurrency: Optional[int] = None) -> Tuple[List[BatchItemResult], int, Dict[str, float]]:
+    """Answer many questions as one unit of work.
+
+    Histories are loaded and follow-ups rewritten concurrently, identical
+    standalone questions are answered once, all of them are embedded in one
+    batched call, searches run concurrently with the precomputed embeddings,
+    and generation runs with at most max_concurrency requests in flight.
+    Several questions for one session are answered in order, each against the
+    history including the previous ones, by running the batch in rounds.
+    Returns (per-item results, unique questions, batch timings).
+    """
+    batch_start = time.perf_counter()
+    concurrency = min(max_concurrency or CHAT_BATCH_CONCURRENCY, CHAT_BATCH_MAX_CONCURRENCY)
+    slots = asyncio.Semaphore(concurrency)
+    items = [_Item(question=q.question, session_id=q.session_id or str(uuid.uuid4()), new_session=not q.session_id)
+             for q in questions]
+    timings: Dict[str, float] = {}
+
+    unique_questions = 0
+    for round_items in _rounds(items):
+        unique_questions += await _answer_round(round_items, model, slots, timings)
+
+    timings["total"] = _elapsed_ms(batch_start)
+    logger.info(f"Answered batch of {len(items)} questions ({unique_questions} unique) in {timings['total']} ms")
+    results = [
+        BatchItemResult(
+            question=item.question,
+            session_id=item.session_id,
+            answer=item.answer,
+            cached=item.cached,
+            deduplicated=item.deduplicated,
+            error=item.error,
+            timings_ms=item.timings_ms
+        )
+        for item in items
+    ]
+    return results, unique_questions, timings
+
+
+async def _answer_round(items: List[_Item], model: str, slots: asyncio.Semaphore, timings: Dict[str, float]) -> int:
+    """Answer questions for distinct sessions, adding each stage's time to timings; returns the unique questions"""
+    def add_timing(stage: str, start: float):
+        timings[stage] = round(timings.get(stage, 0.0) + _elapsed_ms(start), 1)
+
+    # Conversation state, once per session the caller named
+    start = time.perf_counter()
+    named = [item for item in items if not item.new_session]
+    with span("history"):
+        histories = await asyncio.gather(*(conversation_memory.get_history(item.session_id) for item in named))
+    for item, history in zip(named, histories):
+        item.history = history
+    add_timing("history", start)
+
+    async def rewrite(item: _Item):
+        start = time.perf_counter()
+        try:
+            async with slots:
+                item.standalone_question = await get_standalone_question(item.question, item.history, model)
+        except Exception as e:
+            logger.error(f"Error rewriting batch question: {str(e)}", exc_info=True)
+            item.error = str(e)
+        item.timings_ms["rewrite"] = _elapsed_ms(start)
+
+    start = time.perf_counter()
+    with span("contextualize"):
+        await asyncio.gather(*(rewrite(item) for item in items))
+    add_timing("rewrite", start)
+
+    groups: Dict[Tuple[str, Optional[str], Optional[str]], _Group] = {}
+    for item in items:
+        if item.error:
+            continue
+        group = groups.get(item.key)
+        if group is None:
+            groups[item.key] = _Group(items=[item])
+        else:
+            item.deduplicated = True
+            group.items.append(item)
+    unique = list(groups.values())
+
+    # One embedding request for every distinct question
+    start = time.perf_counter()
+    corpus_version = await semantic_cache.refresh_corpus_version() if semantic_cache.enabled else None
+    try:
+        embeddings = await get_embeddings().aembed_documents([group.lead.standalone_question for group in unique])
+    except Exception as e:
+        logger.error(f"Error embedding batch questions: {str(e)}", exc_info=True)
+        embeddings = [None] * len(unique)
+        for group in unique:
+            group.error = str(e)
+    add_timing("embed", start)
+
+    retriever = get_retriever()
+    fetch_k = CONTEXT_FETCH_K if CONTEXT_ASSEMBLY_ENABLED else RETRIEVAL_K
+    qa_chain = chain_registry.get_qa_chain(model)
+
+    async def answer(group: _Group, embedding: List[float]):
+        if group.error:
+            return
+        group.embedding = embedding
+        lead = group.lead
+        try:
+            if semantic_cache.enabled:
+                cached = semantic_cache.lookup(model, embedding)
+                if cached:
+                    group.answer, group.cached = cached.answer, True
+                    return
+
+            start = time.perf_counter()
+            with span("retrieval"):
+                documents = await retriever.aretrieve(lead.standalone_question, embedding, fetch_k)
+            if CONTEXT_ASSEMBLY_ENABLED:
+                with span("context_assembly"):
+                    documents = assemble_context(documents, model)
+            group.documents = documents
+            group.timings_ms["retrieval"] = _elapsed_ms(start)
+
+            start = time.perf_counter()
+            async with slots:
+                # The generation span and token counts come from the chain's callbacks, as for /chat
+                group.answer = await qa_chain.ainvoke({
+                    "input": lead.question,
+                    "chat_history": lead.history,
+                    "context": group.documents
+                }, config={"callbacks": chain_callbacks(model)})
+            group.timings_ms["generation"] = _elapsed_ms(start)
+
+            if semantic_cache.enabled:
+                semantic_cache.store(model, lead.standalone_question, embedding, group.answer,
+                                     source_metadata(group.documents), sum(group.timings_ms.values()), corpus_version)
+        except Exception as e:
+            logger.error(f"Error answering batch question: {str(e)}", exc_info=True)
+            group.error = str(e)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(answer(group, embedding) for group, embedding in zip(unique, embeddings)))
+    add_timing("answer", start)
+
+    with span("log_write"):
+        for group in unique:
+            for item in group.items:
+                item.answer, item.cached, item.error = group.answer, group.cached, group.error
+                item.timings_ms.update(group.timings_ms)
+                if item.answer is not None:
+                    await application_log_sink.write(item.session_id, item.question, item.answer, model)
+                    conversation_memory.append_turn(item.session_id, item.question, item.answer)
+    return len(unique)
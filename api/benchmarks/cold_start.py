@@ -0,0 +1,110 @@
+"""Measure the cold start of the API module, as on a fresh Lambda container.
+
+Each run imports main in a new interpreter with -X importtime, then reports the
+total import time and the slowest top-level modules. It exits with status 1 if
+any of DEFERRED_MODULES was loaded by the import. With --first-request the
+run also times the lazy client initializations triggered by a first /list-docs
+call (needs credentials for the configured backends).
+
+    cd api
+    python benchmarks/cold_start.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Heavy libraries that must only load when a request first needs them
+DEFERRED_MODULES = ("numpy", "langchain_core", "langchain", "langchain_openai", "langchain_community",
+                    "botocore", "boto3", "pinecone", "openai", "tiktoken", "supabase", "asyncpg")
+
+_FIRST_REQUEST = """
+import asyncio, json, time
+start = time.perf_counter()
+import main
+from startup_utils import startup_profile
+from db_utils import get_all_documents
+import_seconds = time.perf_counter() - start
+start = time.perf_counter()
+try:
+    asyncio.run(get_all_documents())
+except Exception:
+    pass
+print(json.dumps({"import_s": import_seconds, "first_request_s": time.perf_counter() - start,
+                  "startup": startup_profile.report()}))
+"""
+
+
+def _parse_importtime(stderr: str) -> dict:
+    """Return {module: cumulative microseconds} for top-level modules and their direct imports"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth <= 1:
+            modules[name.strip()] = modules.get(name.strip(), 0) + int(cumulative)
+    return modules
+
+
+def _loaded_packages(stderr: str) -> set:
+    """Top-level package of every module the import loaded"""
+    return {line.rsplit("|", 1)[1].strip().split(".")[0] for line in stderr.splitlines()
+            if line.startswith("import time:") and "cumulative" not in line}
+
+
+def run_import(env: dict) -> tuple:
+    """Return ({module: cumulative microseconds}, deferred modules that were loaded)"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            cwd=API_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-2000:])
+    loaded = _loaded_packages(result.stderr)
+    return _parse_importtime(result.stderr), sorted(name for name in DEFERRED_MODULES if name in loaded)
+
+
+def run_first_request(env: dict) -> dict:
+    result = subprocess.run([sys.executable, "-c", _FIRST_REQUEST], cwd=API_DIR, env=env,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-2000:])
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to start")
+    parser.add_argument("--top", type=int, default=10, help="slowest top-level imports to report")
+    parser.add_argument("--first-request", action="store_true", help="also time lazy initialization on first use")
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    runs, eager = [], set()
+    for _ in range(args.runs):
+        modules, loaded = run_import(env)
+        runs.append(modules)
+        eager.update(loaded)
+    totals = [modules["main"] / 1000 for modules in runs]
+    slowest = sorted(((name, us) for name, us in runs[-1].items() if name != "main"),
+                     key=lambda item: item[1], reverse=True)[:args.top]
+    report = {
+        "runs": args.runs,
+        "import_ms_p50": round(statistics.median(totals), 1),
+        "import_ms_max": round(max(totals), 1),
+        "slowest_imports_ms": {name: round(us / 1000, 1) for name, us in slowest},
+        "deferred_modules_loaded": sorted(eager),
+    }
+    if args.first_request:
+        report["first_request"] = run_first_request(env)
+    print(json.dumps(report, indent=2))
+    if eager:
+        print(f"import main loaded modules that should be deferred: {', '.join(sorted(eager))}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
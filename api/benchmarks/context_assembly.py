@@ -0,0 +1,112 @@
+"""Compare prompt context sizes with and without context assembly (context_utils).
+
+Documents are indexed into the local stand-ins (benchmarks/fakes.py), then each
+question is answered from the same retriever twice: the plain top RETRIEVAL_K
+chunks, as without assembly, and assemble_context over the top CONTEXT_FETCH_K
+candidates. Token counts and passage counts are written as JSON, and the run
+exits with status 1 if assembly sends more context tokens on average than the
+plain top-k baseline.
+
+    cd api
+    python benchmarks/context_assembly.py --docs 8 --doc-kb 64 --questions 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Point every backend at local storage before the app reads its configuration
+WORKDIR = tempfile.mkdtemp(prefix="rag-context-")
+os.environ.update({
+    "OPENAI_API_KEY": "benchmark",
+    "METADATA_STORE_BACKEND": "sqlite",
+    "VECTOR_STORE_BACKEND": "local",
+    "LOCAL_VECTOR_DIR": os.path.join(WORKDIR, "vectors"),
+    "SQLITE_DATABASE_PATH": os.path.join(WORKDIR, "metadata.sqlite"),
+    "BM25_INDEX_PATH": os.path.join(WORKDIR, "bm25.json"),
+    "EMBEDDING_CACHE_PATH": os.path.join(WORKDIR, "embedding_cache.sqlite"),
+})
+os.environ.setdefault("PARSER_PROCESSES", "0")
+
+import fakes  # noqa: E402
+
+
+def question(n: int, docs: int) -> str:
+    """The first-turn questions of benchmarks/end_to_end.py"""
+    words = [fakes.WORDS[(n * 7 + i) % len(fakes.WORDS)] for i in range(6)]
+    return f"What does document {n % max(docs, 1)} say about {' '.join(words)}?"
+
+
+async def benchmark(args) -> dict:
+    from context_utils import CONTEXT_FETCH_K, assemble_context
+    from db_utils import insert_document_record
+    from langchain_utils import RETRIEVAL_K, get_retriever
+    from pinecone_utils import embed_query, index_document_to_pinecone
+    from token_utils import count_tokens
+
+    fakes.install(WORKDIR, 0.0, 1e9, 1, 0.0)
+    for n in range(args.docs):
+        path = os.path.join(WORKDIR, f"doc-{n}.docx")
+        with open(path, "wb") as f:
+            f.write(fakes.make_docx(fakes.make_paragraphs(n, args.doc_kb)))
+        file_id = await insert_document_record(f"doc-{n}.docx", f"local://doc-{n}.docx")
+        if not await index_document_to_pinecone(path, file_id):
+            raise RuntimeError(f"Failed to index doc-{n}.docx")
+
+    retriever = get_retriever()
+    baseline, assembled, passages = [], [], []
+    for n in range(args.questions):
+        text = question(n, args.docs)
+        vector = await embed_query(text)
+        candidates = await retriever.aretrieve(text, vector, CONTEXT_FETCH_K)
+        top_k = await retriever.aretrieve(text, vector, RETRIEVAL_K)
+        context = assemble_context(candidates, args.model)
+        baseline.append(sum(count_tokens(doc.page_content) for doc in top_k))
+        assembled.append(sum(count_tokens(doc.page_content) for doc in context))
+        passages.append(len(context))
+
+    return {
+        "config": vars(args),
+        "retrieval_k": RETRIEVAL_K,
+        "context_fetch_k": CONTEXT_FETCH_K,
+        "baseline_tokens_mean": round(statistics.mean(baseline), 1),
+        "assembled_tokens_mean": round(statistics.mean(assembled), 1),
+        "assembled_tokens_max": max(assembled),
+        "assembled_passages_mean": round(statistics.mean(passages), 2),
+        "questions_over_baseline": sum(1 for a, b in zip(assembled, baseline) if a > b),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=8)
+    parser.add_argument("--doc-kb", type=int, default=64, help="approximate size of each document")
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    try:
+        report = asyncio.run(benchmark(args))
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    if report["assembled_tokens_mean"] > report["baseline_tokens_mean"]:
+        print("Context assembly sent more tokens than the plain top-k baseline", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Offline end-to-end benchmark of the API against local stand-ins (benchmarks/fakes.py).
+
+The real app is driven in-process over ASGI: documents are uploaded and indexed,
+listed, chatted against and deleted, with a fake chat model and embedder whose
+latency is configurable. Per-endpoint throughput and p50/p95/p99 latency,
+indexing time and peak RSS are written as JSON for comparison across commits.
+
+    cd api
+    python benchmarks/end_to_end.py --docs 8 --doc-kb 64 --chats 200 --concurrency 16 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Point every backend at local storage before the app reads its configuration
+WORKDIR = tempfile.mkdtemp(prefix="rag-bench-")
+os.environ.update({
+    "OPENAI_API_KEY": "benchmark",
+    "METADATA_STORE_BACKEND": "sqlite",
+    "VECTOR_STORE_BACKEND": "local",
+    "LOCAL_VECTOR_DIR": os.path.join(WORKDIR, "vectors"),
+    "SQLITE_DATABASE_PATH": os.path.join(WORKDIR, "metadata.sqlite"),
+    "BM25_INDEX_PATH": os.path.join(WORKDIR, "bm25.json"),
+    "EMBEDDING_CACHE_PATH": os.path.join(WORKDIR, "embedding_cache.sqlite"),
+})
+os.environ.setdefault("PARSER_PROCESSES", "0")
+
+import httpx  # noqa: E402
+
+import fakes  # noqa: E402
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def summarize(latencies, errors: int, wall_seconds: float) -> dict:
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 1),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1) if latencies else 0.0,
+    }
+
+
+async def run_phase(requests, concurrency: int) -> dict:
+    """Await request factories with bounded concurrency; each returns True on success"""
+    slots = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def timed(request):
+        nonlocal errors
+        async with slots:
+            start = time.perf_counter()
+            ok = await request()
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(request) for request in requests))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def wait_for_jobs(client: httpx.AsyncClient, job_ids, timeout: float) -> dict:
+    deadline = time.perf_counter() + timeout
+    statuses = {}
+    while time.perf_counter() < deadline:
+        for job_id in job_ids:
+            if job_id not in statuses:
+                status = (await client.get(f"/jobs/{job_id}")).json()
+                if status["stage"] in ("completed", "failed"):
+                    statuses[job_id] = status
+        if len(statuses) == len(job_ids):
+            break
+        await asyncio.sleep(0.05)
+    return statuses
+
+
+async def benchmark(args) -> dict:
+    import main
+    from metrics_utils import metrics
+
+    installed = fakes.install(WORKDIR, args.llm_latency, args.tokens_per_second, args.answer_tokens,
+                              args.embed_latency)
+    if not args.semantic_cache:
+        main.semantic_cache.enabled = False
+
+    report = {"config": vars(args)}
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            documents = [fakes.make_docx(fakes.make_paragraphs(n, args.doc_kb)) for n in range(args.docs)]
+            uploads = {}
+
+            def upload(n):
+                async def request():
+                    response = await client.post("/upload-doc", files={
+                        "file": (f"doc-{n}.docx", documents[n],
+                                 "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+                    })
+                    if response.status_code == 202:
+                        uploads[n] = response.json()
+                    return response.status_code == 202
+                return request
+
+            start = time.perf_counter()
+            report["upload"] = await run_phase([upload(n) for n in range(args.docs)], args.concurrency)
+            statuses = await wait_for_jobs(client, [u["job_id"] for u in uploads.values() if u.get("job_id")],
+                                           args.index_timeout)
+            indexing_seconds = time.perf_counter() - start
+            completed = [s for s in statuses.values() if s["stage"] == "completed"]
+            chunks = sum(s["chunks_total"] for s in completed)
+            report["indexing"] = {
+                "documents": len(completed),
+                "failed": len(uploads) - len(completed),
+                "chunks": chunks,
+                "seconds": round(indexing_seconds, 3),
+                "chunks_per_second": round(chunks / indexing_seconds, 1) if indexing_seconds > 0 else 0.0,
+                "peak_rss_increase_mb": max((s.get("peak_rss_increase_mb", 0.0) for s in completed), default=0.0),
+            }
+
+            async def list_docs():
+                return (await client.get("/list-docs")).status_code == 200
+
+            report["list_docs"] = await run_phase([list_docs for _ in range(args.list_requests)], args.concurrency)
+
+            def chat(n):
+                # Consecutive requests share a session, so later turns take the follow-up path
+                session_id = f"session-{n // args.turns}"
+                words = [fakes.WORDS[(n * 7 + i) % len(fakes.WORDS)] for i in range(6)]
+
+                if n % args.turns:
+                    question = f"And what does it say about {' '.join(words)}?"
+                else:
+                    question = f"What does document {n % max(args.docs, 1)} say about {' '.join(words)}?"
+
+                async def request():
+                    response = await client.post("/chat", json={"question": question, "session_id": session_id})
+                    return response.status_code == 200
+                return request
+
+            # Turns of one session run in order; sessions run concurrently
+            sessions = [[chat(n) for n in range(s, min(s + args.turns, args.chats))]
+                        for s in range(0, args.chats, args.turns)]
+
+            def session(turns):
+                async def request():
+                    results = [await turn() for turn in turns]
+                    return all(results)
+                return request
+
+            report["chat"] = await run_phase([chat(n) for n in range(args.chats)] if args.turns == 1
+                                             else [session(turns) for turns in sessions], args.concurrency)
+            if args.turns > 1:
+                report["chat"]["unit"] = f"session of {args.turns} turns"
+
+            def delete(upload_response):
+                async def request():
+                    response = await client.post("/delete-doc", json={"file_id": upload_response["file_id"]})
+                    return response.status_code == 200
+                return request
+
+            report["delete_doc"] = await run_phase([delete(u) for u in uploads.values()], args.concurrency)
+
+    report["embedding_requests"] = installed["embeddings"].requests
+    report["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    report["peak_rss_children_mb"] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+    if args.metrics:
+        report["metrics"] = metrics.render()
+    return report
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=API_DIR,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=4, help="documents to upload and index")
+    parser.add_argument("--doc-kb", type=int, default=32, help="approximate text size of each document")
+    parser.add_argument("--chats", type=int, default=100, help="/chat requests")
+    parser.add_argument("--turns", type=int, default=1, help="chat turns per session (>1 exercises follow-ups)")
+    parser.add_argument("--list-requests", type=int, default=50, help="/list-docs requests")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight per phase")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds before the fake model answers")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="fake model output rate")
+    parser.add_argument("--answer-tokens", type=int, default=50, help="tokens per fake answer")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="seconds per fake embedding request")
+    parser.add_argument("--semantic-cache", action="store_true", help="leave the semantic answer cache on")
+    parser.add_argument("--index-timeout", type=float, default=300.0, help="seconds to wait for indexing jobs")
+    parser.add_argument("--metrics", action="store_true", help="include the /metrics exposition in the output")
+    parser.add_argument("--output", help="write the JSON report to this file as well as stdout")
+    args = parser.parse_args()
+
+    try:
+        report = asyncio.run(benchmark(args))
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+    report["commit"] = _git_commit()
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
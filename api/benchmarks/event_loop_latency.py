@@ -0,0 +1,83 @@
+"""Compare event-loop latency under concurrent chat load while a document is parsed.
+
+Each simulated chat request repeatedly awaits a short sleep and records how late
+the event loop woke it up. Parsing runs either inline on the event loop (the old
+behaviour of load_and_split_document) or in the parser process pool.
+
+    cd api
+    python benchmarks/event_loop_latency.py path/to/large.pdf --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parsing_utils  # noqa: E402
+
+
+async def _chat_load(stop: asyncio.Event, lags: list, interval: float):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append((time.perf_counter() - start - interval) * 1000)
+
+
+async def _parse_inline(file_paths):
+    for file_path in file_paths:
+        parsing_utils._load_and_split(file_path)
+
+
+async def _parse_pool(file_paths):
+    await parsing_utils.split_documents(file_paths)
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+async def run(mode: str, file_paths, concurrency: int, interval: float) -> dict:
+    if mode == "pool":
+        # Warm the pool so process start-up is not counted against parsing
+        await asyncio.get_running_loop().run_in_executor(parsing_utils.get_parser_pool(), int, 0)
+
+    stop = asyncio.Event()
+    lags = []
+    load = [asyncio.create_task(_chat_load(stop, lags, interval)) for _ in range(concurrency)]
+    await asyncio.sleep(interval * 2)
+
+    start = time.perf_counter()
+    await (_parse_pool(file_paths) if mode == "pool" else _parse_inline(file_paths))
+    parse_seconds = time.perf_counter() - start
+
+    stop.set()
+    await asyncio.gather(*load)
+    return {
+        "mode": mode,
+        "files": len(file_paths),
+        "parse_seconds": round(parse_seconds, 3),
+        "lag_p50_ms": round(statistics.median(lags), 2) if lags else 0.0,
+        "lag_p99_ms": round(_percentile(lags, 0.99), 2),
+        "lag_max_ms": round(max(lags), 2) if lags else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="PDF, DOCX or HTML files to parse")
+    parser.add_argument("--concurrency", type=int, default=50, help="simulated concurrent chat requests")
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between event-loop probes")
+    args = parser.parse_args()
+
+    results = [asyncio.run(run(mode, args.files, args.concurrency, args.interval)) for mode in ("inline", "pool")]
+    parsing_utils.shutdown_parser_pool()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
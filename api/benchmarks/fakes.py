@@ -0,0 +1,220 @@
+"""Deterministic local stand-ins for OpenAI, Pinecone, S3 and the metadata store.
+
+They let the benchmarks drive the real FastAPI app offline: the chat model and
+embedder sleep for a configurable latency instead of calling OpenAI, vectors
+live in a LocalVectorBackend, S3 objects in a dict and metadata in SQLite.
+install() swaps them in through the lazy_resource override hooks.
+"""
+import asyncio
+import hashlib
+import io
+import threading
+import time
+import uuid
+import zipfile
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+WORDS = ("latency throughput index vector chunk retrieval answer document model cache "
+         "embedding query session upload storage token batch stream metric worker").split()
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that answers after `latency` seconds, then emits tokens at `tokens_per_second`"""
+
+    latency: float = 0.2
+    tokens_per_second: float = 100.0
+    answer_tokens: int = 50
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _answer(self, messages: List[BaseMessage]) -> List[str]:
+        seed = int(hashlib.sha256(str(messages[-1].content).encode()).hexdigest()[:8], 16)
+        return [WORDS[(seed + i) % len(WORDS)] for i in range(self.answer_tokens)]
+
+    def _message(self, messages: List[BaseMessage], tokens: List[str]) -> AIMessage:
+        input_tokens = sum(len(str(message.content).split()) for message in messages)
+        return AIMessage(content=" ".join(tokens), usage_metadata={
+            "input_tokens": input_tokens,
+            "output_tokens": len(tokens),
+            "total_tokens": input_tokens + len(tokens),
+        })
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        tokens = self._answer(messages)
+        time.sleep(self.latency + len(tokens) / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, tokens))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        tokens = self._answer(messages)
+        await asyncio.sleep(self.latency + len(tokens) / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, tokens))])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        for i, token in enumerate(self._answer(messages)):
+            await asyncio.sleep(1 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token if i == 0 else f" {token}"))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+class HashEmbeddings(Embeddings):
+    """Embeds text as a unit vector seeded by its SHA-256, after `latency` seconds per request"""
+
+    def __init__(self, dimension: Optional[int] = None, latency: float = 0.05):
+        from vectorstore_utils import EMBEDDING_DIMENSION
+        self.dimension = dimension or EMBEDDING_DIMENSION
+        self.latency = latency
+        self.requests = 0
+
+    def _embed(self, text: str) -> List[float]:
+        seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:16], 16)
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.requests += 1
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class _Body:
+    def __init__(self, data: bytes):
+        self._stream = io.BytesIO(data)
+
+    def read(self, size: int = -1) -> bytes:
+        return self._stream.read(size)
+
+    def close(self):
+        pass
+
+
+class LocalS3:
+    """In-memory stand-in for the boto3 S3 client calls S3Client makes"""
+
+    def __init__(self):
+        self.objects: Dict[str, bytes] = {}
+        self._uploads: Dict[str, Dict[int, bytes]] = {}
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes):
+        with self._lock:
+            self.objects[Key] = bytes(Body)
+        return {"ETag": hashlib.md5(Body).hexdigest()}
+
+    def upload_file(self, file_path: str, bucket: str, key: str):
+        with open(file_path, "rb") as f:
+            self.put_object(Bucket=bucket, Key=key, Body=f.read())
+
+    def create_multipart_upload(self, Bucket: str, Key: str):
+        upload_id = str(uuid.uuid4())
+        with self._lock:
+            self._uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body: bytes):
+        with self._lock:
+            self._uploads[UploadId][PartNumber] = bytes(Body)
+        return {"ETag": hashlib.md5(Body).hexdigest()}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: Dict):
+        with self._lock:
+            parts = self._uploads.pop(UploadId)
+            self.objects[Key] = b"".join(parts[part["PartNumber"]] for part in MultipartUpload["Parts"])
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str):
+        with self._lock:
+            self._uploads.pop(UploadId, None)
+
+    def get_object(self, Bucket: str, Key: str):
+        with self._lock:
+            return {"Body": _Body(self.objects[Key])}
+
+    def delete_object(self, Bucket: str, Key: str):
+        with self._lock:
+            self.objects.pop(Key, None)
+
+
+def make_docx(paragraphs: List[str]) -> bytes:
+    """Build a minimal .docx that Docx2txtLoader can read"""
+    body = "".join(f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>" for text in paragraphs)
+    document = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                f"<w:body>{body}</w:body></w:document>")
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml",
+                         '<?xml version="1.0" encoding="UTF-8"?>'
+                         '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                         '<Default Extension="xml" ContentType="application/xml"/></Types>')
+        archive.writestr("word/document.xml", document)
+    return buffer.getvalue()
+
+
+def make_paragraphs(doc_number: int, size_kb: int) -> List[str]:
+    """Deterministic, document-specific text of roughly size_kb kilobytes"""
+    rng = np.random.default_rng(doc_number)
+    paragraphs, size = [], 0
+    while size < size_kb * 1024:
+        words = [WORDS[i] for i in rng.integers(0, len(WORDS), 60)]
+        paragraph = f"Document {doc_number} section {len(paragraphs)}: " + " ".join(words) + "."
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 1
+    return paragraphs
+
+
+def install(workdir: str, llm_latency: float, tokens_per_second: float, answer_tokens: int,
+            embed_latency: float) -> Dict[str, Any]:
+    """Swap the local stand-ins in for every external service; returns them by name"""
+    import os
+    from bm25_utils import BM25Index, get_bm25_index
+    from chunk_store_utils import ChunkStore, get_chunk_store
+    from embedding_cache_utils import EmbeddingCache, get_embedding_cache
+    from langchain_utils import chain_registry, get_retriever
+    from pinecone_utils import get_embeddings
+    from pydantic_models import ModelName
+    from repository_utils import SQLiteRepository, get_repository
+    from s3_utils import S3Client, get_s3_client
+    from vectorstore_utils import LocalVectorBackend, get_vector_store
+
+    fakes = {
+        "embeddings": HashEmbeddings(latency=embed_latency),
+        "s3": LocalS3(),
+        "llm": FakeChatModel(latency=llm_latency, tokens_per_second=tokens_per_second, answer_tokens=answer_tokens),
+    }
+    get_embeddings.override(fakes["embeddings"])
+    get_vector_store.override(LocalVectorBackend(directory=os.path.join(workdir, "vectors")))
+    get_bm25_index.override(BM25Index(path=os.path.join(workdir, "bm25.json")))
+    get_embedding_cache.override(EmbeddingCache(path=os.path.join(workdir, "embedding_cache.sqlite")))
+    get_chunk_store.override(ChunkStore(path=os.path.join(workdir, "chunk_store.sqlite")))
+    get_repository.override(SQLiteRepository(path=os.path.join(workdir, "metadata.sqlite")))
+    get_s3_client.override(S3Client(s3_client=fakes["s3"], bucket_name="benchmark"))
+    get_retriever.reset()
+    for model in ModelName:
+        chain_registry.override_llm(model, fakes["llm"])
+    return fakes
@@ -0,0 +1,126 @@
+"""Compare recall and query latency of the local vector index across dimensions and quantizations.
+
+Vectors are shortened the way text-embedding-3 shortens them (keep the first
+dimensions, renormalize). Recall@k is measured against exact search over the
+full-length vectors. Real embeddings can be read from the embedding cache; otherwise
+clustered synthetic vectors with decaying per-dimension variance stand in for them.
+
+    cd api
+    python benchmarks/vector_quantization.py --embedding-cache /tmp/embedding_cache.db
+    python benchmarks/vector_quantization.py --vectors 50000 --dimensions 1536 512 256
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vectorstore_utils import LocalVectorBackend  # noqa: E402
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def load_cached_embeddings(path: str, limit: int) -> np.ndarray:
+    with sqlite3.connect(path) as conn:
+        rows = conn.execute("SELECT vector FROM embeddings LIMIT ?", (limit,)).fetchall()
+    return _normalize(np.stack([np.frombuffer(row[0], dtype=np.float32) for row in rows]))
+
+
+def synthetic_embeddings(count: int, dimension: int, clusters: int, seed: int = 0) -> np.ndarray:
+    """Clustered vectors whose variance decays with the dimension index, as in Matryoshka embeddings"""
+    rng = np.random.default_rng(seed)
+    decay = (1.0 / np.sqrt(1 + np.arange(dimension) / 64)).astype(np.float32)
+    centers = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, count)] + 0.8 * rng.standard_normal((count, dimension)).astype(np.float32)
+    return _normalize(vectors * decay)
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def run(vectors: np.ndarray, queries: np.ndarray, truth, dimension: int, quantization: str,
+        k: int, rescore_factor: int, workdir: str) -> dict:
+    directory = os.path.join(workdir, f"{dimension}-{quantization}")
+    backend = LocalVectorBackend(directory=directory, dimension=dimension, quantization=quantization,
+                                 rescore_factor=rescore_factor)
+    shortened = _normalize(vectors[:, :dimension])
+    for i in range(0, len(shortened), 5000):
+        backend.upsert([{"id": str(i + n), "values": row, "metadata": {}}
+                        for n, row in enumerate(shortened[i:i + 5000])])
+
+    latencies, recalls = [], []
+    for query, expected in zip(_normalize(queries[:, :dimension]), truth):
+        start = time.perf_counter()
+        matches = backend.query(query, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len({int(match.id) for match in matches} & expected) / k)
+
+    vector_bytes = backend._vectors.dtype.itemsize * dimension
+    scanned_bytes = backend._codes.dtype.itemsize if backend._codes is not None else vector_bytes
+    return {
+        "dimension": dimension,
+        "quantization": quantization,
+        f"recall@{k}": round(statistics.mean(recalls), 4),
+        "p50_ms": round(_percentile(latencies, 0.5), 3),
+        "p95_ms": round(_percentile(latencies, 0.95), 3),
+        "scanned_bytes_per_vector": scanned_bytes,
+        "compression": round(4 * vectors.shape[1] / scanned_bytes, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embedding-cache", help="SQLite embedding cache to read real embeddings from")
+    parser.add_argument("--vectors", type=int, default=20000, help="vectors to index")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--full-dimension", type=int, default=1536, help="dimension of synthetic vectors")
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[1536, 1024, 512, 256])
+    parser.add_argument("--quantizations", nargs="+", default=["none", "int8", "binary"])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    if args.embedding_cache:
+        data = load_cached_embeddings(args.embedding_cache, args.vectors + args.queries)
+    else:
+        data = synthetic_embeddings(args.vectors + args.queries, args.full_dimension, args.clusters)
+    # Queries are held-out vectors; ground truth is exact search at full length
+    vectors, queries = data[args.queries:], data[:args.queries]
+    scores = queries @ vectors.T
+    truth = [set(np.argpartition(-row, args.k - 1)[:args.k].tolist()) for row in scores]
+
+    workdir = tempfile.mkdtemp(prefix="vector_quantization_")
+    try:
+        results = [
+            run(vectors, queries, truth, dimension, quantization, args.k, args.rescore_factor, workdir)
+            for dimension in args.dimensions if dimension <= vectors.shape[1]
+            for quantization in args.quantizations
+        ]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for result in results:
+        print(json.dumps(result))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"vectors": len(vectors), "queries": len(queries), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
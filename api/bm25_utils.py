@@ -0,0 +1,212 @@
+from collections import Counter, defaultdict
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+from startup_utils import lazy_resource
+from vectorstore_utils import VECTOR_STORE_BACKEND
+import threading
+import math
+import json
+import re
+import os
+from dotenv import load_dotenv
+import logging
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# The index lives in local files and process memory, so it is only complete where every
+# upload is indexed by the process that searches it (the local vector backend). Each Lambda
+# container would start from an empty /tmp, so with Pinecone it is opt-in.
+HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "true" if VECTOR_STORE_BACKEND == "local" else "false").lower() == "true"
+BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH", "/tmp/bm25_index.json")
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Metadata fields retrievers attach to documents: dense similarity and BM25 score
+SCORE_FIELDS = ("score", "bm25_score")
+
+# Keeps product codes and identifiers such as "nt-4000" or "v2.1" together
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_PART_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-case word tokens, plus the parts of compound identifiers"""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        parts = _PART_RE.findall(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class BM25Index:
+    """Persisted inverted index with BM25 scoring, updated incrementally per chunk.
+
+    The index is saved as JSON; other workers pick up changes on their next
+    search by checking the file's modification time. Changes made since the
+    last save are kept aside and re-applied on top of a reloaded file, so a
+    reload never drops them and a save merges them into the other workers' changes.
+    """
+
+    def __init__(self, path: str = BM25_INDEX_PATH, k1: float = BM25_K1, b: float = BM25_B):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._mtime = None
+        # doc_id -> (text, metadata), or None for a removal, not yet saved
+        self._pending: Dict[str, Optional[Tuple[str, Dict]]] = {}
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self._mtime = os.path.getmtime(self.path)
+        except Exception as e:
+            logger.error(f"Error loading BM25 index from {self.path}: {str(e)}", exc_info=True)
+            return
+
+        self._reset()
+        for doc_id, doc in data["docs"].items():
+            self._add(doc_id, doc["text"], doc["metadata"], Counter(tokenize(doc["text"])))
+        for doc_id, item in self._pending.items():
+            if item is None:
+                self._remove(doc_id)
+            else:
+                self._add(doc_id, item[0], item[1], Counter(tokenize(item[0])))
+        logger.info(f"Loaded BM25 index with {len(self._docs)} chunks from {self.path}")
+
+    def _reload_if_changed(self):
+        if self.path and os.path.exists(self.path) and os.path.getmtime(self.path) != self._mtime:
+            self._load()
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            self._reload_if_changed()
+            data = {"docs": {doc_id: {"text": doc["text"], "metadata": doc["metadata"]} for doc_id, doc in self._docs.items()}}
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+            self._mtime = os.path.getmtime(self.path)
+            self._pending.clear()
+
+    def _add(self, doc_id: str, text: str, metadata: Dict, terms: Counter):
+        if doc_id in self._docs:
+            self._remove(doc_id)
+        length = sum(terms.values())
+        self._docs[doc_id] = {"text": text, "metadata": metadata, "terms": dict(terms), "length": length}
+        self._total_length += length
+        for term, tf in terms.items():
+            self._postings[term][doc_id] = tf
+
+    def _remove(self, doc_id: str):
+        doc = self._docs.pop(doc_id, None)
+        if doc is None:
+            return
+        self._total_length -= doc["length"]
+        for term in doc["terms"]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def add_documents(self, items: Iterable[Tuple[str, str, Dict]]):
+        """Index (id, text, metadata) chunks, replacing any with the same id"""
+        with self._lock:
+            for doc_id, text, metadata in items:
+                self._add(doc_id, text, metadata, Counter(tokenize(text)))
+                self._pending[doc_id] = (text, metadata)
+
+    def update_metadata(self, updates: Dict[str, Dict]):
+        """Set metadata fields of indexed chunks; the text and its terms are unchanged"""
+        with self._lock:
+            for doc_id, fields in updates.items():
+                doc = self._docs.get(doc_id)
+                if doc is not None:
+                    doc["metadata"] = {**doc["metadata"], **fields}
+                    self._pending[doc_id] = (doc["text"], doc["metadata"])
+
+    def remove_ids(self, doc_ids: Iterable[str]):
+        with self._lock:
+            for doc_id in doc_ids:
+                self._remove(doc_id)
+                self._pending[doc_id] = None
+
+    def search(self, query: str, top_k: int, filter: Optional[Dict] = None) -> List[Tuple[str, float]]:
+        """Return the top_k (id, score) pairs for a query, optionally restricted by exact-match metadata"""
+        with self._lock:
+            self._reload_if_changed()
+            if not self._docs:
+                return []
+            doc_count = len(self._docs)
+            avg_length = self._total_length / doc_count
+            scores: Dict[str, float] = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    length = self._docs[doc_id]["length"]
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_length))
+
+            if filter:
+                scores = {doc_id: score for doc_id, score in scores.items()
+                          if all(self._docs[doc_id]["metadata"].get(key) == value for key, value in filter.items())}
+            return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    def get_documents(self, doc_ids: List[str]) -> List["Document"]:
+        from langchain_core.documents import Document
+        with self._lock:
+            return [
+                Document(id=doc_id, page_content=self._docs[doc_id]["text"], metadata=dict(self._docs[doc_id]["metadata"]))
+                for doc_id in doc_ids if doc_id in self._docs
+            ]
+
+
+def reciprocal_rank_fusion(result_lists: List[List["Document"]], k: int = RRF_K) -> List["Document"]:
+    """Merge ranked document lists by summing 1 / (k + rank) per document id.
+
+    A document found by several lists keeps the best of each retriever score (SCORE_FIELDS).
+    """
+    scores: Dict[str, float] = defaultdict(float)
+    documents: Dict[str, "Document"] = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            key = doc.id or doc.page_content
+            scores[key] += 1.0 / (k + rank + 1)
+            seen = documents.get(key)
+            if seen is None:
+                documents[key] = doc
+                continue
+            best = {field: max(value for value in (seen.metadata.get(field), doc.metadata.get(field)) if value is not None)
+                    for field in SCORE_FIELDS if field in seen.metadata or field in doc.metadata}
+            if any(seen.metadata.get(field) != value for field, value in best.items()):
+                documents[key] = seen.model_copy(update={"metadata": {**seen.metadata, **best}})
+    return [documents[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+@lazy_resource("bm25_index")
+def get_bm25_index() -> BM25Index:
+    return BM25Index()
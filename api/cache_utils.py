@@ -0,0 +1,185 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+import itertools
+import threading
+import time
+import os
+from dotenv import load_dotenv
+import logging
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+# How often the document store is asked whether another worker or container changed the corpus
+SEMANTIC_CACHE_VERSION_CHECK_SECONDS = float(os.getenv("SEMANTIC_CACHE_VERSION_CHECK_SECONDS", "5"))
+
+
+@dataclass
+class CacheEntry:
+    model: str
+    question: str
+    embedding: "np.ndarray"
+    answer: str
+    sources: List[Dict]
+    corpus_version: Tuple[Optional[str], int]
+    compute_ms: float
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class SemanticCache:
+    """LRU/TTL cache of answers keyed by the embedding of the standalone question.
+
+    Entries are only served for the same model and corpus version. The version
+    pairs a fingerprint of the document store, shared by every worker and
+    container and re-read at most every SEMANTIC_CACHE_VERSION_CHECK_SECONDS,
+    with a local counter bumped by this process's own changes; either moving
+    empties the cache.
+    """
+
+    def __init__(self, enabled: bool = SEMANTIC_CACHE_ENABLED, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES, ttl_seconds: float = SEMANTIC_CACHE_TTL_SECONDS,
+                 version_check_seconds: float = SEMANTIC_CACHE_VERSION_CHECK_SECONDS):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version_check_seconds = version_check_seconds
+        self._shared_version: Optional[str] = None
+        self._local_version = 0
+        self._checked_at: Optional[float] = None
+        self._entries: "OrderedDict[int, CacheEntry]" = OrderedDict()
+        self._matrices: Dict[str, tuple] = {}
+        self._keys = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved_ms = 0.0
+
+    @property
+    def corpus_version(self) -> Tuple[Optional[str], int]:
+        return self._shared_version, self._local_version
+
+    async def refresh_corpus_version(self) -> Tuple[Optional[str], int]:
+        """Re-read the shared corpus version if the last check is stale, and return the current version"""
+        from db_utils import get_corpus_version
+
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.version_check_seconds:
+            self._checked_at = now
+            shared = await get_corpus_version()
+            with self._lock:
+                if shared is None:
+                    # The store is unreachable; stop serving answers until it can be checked again
+                    self._checked_at = None
+                    self._entries.clear()
+                    self._matrices.clear()
+                elif shared != self._shared_version:
+                    if self._entries:
+                        logger.info(f"Semantic cache invalidated, the document store changed to {shared}")
+                    self._entries.clear()
+                    self._matrices.clear()
+                self._shared_version = shared
+        return self.corpus_version
+
+    @staticmethod
+    def _normalize(embedding) -> "np.ndarray":
+        import numpy as np
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        expired = [key for key, entry in self._entries.items() if now - entry.created_at > self.ttl_seconds]
+        for key in expired:
+            self._remove(key)
+
+    def _remove(self, key: int):
+        entry = self._entries.pop(key)
+        self._matrices.pop(entry.model, None)
+
+    def _model_matrix(self, model: str):
+        import numpy as np
+        if model not in self._matrices:
+            keys = [key for key, entry in self._entries.items() if entry.model == model]
+            matrix = np.stack([self._entries[key].embedding for key in keys]) if keys else None
+            self._matrices[model] = (keys, matrix)
+        return self._matrices[model]
+
+    def lookup(self, model: str, embedding) -> Optional[CacheEntry]:
+        """Return the most similar cached answer above the threshold, if any"""
+        import numpy as np
+        with self._lock:
+            self._evict_expired()
+            keys, matrix = self._model_matrix(model)
+            if matrix is None:
+                self.misses += 1
+                return None
+
+            scores = matrix @ self._normalize(embedding)
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            key = keys[best]
+            entry = self._entries[key]
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.latency_saved_ms += entry.compute_ms
+            logger.info(f"Semantic cache hit (similarity {scores[best]:.3f}) for question: {entry.question}")
+            return entry
+
+    def store(self, model: str, question: str, embedding, answer: str, sources: List[Dict],
+              compute_ms: float, corpus_version: Tuple[Optional[str], int]):
+        """Cache an answer computed against the given corpus version"""
+        with self._lock:
+            if corpus_version != self.corpus_version or corpus_version[0] is None:
+                # The documents changed while the answer was being generated, or could not be checked
+                return
+            self._entries[next(self._keys)] = CacheEntry(
+                model=model,
+                question=question,
+                embedding=self._normalize(embedding),
+                answer=answer,
+                sources=sources,
+                corpus_version=corpus_version,
+                compute_ms=compute_ms
+            )
+            self._matrices.pop(model, None)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def bump_corpus_version(self):
+        """Invalidate every cached answer after the indexed documents changed"""
+        with self._lock:
+            self._local_version += 1
+            self._entries.clear()
+            self._matrices.clear()
+            # The store has changed too; pick up its new version on the next lookup
+            self._checked_at = None
+            logger.info(f"Semantic cache invalidated, corpus version is now {self.corpus_version}")
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "corpus_version": f"{self._shared_version}/{self._local_version}",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "latency_saved_ms": round(self.latency_saved_ms, 1),
+        }
+
+
+semantic_cache = SemanticCache()
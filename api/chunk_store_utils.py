@@ -0,0 +1,98 @@
+from collections import OrderedDict
+from typing import Dict, Iterable, List
+from startup_utils import lazy_resource
+from vectorstore_utils import VECTOR_STORE_BACKEND
+import threading
+import sqlite3
+import os
+from dotenv import load_dotenv
+import logging
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# "sqlite" keeps chunk text in a side-car store; "vector" keeps it in the vector metadata.
+# /tmp does not outlive a Lambda container, so with Pinecone point CHUNK_STORE_PATH at
+# persistent storage (e.g. EFS) before switching to "sqlite".
+CHUNK_STORE_BACKEND = os.getenv("CHUNK_STORE_BACKEND", "sqlite" if VECTOR_STORE_BACKEND == "local" else "vector")
+CHUNK_STORE_PATH = os.getenv("CHUNK_STORE_PATH", "/tmp/chunk_store.sqlite")
+CHUNK_STORE_CACHE_SIZE = int(os.getenv("CHUNK_STORE_CACHE_SIZE", "2048"))
+CHUNK_TEXT_IN_VECTOR_METADATA = CHUNK_STORE_BACKEND != "sqlite"
+
+
+class ChunkStore:
+    """Chunk text keyed by vector id, so vectors only carry small filterable metadata.
+
+    Texts live in SQLite and are read in one query per retrieval; recently
+    retrieved chunks are kept in an in-process LRU. Methods are synchronous;
+    async callers run them with asyncio.to_thread.
+    """
+
+    def __init__(self, path: str = CHUNK_STORE_PATH, cache_size: int = CHUNK_STORE_CACHE_SIZE):
+        self.path = path
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, text TEXT NOT NULL)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, chunk_id: str, text: str):
+        self._cache[chunk_id] = text
+        self._cache.move_to_end(chunk_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def get_many(self, ids: List[str]) -> Dict[str, str]:
+        found = {}
+        with self._lock:
+            missing = []
+            for chunk_id in dict.fromkeys(ids):
+                if chunk_id in self._cache:
+                    self._cache.move_to_end(chunk_id)
+                    found[chunk_id] = self._cache[chunk_id]
+                else:
+                    missing.append(chunk_id)
+            self.hits += len(found)
+            self.misses += len(missing)
+            for i in range(0, len(missing), 500):
+                part = missing[i:i + 500]
+                placeholders = ", ".join("?" for _ in part)
+                rows = self._conn.execute(f"SELECT id, text FROM chunks WHERE id IN ({placeholders})", part).fetchall()
+                for chunk_id, text in rows:
+                    found[chunk_id] = text
+                    self._remember(chunk_id, text)
+        return found
+
+    def put_many(self, texts: Dict[str, str]):
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO chunks (id, text) VALUES (?, ?)", list(texts.items()))
+            self._conn.commit()
+            for chunk_id in texts:
+                self._cache.pop(chunk_id, None)
+
+    def delete_many(self, ids: Iterable[str]):
+        ids = list(ids)
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in ids])
+            self._conn.commit()
+            for chunk_id in ids:
+                self._cache.pop(chunk_id, None)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": CHUNK_STORE_BACKEND,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "cached_chunks": len(self._cache),
+        }
+
+
+@lazy_resource("chunk_store")
+def get_chunk_store() -> ChunkStore:
+    return ChunkStore()
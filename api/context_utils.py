@@ -0,0 +1,172 @@
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+from bm25_utils import SCORE_FIELDS, tokenize
+from langchain_utils import RETRIEVAL_K
+from parsing_utils import CHUNK_SIZE
+from token_utils import count_tokens
+from metrics_utils import metrics
+from pydantic_models import ModelName
+import os
+from dotenv import load_dotenv
+import logging
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+CONTEXT_ASSEMBLY_ENABLED = os.getenv("CONTEXT_ASSEMBLY_ENABLED", "true").lower() == "true"
+CONTEXT_FETCH_K = int(os.getenv("CONTEXT_FETCH_K", "8"))
+# Passages scoring below this fraction of the best passage's retriever score are left out
+CONTEXT_MIN_RELATIVE_SCORE = float(os.getenv("CONTEXT_MIN_RELATIVE_SCORE", "0.85"))
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+CONTEXT_MAX_SIMILARITY = float(os.getenv("CONTEXT_MAX_SIMILARITY", "0.8"))
+CONTEXT_MIN_OVERLAP = int(os.getenv("CONTEXT_MIN_OVERLAP", "20"))
+CONTEXT_MAX_OVERLAP = int(os.getenv("CONTEXT_MAX_OVERLAP", "400"))
+# About what the top RETRIEVAL_K chunks take without assembly (4 characters per token)
+BASELINE_CONTEXT_TOKENS = RETRIEVAL_K * CHUNK_SIZE // 4
+CONTEXT_TOKEN_BUDGETS: Dict[ModelName, int] = {
+    ModelName.GPT4_O: int(os.getenv("CONTEXT_TOKEN_BUDGET_GPT4O", str(BASELINE_CONTEXT_TOKENS))),
+    ModelName.GPT4_O_MINI: int(os.getenv("CONTEXT_TOKEN_BUDGET_GPT4O_MINI", str(BASELINE_CONTEXT_TOKENS))),
+}
+
+context_tokens = metrics.counter(
+    "context_tokens_total", "Context tokens retrieved as candidates and packed into prompts", ("stage",))
+
+
+def _overlap(left: str, right: str) -> int:
+    """Length of the longest suffix of left that is a prefix of right (at least CONTEXT_MIN_OVERLAP)"""
+    for length in range(min(len(left), len(right), CONTEXT_MAX_OVERLAP), CONTEXT_MIN_OVERLAP - 1, -1):
+        if left.endswith(right[:length]):
+            return length
+    return 0
+
+
+def _join(left: "Document", right: "Document") -> Optional[str]:
+    """Text of two chunks of one page joined without their shared span, or None if they are not adjacent"""
+    left_start, right_start = left.metadata.get("start_index"), right.metadata.get("start_index")
+    if left_start is not None and right_start is not None:
+        shared = left_start + len(left.page_content) - right_start
+        if shared < 0:
+            return None
+        if shared <= len(right.page_content) and left.page_content.endswith(right.page_content[:shared]):
+            return left.page_content + right.page_content[shared:]
+
+    shared = _overlap(left.page_content, right.page_content)
+    if shared:
+        return left.page_content + right.page_content[shared:]
+    left_index, right_index = left.metadata.get("chunk_index"), right.metadata.get("chunk_index")
+    if left_index is not None and right_index == left_index + 1:
+        return left.page_content + "\n" + right.page_content
+    return None
+
+
+def merge_adjacent_chunks(documents: List["Document"]) -> List[Tuple[int, "Document"]]:
+    """Merge retrieved chunks that are neighbours on the same file_id/page, stripping the splitter overlap.
+
+    Returns (best rank among the merged chunks, passage) pairs in rank order.
+    """
+    from langchain_core.documents import Document
+
+    groups: Dict[Tuple, List[Tuple[int, "Document"]]] = {}
+    for rank, doc in enumerate(documents):
+        key = (doc.metadata.get("file_id"), doc.metadata.get("page"))
+        groups.setdefault(key, []).append((rank, doc))
+
+    passages = []
+    for members in groups.values():
+        members.sort(key=lambda item: (item[1].metadata.get("start_index", -1),
+                                       item[1].metadata.get("chunk_index", -1), item[0]))
+        rank, current = members[0]
+        merged = 1
+        for next_rank, doc in members[1:]:
+            text = _join(current, doc)
+            if text is None:
+                passages.append((rank, current))
+                rank, current, merged = next_rank, doc, 1
+                continue
+            merged += 1
+            # A passage scores as its best chunk
+            scores = {field: max(value for value in (current.metadata.get(field), doc.metadata.get(field))
+                                 if value is not None)
+                      for field in SCORE_FIELDS if field in current.metadata or field in doc.metadata}
+            current = Document(id=current.id, page_content=text,
+                               metadata={**current.metadata, **scores, "merged_chunks": merged})
+            rank = min(rank, next_rank)
+        passages.append((rank, current))
+    return sorted(passages, key=lambda item: item[0])
+
+
+def _similarity(left: Set[str], right: Set[str]) -> float:
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+def _relevance(passages: List[Tuple[int, "Document"]]) -> Optional[List[float]]:
+    """Each passage's retriever score relative to the best passage's, on whichever of
+    SCORE_FIELDS rates it higher; None when the retriever attached no scores"""
+    best = {field: max((doc.metadata.get(field) or 0.0 for _, doc in passages), default=0.0) for field in SCORE_FIELDS}
+    if not any(score > 0 for score in best.values()):
+        return None
+    return [
+        max((doc.metadata[field] / best[field] for field in SCORE_FIELDS
+             if doc.metadata.get(field) is not None and best[field] > 0), default=0.0)
+        for _, doc in passages
+    ]
+
+
+def assemble_context(documents: List["Document"], model = ModelName.GPT4_O_MINI,
+                     budget: Optional[int] = None) -> List["Document"]:
+    """Turn a ranked candidate set into the passages to put in the prompt.
+
+    Adjacent chunks are merged, and passages scoring below CONTEXT_MIN_RELATIVE_SCORE
+    of the best one are dropped, so a question with one clearly matching passage
+    gets just that passage. The rest are picked in MMR order (relative score
+    against word-overlap similarity to what is already picked) until the model's
+    token budget is full, skipping near-duplicates of a picked passage. Without
+    retriever scores, rank order stands in for relevance, nothing is cut and at
+    most RETRIEVAL_K passages are picked, as plain retrieval would. The budget
+    never exceeds what the top RETRIEVAL_K candidates take, so assembly never
+    sends more context than plain retrieval.
+    """
+    if not documents:
+        return []
+    tokens = [count_tokens(doc.page_content) for doc in documents]
+    budget = min(budget or CONTEXT_TOKEN_BUDGETS.get(ModelName(model), BASELINE_CONTEXT_TOKENS),
+                 sum(tokens[:RETRIEVAL_K]))
+    passages = merge_adjacent_chunks(documents)
+    relevance, cutoff, limit = _relevance(passages), CONTEXT_MIN_RELATIVE_SCORE, len(passages)
+    if relevance is None:
+        relevance, cutoff = [1.0 - position / len(passages) for position in range(len(passages))], 0.0
+        limit = RETRIEVAL_K
+    candidates = [
+        {"doc": doc, "relevance": score, "terms": set(tokenize(doc.page_content)), "tokens": count_tokens(doc.page_content)}
+        for (_, doc), score in zip(passages, relevance) if score >= cutoff
+    ]
+
+    selected: List[Dict] = []
+    used = 0
+    while candidates and len(selected) < limit:
+        for candidate in candidates:
+            candidate["redundancy"] = max((_similarity(candidate["terms"], s["terms"]) for s in selected), default=0.0)
+        best = max(candidates, key=lambda c: CONTEXT_MMR_LAMBDA * c["relevance"] - (1 - CONTEXT_MMR_LAMBDA) * c["redundancy"])
+        candidates.remove(best)
+        if best["redundancy"] > CONTEXT_MAX_SIMILARITY:
+            continue
+        if used + best["tokens"] > budget:
+            if selected:
+                continue
+            # Always answer from something: trim an oversized first passage to the budget
+            text = best["doc"].page_content[:len(best["doc"].page_content) * budget // best["tokens"]]
+            best["doc"] = best["doc"].model_copy(update={"page_content": text})
+            best["tokens"] = count_tokens(text)
+        selected.append(best)
+        used += best["tokens"]
+
+    retrieved = sum(tokens)
+    context_tokens.inc(retrieved, stage="retrieved")
+    context_tokens.inc(used, stage="assembled")
+    logger.info(f"Assembled {len(selected)} passages ({used} tokens) from {len(documents)} chunks ({retrieved} tokens)")
+    return [candidate["doc"] for candidate in selected]
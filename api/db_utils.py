@@ -1,42 +1,28 @@
-from supabase import create_client, Client
-from datetime import datetime, timezone
-from typing import Dict, List
-import os
-from dotenv import load_dotenv
+from typing import Dict, List, Optional
+from repository_utils import get_repository
+from log_sink_utils import application_log_sink
 import logging
 
 logger = logging.getLogger(__name__)
 
-load_dotenv()
-
-supabase: Client = create_client(
-    os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_KEY")
-)
+# Thin wrappers over the configured metadata repository (repository_utils).
+# They keep the original contract: errors are logged and turned into empty results.
 
 async def get_all_documents() -> List[Dict]:
     try:
         logger.info("Fetching all documents from database")
-        response = supabase.table("document_store").select("*")\
-            .order("upload_timestamp", desc=True)\
-            .execute()
-        logger.info(f"Successfully retrieved {len(response.data)} documents")
-        return response.data
+        documents = await get_repository().get_all_documents()
+        logger.info(f"Successfully retrieved {len(documents)} documents")
+        return documents
     except Exception as e:
         logger.error(f"Error fetching documents: {str(e)}", exc_info=True)
         return []
-    
+
 
 async def insert_application_logs(session_id: str, user_query: str, gpt_response: str, model: str):
     try:
         logger.info(f"Inserting application log for session: {session_id}")
-        supabase.table("application_logs").insert({
-            "session_id": session_id,
-            "user_query": user_query,
-            "gpt_response": gpt_response,
-            "model": model,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }).execute()
+        await get_repository().insert_application_logs(session_id, user_query, gpt_response, model)
         logger.info("Successfully inserted application log")
     except Exception as e:
         logger.error(f"Error inserting application logs: {str(e)}", exc_info=True)
@@ -44,56 +30,125 @@ async def insert_application_logs(session_id: str, user_query: str, gpt_response
 
 async def get_chat_history(session_id: str) -> List[Dict]:
     try:
-        response = supabase.table("application_logs")\
-            .select("user_query, gpt_response")\
-            .eq("session_id", session_id)\
-            .order("created_at")\
-            .execute()
-        
+        rows = await application_log_sink.read_chat_history(session_id, get_repository().get_chat_history)
+
         messages = []
-        for row in response.data:
+        for row in rows:
             messages.extend([
                 {"role": "human", "content": row['user_query']},
                 {"role": "ai", "content": row['gpt_response']}
             ])
         return messages
     except Exception as e:
-        print(f"Error fetching chat history: {e}")
+        logger.error(f"Error fetching chat history: {str(e)}", exc_info=True)
         return []
-    
 
-async def insert_document_record(filename: str, s3_url: str) -> int:
+
+async def count_chat_history(session_id: str) -> Optional[int]:
+    """Number of turns stored for the session, or None if it could not be read"""
+    try:
+        return await application_log_sink.count_chat_history(session_id, get_repository().count_chat_history)
+    except Exception as e:
+        logger.error(f"Error counting chat history: {str(e)}", exc_info=True)
+        return None
+
+
+async def insert_document_record(filename: str, s3_url: str, content_hash: str = None) -> int:
     try:
-        response = supabase.table("document_store").insert({
-            "filename": filename,
-            "s3_url": s3_url,
-            "upload_timestamp": datetime.now(timezone.utc).isoformat()
-        }).execute()
-        return response.data[0]['id']
+        return await get_repository().insert_document_record(filename, s3_url, content_hash)
     except Exception as e:
-        print(f"Error inserting document record: {e}")
+        logger.error(f"Error inserting document record: {str(e)}", exc_info=True)
         return None
-    
+
 
 async def get_document_by_id(file_id: int) -> Dict:
     try:
-        response = supabase.table("document_store")\
-            .select("*")\
-            .eq("id", file_id)\
-            .execute()
-        return response.data[0] if response.data else None
+        return await get_repository().get_document_by_id(file_id)
+    except Exception as e:
+        logger.error(f"Error fetching document by ID: {str(e)}", exc_info=True)
+        return None
+
+
+async def get_document_by_hash(content_hash: str) -> Dict:
+    try:
+        return await get_repository().get_document_by_hash(content_hash)
     except Exception as e:
-        print(f"Error fetching document by ID: {e}")
+        logger.error(f"Error fetching document by hash: {str(e)}", exc_info=True)
         return None
-    
+
+
+async def get_documents_by_ids(file_ids: List[int]) -> List[Dict]:
+    try:
+        return await get_repository().get_documents_by_ids(file_ids)
+    except Exception as e:
+        logger.error(f"Error fetching documents by ID: {str(e)}", exc_info=True)
+        return []
+
+
+async def update_document_chunk_count(file_id: int, chunk_count: int) -> bool:
+    try:
+        await get_repository().update_document_chunk_count(file_id, chunk_count)
+        return True
+    except Exception as e:
+        logger.error(f"Error updating document chunk count: {str(e)}", exc_info=True)
+        return False
+
+
+async def update_document_record(file_id: int, filename: str, s3_url: str, content_hash: str = None) -> bool:
+    try:
+        await get_repository().update_document_record(file_id, filename, s3_url, content_hash)
+        return True
+    except Exception as e:
+        logger.error(f"Error updating document record: {str(e)}", exc_info=True)
+        return False
+
+
+async def get_document_chunk_ids(file_id: int) -> List[str]:
+    try:
+        return await get_repository().get_document_chunk_ids(file_id)
+    except Exception as e:
+        logger.error(f"Error fetching document chunk ids: {str(e)}", exc_info=True)
+        return []
+
+
+async def replace_document_chunk_ids(file_id: int, chunk_ids: List[str]) -> bool:
+    try:
+        await get_repository().replace_document_chunk_ids(file_id, chunk_ids)
+        return True
+    except Exception as e:
+        logger.error(f"Error recording document chunk ids: {str(e)}", exc_info=True)
+        return False
+
 
 async def delete_document_record(file_id: int) -> bool:
     try:
-        supabase.table("document_store")\
-            .delete()\
-            .eq("id", file_id)\
-            .execute()
+        await get_repository().delete_document_record(file_id)
+        return True
+    except Exception as e:
+        logger.error(f"Error deleting document record: {str(e)}", exc_info=True)
+        return False
+
+
+async def get_corpus_version() -> Optional[str]:
+    try:
+        return await get_repository().get_corpus_version()
+    except Exception as e:
+        logger.error(f"Error fetching corpus version: {str(e)}", exc_info=True)
+        return None
+
+
+async def get_session_summary(session_id: str) -> Dict:
+    try:
+        return await get_repository().get_session_summary(session_id)
+    except Exception as e:
+        logger.error(f"Error fetching session summary: {str(e)}", exc_info=True)
+        return None
+
+
+async def upsert_session_summary(session_id: str, summary: str, summarized_turns: int) -> bool:
+    try:
+        await get_repository().upsert_session_summary(session_id, summary, summarized_turns)
         return True
     except Exception as e:
-        print(f"Error deleting document record: {e}")
-        return False
\ No newline at end of file
+        logger.error(f"Error upserting session summary: {str(e)}", exc_info=True)
+        return False
@@ -0,0 +1,78 @@
+from typing import Dict, List
+from startup_utils import lazy_resource
+import threading
+import hashlib
+import sqlite3
+import os
+from dotenv import load_dotenv
+import logging
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "/tmp/embedding_cache.sqlite")
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent chunk-hash -> embedding store, so identical chunk text is only embedded once.
+
+    Keys are the SHA-256 of the chunk text, scoped by embedding model; vectors
+    are stored as float32 blobs in SQLite. Methods are synchronous; async
+    callers run them with asyncio.to_thread.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (model TEXT, hash TEXT, vector BLOB, PRIMARY KEY (model, hash))"
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, List[float]]:
+        import numpy as np
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            for i in range(0, len(unique), 500):
+                part = unique[i:i + 500]
+                placeholders = ", ".join("?" for _ in part)
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})", [model, *part]
+                ).fetchall()
+                for chunk_hash, vector in rows:
+                    found[chunk_hash] = np.frombuffer(vector, dtype=np.float32).tolist()
+        self.hits += sum(1 for h in hashes if h in found)
+        self.misses += sum(1 for h in hashes if h not in found)
+        return found
+
+    def put_many(self, model: str, embeddings: Dict[str, List[float]]):
+        import numpy as np
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(model, chunk_hash, np.asarray(vector, dtype=np.float32).tobytes())
+                 for chunk_hash, vector in embeddings.items()]
+            )
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+@lazy_resource("embedding_cache")
+def get_embedding_cache() -> EmbeddingCache:
+    return EmbeddingCache()
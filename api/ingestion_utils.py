@@ -0,0 +1,383 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+from pydantic_models import JobStage, JobStatus
+from pinecone_utils import index_document_to_pinecone, reindex_document_in_pinecone, delete_doc_from_pinecone
+from db_utils import delete_document_record
+from cache_utils import semantic_cache
+from s3_utils import get_s3_client
+from metrics_utils import current_rss_mb
+import asyncio
+import uuid
+import time
+import os
+from dotenv import load_dotenv
+import logging
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+INGESTION_QUEUE_BACKEND = os.getenv("INGESTION_QUEUE_BACKEND", "memory")
+INGESTION_DRAIN_TIMEOUT = float(os.getenv("INGESTION_DRAIN_TIMEOUT", "25"))
+# On Lambda, Mangum runs the lifespan around every invocation and the container is frozen between
+# them, so an in-process queue has no background to run in: index inside the upload request instead
+INGESTION_INLINE = os.getenv(
+    "INGESTION_INLINE",
+    "true" if os.getenv("AWS_LAMBDA_FUNCTION_NAME") and INGESTION_QUEUE_BACKEND == "memory" else "false"
+).lower() == "true"
+
+
+class JobCancelled(Exception):
+    pass
+
+
+@dataclass
+class IngestionJob:
+    file_id: int
+    filename: str
+    file_path: str
+    s3_key: str
+    job_id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    # Set for replacements of an already indexed document (PUT /update-doc)
+    replace: bool = False
+    s3_url: Optional[str] = None
+    content_hash: Optional[str] = None
+    previous_s3_key: Optional[str] = None
+    stage: JobStage = JobStage.QUEUED
+    chunks_done: int = 0
+    chunks_total: int = 0
+    chunks_embedded: int = 0
+    chunks_reused: int = 0
+    chunks_unchanged: int = 0
+    chunks_removed: int = 0
+    # Process RSS sampled at each progress report; parser processes are not included
+    peak_rss_mb: float = 0.0
+    rss_start_mb: float = 0.0
+    error: Optional[str] = None
+    # Set when the document is deleted mid-job; the next progress report stops the job
+    cancelled: bool = False
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    _started: float = 0.0
+    _finished: float = 0.0
+
+    def update(self, stage: str, chunks_done: int, chunks_total: int, **counts: int):
+        """Progress callback handed to index_document_to_pinecone"""
+        if self.cancelled:
+            raise JobCancelled(f"Document {self.file_id} was deleted while it was being indexed")
+        self.stage = JobStage(stage)
+        self.chunks_done = chunks_done
+        self.chunks_total = chunks_total
+        for name, value in counts.items():
+            setattr(self, name, value)
+        self.sample_memory()
+
+    def sample_memory(self):
+        self.peak_rss_mb = max(self.peak_rss_mb, current_rss_mb())
+
+    def payload(self) -> Dict:
+        return {
+            "job_id": self.job_id,
+            "file_id": self.file_id,
+            "filename": self.filename,
+            "file_path": self.file_path,
+            "s3_key": self.s3_key,
+            "replace": self.replace,
+            "s3_url": self.s3_url,
+            "content_hash": self.content_hash,
+            "previous_s3_key": self.previous_s3_key,
+        }
+
+    def status(self) -> JobStatus:
+        elapsed = (self._finished or time.monotonic()) - self._started if self._started else 0.0
+        return JobStatus(
+            job_id=self.job_id,
+            file_id=self.file_id,
+            filename=self.filename,
+            stage=self.stage,
+            chunks_done=self.chunks_done,
+            chunks_total=self.chunks_total,
+            chunks_embedded=self.chunks_embedded,
+            chunks_reused=self.chunks_reused,
+            chunks_unchanged=self.chunks_unchanged,
+            chunks_removed=self.chunks_removed,
+            chunks_per_second=round(self.chunks_done / elapsed, 2) if elapsed > 0 else 0.0,
+            peak_rss_mb=round(self.peak_rss_mb, 1),
+            peak_rss_increase_mb=round(max(0.0, self.peak_rss_mb - self.rss_start_mb), 1),
+            error=self.error,
+            created_at=self.created_at,
+            started_at=self.started_at,
+            finished_at=self.finished_at
+        )
+
+
+class QueueBackend:
+    """Transport for ingestion job payloads between the API and the workers"""
+
+    async def put(self, payload: Dict):
+        raise NotImplementedError
+
+    async def get(self) -> Dict:
+        raise NotImplementedError
+
+    def task_done(self):
+        pass
+
+    def qsize(self) -> int:
+        return 0
+
+    def drain(self) -> List[Dict]:
+        """Remove and return the payloads that would be lost when the workers stop; external queues keep theirs"""
+        return []
+
+
+class InMemoryQueueBackend(QueueBackend):
+    """In-process queue for local and uvicorn deployments"""
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+
+    @property
+    def queue(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        return self._queue
+
+    async def put(self, payload: Dict):
+        await self.queue.put(payload)
+
+    async def get(self) -> Dict:
+        return await self.queue.get()
+
+    def task_done(self):
+        self.queue.task_done()
+
+    def qsize(self) -> int:
+        return self.queue.qsize()
+
+    def drain(self) -> List[Dict]:
+        payloads = []
+        while self._queue is not None and not self._queue.empty():
+            payloads.append(self._queue.get_nowait())
+            self._queue.task_done()
+        return payloads
+
+
+QUEUE_BACKENDS: Dict[str, Callable[[], QueueBackend]] = {
+    "memory": InMemoryQueueBackend,
+}
+
+
+def register_queue_backend(name: str, factory: Callable[[], QueueBackend]):
+    """Make a queue backend (e.g. SQS or Redis) selectable via INGESTION_QUEUE_BACKEND"""
+    QUEUE_BACKENDS[name] = factory
+
+
+class IngestionWorkerPool:
+    """Runs parse -> split -> embed -> upsert jobs with bounded concurrency.
+
+    With inline, no workers are started and submit() runs the job to completion
+    before returning.
+    """
+
+    def __init__(self, backend: QueueBackend, num_workers: int = INGESTION_WORKERS, inline: bool = INGESTION_INLINE):
+        self.backend = backend
+        self.num_workers = max(1, num_workers)
+        self.inline = inline
+        self._jobs: Dict[str, IngestionJob] = {}
+        self._workers = []
+
+    @property
+    def running(self) -> bool:
+        return any(not worker.done() for worker in self._workers)
+
+    async def start(self):
+        if self.running or self.inline:
+            return
+        logger.info(f"Starting {self.num_workers} ingestion workers")
+        self._workers = [asyncio.create_task(self._worker(n)) for n in range(self.num_workers)]
+
+    async def stop(self, drain_timeout: float = INGESTION_DRAIN_TIMEOUT):
+        """Wait for queued jobs to finish (up to drain_timeout) and stop the workers.
+
+        Jobs still running at the deadline are cancelled, and they and any jobs
+        left in an in-process queue are marked failed and cleaned up like any
+        other failed job, so no partially indexed document is left behind.
+        """
+        if not self._workers:
+            return
+        pending = [job for job in self._jobs.values() if job.stage not in (JobStage.COMPLETED, JobStage.FAILED)]
+        if pending:
+            logger.info(f"Draining {len(pending)} ingestion jobs before shutdown")
+            deadline = time.monotonic() + drain_timeout
+            while time.monotonic() < deadline and any(
+                    job.stage not in (JobStage.COMPLETED, JobStage.FAILED) for job in pending):
+                await asyncio.sleep(0.1)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for payload in self.backend.drain():
+            job = self._jobs.get(payload["job_id"]) or IngestionJob(**payload)
+            self._jobs[job.job_id] = job
+            if job.cancelled:
+                continue
+            await self._abandon(job, "Not started before shutdown")
+
+    async def submit(self, file_id: int, filename: str, file_path: str, s3_key: str, **replacement) -> IngestionJob:
+        """Register a job and enqueue it for the workers, or run it now when inline.
+
+        Replacing an indexed document passes replace=True with the new s3_url,
+        content_hash and the previous_s3_key to remove once it is re-indexed.
+        """
+        job = IngestionJob(file_id=file_id, filename=filename, file_path=file_path, s3_key=s3_key, **replacement)
+        self._jobs[job.job_id] = job
+        if self.inline:
+            logger.info(f"Indexing file_id: {file_id} inline (job {job.job_id})")
+            await self._run(job)
+            return job
+        await self.start()
+        await self.backend.put(job.payload())
+        logger.info(f"Queued ingestion job {job.job_id} for file_id: {file_id}")
+        return job
+
+    def get_job(self, job_id: str) -> Optional[IngestionJob]:
+        return self._jobs.get(job_id)
+
+    async def cancel_jobs(self, file_id: int, timeout: float = INGESTION_DRAIN_TIMEOUT) -> bool:
+        """Stop every unfinished job for a document that is about to be deleted.
+
+        Jobs not yet started are failed at once; running jobs stop at their next
+        progress report and clean up what they upserted. Returns False if a job
+        is still running after timeout seconds, in which case the caller must not
+        delete the document's vectors yet.
+        """
+        jobs = [job for job in self._jobs.values() if job.file_id == file_id and job.finished_at is None]
+        for job in jobs:
+            job.cancelled = True
+            if job.started_at is None:
+                # Still queued: the worker skips it when its payload comes up
+                job.stage = JobStage.FAILED
+                job.error = "Document deleted before indexing started"
+                self._finish(job)
+        deadline = time.monotonic() + timeout
+        # finished_at is only set once a failed job's cleanup is done
+        while any(job.finished_at is None for job in jobs):
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        if jobs:
+            logger.info(f"Stopped {len(jobs)} ingestion jobs for deleted file_id: {file_id}")
+        return True
+
+    def stats(self) -> Dict:
+        stages = {}
+        for job in self._jobs.values():
+            stages[job.stage.value] = stages.get(job.stage.value, 0) + 1
+        return {
+            "workers": 0 if self.inline else self.num_workers,
+            "inline": self.inline,
+            "running": self.running,
+            "queue_depth": self.backend.qsize(),
+            "jobs": stages,
+        }
+
+    async def _worker(self, n: int):
+        while True:
+            payload = await self.backend.get()
+            try:
+                job = self._jobs.get(payload["job_id"])
+                if job is None:
+                    job = IngestionJob(**payload)
+                    self._jobs[job.job_id] = job
+                if not job.cancelled:
+                    await self._run(job)
+            except Exception as e:
+                logger.error(f"Ingestion worker {n} failed on job {payload.get('job_id')}: {str(e)}", exc_info=True)
+            finally:
+                self.backend.task_done()
+
+    async def _run(self, job: IngestionJob):
+        job.started_at = datetime.now(timezone.utc)
+        job._started = time.monotonic()
+        job.rss_start_mb = job.peak_rss_mb = current_rss_mb()
+        logger.info(f"Running ingestion job {job.job_id} for file_id: {job.file_id}")
+        try:
+            if not os.path.exists(job.file_path):
+                # Jobs from an external queue run where the upload was not received
+                await get_s3_client().download_file(job.s3_key, job.file_path)
+            if job.replace:
+                success = await reindex_document_in_pinecone(job.file_path, job.file_id, job.filename, job.s3_url,
+                                                             job.content_hash, progress=job.update)
+            else:
+                success = await index_document_to_pinecone(job.file_path, job.file_id, progress=job.update)
+            semantic_cache.bump_corpus_version()
+            if success:
+                job.stage = JobStage.COMPLETED
+                job.chunks_done = job.chunks_total
+                logger.info(f"Successfully processed document: {job.filename}")
+                if job.replace and job.previous_s3_key:
+                    await get_s3_client().delete_file(job.previous_s3_key)
+            else:
+                job.stage = JobStage.FAILED
+                job.error = "Document deleted while indexing" if job.cancelled else "Failed to index document"
+                await self._cleanup_failed(job)
+        except Exception as e:
+            job.stage = JobStage.FAILED
+            job.error = str(e)
+            logger.error(f"Error indexing document {job.filename}: {str(e)}", exc_info=True)
+            await self._cleanup_failed(job)
+        except asyncio.CancelledError:
+            # Stopped mid-job (e.g. the shutdown drain timed out): remove what was already upserted
+            job.stage = JobStage.FAILED
+            job.error = "Interrupted by shutdown"
+            logger.error(f"Ingestion job {job.job_id} for {job.filename} was interrupted by shutdown")
+            await self._cleanup_failed(job)
+            raise
+        finally:
+            job.sample_memory()
+            logger.info(f"Ingestion job {job.job_id} peak RSS {job.peak_rss_mb:.1f} MB "
+                        f"(+{job.peak_rss_mb - job.rss_start_mb:.1f} MB)")
+            self._finish(job)
+
+    async def _abandon(self, job: IngestionJob, reason: str):
+        """Fail a job that will never run"""
+        job.stage = JobStage.FAILED
+        job.error = reason
+        logger.error(f"Ingestion job {job.job_id} for {job.filename} failed: {reason}")
+        await self._cleanup_failed(job)
+        self._finish(job)
+
+    def _finish(self, job: IngestionJob):
+        job.finished_at = datetime.now(timezone.utc)
+        job._finished = time.monotonic()
+        if os.path.exists(job.file_path):
+            try:
+                os.remove(job.file_path)
+                logger.info(f"Cleaned up temporary file: {job.file_path}")
+            except Exception as e:
+                logger.warning(f"Failed to cleanup temporary file: {str(e)}")
+
+    async def _cleanup_failed(self, job: IngestionJob):
+        # If indexing fails, clean up S3 and database
+        logger.error(f"Failed to index document: {job.filename}")
+        if job.replace:
+            # The previous version is still indexed and stays; only drop the new upload
+            try:
+                await get_s3_client().delete_file(job.s3_key)
+            except Exception as e:
+                logger.error(f"Error cleaning up failed re-index job {job.job_id}: {str(e)}", exc_info=True)
+            return
+        try:
+            # Remove any batches that were upserted before the failure
+            await delete_doc_from_pinecone(job.file_id)
+            await get_s3_client().delete_file(job.s3_key)
+            await delete_document_record(job.file_id)
+        except Exception as e:
+            logger.error(f"Error cleaning up failed ingestion job {job.job_id}: {str(e)}", exc_info=True)
+
+
+ingestion_pool = IngestionWorkerPool(QUEUE_BACKENDS[INGESTION_QUEUE_BACKEND]())
@@ -1,22 +1,57 @@
-from langchain_openai import ChatOpenAI
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
 import os
-from pinecone_utils import vectorstore
+from pinecone_utils import get_embeddings
+from vectorstore_utils import get_vector_store
+from chunk_store_utils import CHUNK_TEXT_IN_VECTOR_METADATA, get_chunk_store
+from bm25_utils import HYBRID_SEARCH_ENABLED, get_bm25_index
+from startup_utils import lazy_resource
+from pydantic_models import ModelName
+from metrics_utils import metrics
+from admission_utils import admission_transport
 from dotenv import load_dotenv
-import asyncio
+from collections import Counter, OrderedDict
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+from functools import lru_cache
+import threading
+import hashlib
+import json
+import re
 import logging
 
+if TYPE_CHECKING:
+    from langchain_core.runnables import Runnable
+    from langchain_openai import ChatOpenAI
+
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
 openai_api_key = os.getenv("OPENAI_API_KEY")
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "2"))
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "10"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+REWRITE_SKIP_SELF_CONTAINED = os.getenv("REWRITE_SKIP_SELF_CONTAINED", "true").lower() == "true"
+REWRITE_SKIP_MIN_WORDS = int(os.getenv("REWRITE_SKIP_MIN_WORDS", "5"))
+REWRITE_CACHE_SIZE = int(os.getenv("REWRITE_CACHE_SIZE", "1024"))
+REWRITE_HISTORY_TURNS = int(os.getenv("REWRITE_HISTORY_TURNS", "3"))
+
+query_rewrites = metrics.counter(
+    "query_rewrites_total", "Follow-up questions by how their standalone form was obtained", ("outcome",))
 
-retriever = vectorstore.as_retriever(search_kwargs = {"k": 2})
-output_parser = StrOutputParser()
+@lazy_resource("retriever")
+def get_retriever():
+    chunk_store = None if CHUNK_TEXT_IN_VECTOR_METADATA else get_chunk_store()
+    if HYBRID_SEARCH_ENABLED:
+        from retriever_utils import HybridRetriever
+        return HybridRetriever(
+            dense=get_vector_store().as_retriever(get_embeddings(), k=HYBRID_FETCH_K, chunk_store=chunk_store),
+            sparse=get_bm25_index(),
+            k=RETRIEVAL_K,
+            fetch_k=HYBRID_FETCH_K
+        )
+    return get_vector_store().as_retriever(get_embeddings(), k=RETRIEVAL_K, chunk_store=chunk_store)
 
 contextualize_q_system_prompt = (
     "Given a chat history and the latest user question "
@@ -26,52 +61,246 @@ contextualize_q_system_prompt = (
     "just reformulate it if needed and otherwise return it as is."
 )
 
-contextualize_q_prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system", contextualize_q_system_prompt),
-        MessagesPlaceholder("chat_history"),
-        ("human", "{input}")
-    ]
-)
+# Prompts and parsers are built on first use; langchain_core pulls in langsmith,
+# which would otherwise dominate the cold start of routes that never chat.
+
+@lru_cache(maxsize=1)
+def get_output_parser():
+    from langchain_core.output_parsers import StrOutputParser
+    return StrOutputParser()
+
+@lru_cache(maxsize=1)
+def get_contextualize_q_prompt():
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    return ChatPromptTemplate.from_messages(
+        [
+            ("system", contextualize_q_system_prompt),
+            MessagesPlaceholder("chat_history"),
+            ("human", "{input}")
+        ]
+    )
+
+@lru_cache(maxsize=1)
+def get_qa_prompt():
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    return ChatPromptTemplate.from_messages(
+        [
+            ("system", "You are a helpful AI assistant. Use the following context to answer the user's question."),
+            ("system", "Context: {context}"),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("human", "{input}")
+        ]
+    )
+
+def source_metadata(documents) -> List[Dict]:
+    """Extract the metadata of retrieved documents, without the chunk text"""
+    return [{k: v for k, v in doc.metadata.items() if k != "text"} for doc in documents]
+
+class RAGChainRegistry:
+    """Build the chat model and its chains (question rewrite, answer generation) once per model and share them.
+
+    All chat models, and the embeddings client, share a pooled, keep-alive HTTP
+    client so warm containers and uvicorn workers reuse their connections to OpenAI.
+    """
+
+    CHAIN_KINDS = ("contextualize", "qa")
+
+    def __init__(self):
+        self._llms: Dict[ModelName, "ChatOpenAI"] = {}
+        self._chains: Dict[str, Dict[ModelName, "Runnable"]] = {kind: {} for kind in self.CHAIN_KINDS}
+        self._lock = threading.RLock()
+        self._http_client = None
+        self._http_async_transport = None
+        self.build_counts = {kind: Counter() for kind in self.CHAIN_KINDS}
+        self.hit_counts = {kind: Counter() for kind in self.CHAIN_KINDS}
+
+    def http_clients(self, model: str):
+        """Return (sync client, async client) for calls to a model over the shared connection pool.
+
+        Only the async client goes through the model's admission limiter, which
+        waits on the event loop. The app only makes async calls; the sync client
+        is there for LangChain's sync methods (invoke, embed_query) used outside it.
+        """
+        import httpx
+        with self._lock:
+            if self._http_client is None:
+                limits = httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+                )
+                self._http_client = httpx.Client(limits=limits, timeout=OPENAI_TIMEOUT)
+                self._http_async_transport = httpx.AsyncHTTPTransport(limits=limits)
+        # One async client per model over the shared connection pool, so each model has its own limiter
+        http_async_client = httpx.AsyncClient(
+            transport=admission_transport(model, self._http_async_transport), timeout=OPENAI_TIMEOUT)
+        return self._http_client, http_async_client
+
+    def get_llm(self, model) -> "ChatOpenAI":
+        """Return the shared chat model client for a model, creating it on first use"""
+        model = ModelName(model)
+        llm = self._llms.get(model)
+        if llm is None:
+            with self._lock:
+                llm = self._llms.get(model)
+                if llm is None:
+                    from langchain_openai import ChatOpenAI
+                    http_client, http_async_client = self.http_clients(model.value)
+                    llm = ChatOpenAI(
+                        api_key=openai_api_key,
+                        model=model.value,
+                        http_client=http_client,
+                        http_async_client=http_async_client,
+                    )
+                    self._llms[model] = llm
+        return llm
+
+    def override_llm(self, model, llm):
+        """Use a given chat model for a model name (e.g. a local stand-in), rebuilding its chains"""
+        model = ModelName(model)
+        with self._lock:
+            self._llms[model] = llm
+            for chains in self._chains.values():
+                chains.pop(model, None)
+
+    def _get_chain(self, kind: str, model, build: Callable[[ModelName], "Runnable"]) -> "Runnable":
+        model = ModelName(model)
+        chains = self._chains[kind]
+        chain = chains.get(model)
+        if chain is not None:
+            self.hit_counts[kind][model.value] += 1
+            return chain
+
+        with self._lock:
+            chain = chains.get(model)
+            if chain is None:
+                chain = build(model)
+                chains[model] = chain
+                self.build_counts[kind][model.value] += 1
+            else:
+                self.hit_counts[kind][model.value] += 1
+        return chain
+
+    def get_contextualize_chain(self, model) -> "Runnable":
+        """Return the chain that rewrites a follow-up into a standalone question"""
+        return self._get_chain("contextualize", model,
+                               lambda model: get_contextualize_q_prompt() | self.get_llm(model) | get_output_parser())
+
+    def get_qa_chain(self, model) -> "Runnable":
+        """Return the answer-generation chain; callers retrieve and assemble the context themselves"""
+        def build(model: ModelName) -> "Runnable":
+            from langchain.chains.combine_documents import create_stuff_documents_chain
+            logger.info(f"Initializing QA chain with model: {model.value}")
+            return create_stuff_documents_chain(self.get_llm(model), get_qa_prompt())
+
+        return self._get_chain("qa", model, build)
+
+    def stats(self) -> Dict:
+        return {
+            "models": sorted({model.value for chains in self._chains.values() for model in chains}),
+            "builds": {kind: dict(counts) for kind, counts in self.build_counts.items()},
+            "hits": {kind: dict(counts) for kind, counts in self.hit_counts.items()},
+        }
 
-qa_prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system", "You are a helpful AI assistant. Use the following context to answer the user's question."),
-        ("system", "Context: {context}"),
-        MessagesPlaceholder(variable_name="chat_history"),
-        ("human", "{input}")
-    ]
+
+chain_registry = RAGChainRegistry()
+
+
+# Words and openings that make a question lean on the conversation before it
+_REFERENCE_WORDS = frozenset(
+    "it its it's they them their theirs this that these those he him his she her hers there then "
+    "above previous earlier former latter same also else again more another one ones such".split()
 )
+_FOLLOW_UP_PREFIXES = ("and ", "but ", "or ", "so ", "what about", "how about", "what else", "why not")
 
-async def get_rag_chain(model = "gpt-4o-mini"):
-    """Create and return an async RAG chain"""
-    try:
-        logger.info(f"Initializing RAG chain with model: {model}")
-        llm = ChatOpenAI(
-            api_key=openai_api_key, 
-            model=model,
-        )
-        
-        logger.info("Creating history-aware retriever")
-        history_aware_retriever = await asyncio.get_event_loop().run_in_executor(
-            None,
-            lambda: create_history_aware_retriever(llm, retriever, contextualize_q_prompt)
-        )
 
-        logger.info("Creating QA chain")
-        qa_chain = await asyncio.get_event_loop().run_in_executor(
-            None,
-            lambda: create_stuff_documents_chain(llm, qa_prompt)
-        )
+def is_self_contained(question: str) -> bool:
+    """Cheap check that a question can be understood without the chat history.
 
-        logger.info("Creating final RAG chain")
-        rag_chain = await asyncio.get_event_loop().run_in_executor(
-            None,
-            lambda: create_retrieval_chain(history_aware_retriever, qa_chain)
-        )
-        
-        logger.info("Successfully created RAG chain")
-        return rag_chain
-    except Exception as e:
-        logger.error(f"Error creating RAG chain: {str(e)}", exc_info=True)
-        raise
+    Conservative: short questions, follow-up openings and any pronoun or
+    back-reference send the question to the LLM rewrite.
+    """
+    words = re.findall(r"[a-z']+", question.lower())
+    if len(words) < REWRITE_SKIP_MIN_WORDS or question.lower().lstrip().startswith(_FOLLOW_UP_PREFIXES):
+        return False
+    return not any(word in _REFERENCE_WORDS for word in words)
+
+
+class RewriteCache:
+    """LRU memo of standalone rewrites keyed by (model, digest of the recent history, question).
+
+    Only the last REWRITE_HISTORY_TURNS turns are part of the key, so a repeated
+    follow-up in the same context reuses its rewrite without another LLM call.
+    """
+
+    def __init__(self, max_entries: int = REWRITE_CACHE_SIZE, history_turns: int = REWRITE_HISTORY_TURNS):
+        self.max_entries = max_entries
+        self.history_turns = history_turns
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, model, question: str, chat_history: List[Dict]) -> str:
+        recent = chat_history[-2 * self.history_turns:] if self.history_turns > 0 else []
+        payload = json.dumps([ModelName(model).value, " ".join(question.lower().split()), recent],
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            rewritten = self._entries.get(key)
+            if rewritten is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return rewritten
+
+    def put(self, key: str, rewritten: str):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = rewritten
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+rewrite_cache = RewriteCache()
+
+
+def known_standalone_question(question: str, chat_history: List[Dict], model = ModelName.GPT4_O_MINI) -> Optional[str]:
+    """The standalone form of a question when no LLM call is needed: no history, self-contained or memoized"""
+    if not chat_history:
+        return question
+    if REWRITE_SKIP_SELF_CONTAINED and is_self_contained(question):
+        query_rewrites.inc(outcome="skipped")
+        return question
+    rewritten = rewrite_cache.get(rewrite_cache.key(model, question, chat_history))
+    if rewritten is not None:
+        query_rewrites.inc(outcome="memoized")
+    return rewritten
+
+
+async def get_standalone_question(question: str, chat_history: List[Dict], model = ModelName.GPT4_O_MINI) -> str:
+    """Rewrite a follow-up question so it can be understood without the chat history"""
+    known = known_standalone_question(question, chat_history, model)
+    if known is not None:
+        return known
+    rewritten = await chain_registry.get_contextualize_chain(model).ainvoke({
+        "input": question,
+        "chat_history": chat_history
+    })
+    query_rewrites.inc(outcome="llm")
+    rewrite_cache.put(rewrite_cache.key(model, question, chat_history), rewritten)
+    return rewritten
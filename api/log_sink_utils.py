@@ -0,0 +1,159 @@
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List
+from repository_utils import get_repository
+import asyncio
+import os
+from dotenv import load_dotenv
+import logging
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+LOG_SINK_BATCH_SIZE = int(os.getenv("LOG_SINK_BATCH_SIZE", "50"))
+LOG_SINK_FLUSH_INTERVAL = float(os.getenv("LOG_SINK_FLUSH_INTERVAL", "1.0"))
+LOG_SINK_MAX_ROWS = int(os.getenv("LOG_SINK_MAX_ROWS", "2000"))
+
+
+class ApplicationLogSink:
+    """Write-behind buffer for application_logs rows.
+
+    Chat turns are appended to an in-memory buffer and inserted in bulk once
+    LOG_SINK_BATCH_SIZE rows are waiting or LOG_SINK_FLUSH_INTERVAL seconds have
+    passed. When LOG_SINK_MAX_ROWS rows are buffered, writers wait for a flush.
+    Rows that fail to insert stay buffered for the next flush. Reads of a
+    session with unflushed rows see them (read_chat_history).
+    """
+
+    def __init__(self, batch_size: int = LOG_SINK_BATCH_SIZE, flush_interval: float = LOG_SINK_FLUSH_INTERVAL,
+                 max_rows: int = LOG_SINK_MAX_ROWS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self._buffer: List[Dict] = []
+        self._pending: Dict[str, int] = defaultdict(int)
+        self._flush_lock = None
+        self._flush_loop = None
+        self._flusher: asyncio.Task = None
+        self._flush_tasks = set()
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.flushes = 0
+        self.flush_failures = 0
+        self.backpressure_waits = 0
+
+    @property
+    def _lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._flush_lock is None or self._flush_loop is not loop:
+            self._flush_lock = asyncio.Lock()
+            self._flush_loop = loop
+        return self._flush_lock
+
+    async def start(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        """Stop the periodic flusher and drain the buffer"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        await self.flush()
+        if self._buffer:
+            logger.error(f"{len(self._buffer)} application log rows were not persisted at shutdown")
+
+    async def write(self, session_id: str, user_query: str, gpt_response: str, model: str):
+        """Buffer one chat turn; only waits when the buffer is full"""
+        if len(self._buffer) >= self.max_rows:
+            self.backpressure_waits += 1
+            await self.flush()
+            if len(self._buffer) >= self.max_rows:
+                dropped = self._buffer.pop(0)
+                self._pending[dropped["session_id"]] -= 1
+                self.rows_dropped += 1
+                logger.error(f"Application log buffer full, dropped a row for session {dropped['session_id']}")
+
+        self._buffer.append({
+            "session_id": session_id,
+            "user_query": user_query,
+            "gpt_response": gpt_response,
+            "model": model,
+            "created_at": datetime.now(timezone.utc)
+        })
+        self._pending[session_id] += 1
+        if len(self._buffer) >= self.batch_size and not self._lock.locked():
+            task = asyncio.create_task(self.flush())
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+
+    async def flush(self):
+        async with self._lock:
+            await self._flush()
+
+    async def _flush(self):
+        if not self._buffer:
+            return
+        rows, self._buffer = self._buffer, []
+        try:
+            await get_repository().insert_application_logs_batch(rows)
+        except Exception as e:
+            self.flush_failures += 1
+            logger.error(f"Error flushing {len(rows)} application log rows: {str(e)}", exc_info=True)
+            self._buffer = rows + self._buffer
+            return
+        for row in rows:
+            self._pending[row["session_id"]] -= 1
+            if self._pending[row["session_id"]] <= 0:
+                del self._pending[row["session_id"]]
+        self.flushes += 1
+        self.rows_written += len(rows)
+        logger.info(f"Flushed {len(rows)} application log rows")
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error in application log flusher: {str(e)}", exc_info=True)
+
+    async def read_chat_history(self, session_id: str, read: Callable[[str], Awaitable[List[Dict]]]) -> List[Dict]:
+        """Read a session's log rows, including rows still waiting in the buffer.
+
+        Sessions with buffered rows are flushed first, and the read happens under
+        the flush lock so a row is never missed or seen twice.
+        """
+        if not self._pending.get(session_id):
+            return await read(session_id)
+        async with self._lock:
+            await self._flush()
+            rows = await read(session_id)
+            rows.extend({"user_query": row["user_query"], "gpt_response": row["gpt_response"]}
+                        for row in self._buffer if row["session_id"] == session_id)
+            return rows
+
+    async def count_chat_history(self, session_id: str, count: Callable[[str], Awaitable[int]]) -> int:
+        """Count a session's log rows, including rows still waiting in the buffer"""
+        if not self._pending.get(session_id):
+            return await count(session_id)
+        # Under the flush lock no buffered row is being inserted, so none is counted twice
+        async with self._lock:
+            return await count(session_id) + self._pending.get(session_id, 0)
+
+    def stats(self) -> Dict:
+        return {
+            "buffered_rows": len(self._buffer),
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            "flushes": self.flushes,
+            "avg_rows_per_flush": self.rows_written / self.flushes if self.flushes else 0.0,
+            "flush_failures": self.flush_failures,
+            "backpressure_waits": self.backpressure_waits,
+        }
+
+
+application_log_sink = ApplicationLogSink()
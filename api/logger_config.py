@@ -20,12 +20,14 @@ def setup_logger():
     # Add handler if running in Lambda
     if len(logger.handlers) > 0:
         # AWS Lambda adds a handler by default
-        logger.handlers[0].setFormatter(formatter)
+        handler = logger.handlers[0]
+        handler.setFormatter(formatter)
     else:
         # Running locally
         handler = logging.StreamHandler()
         handler.setFormatter(formatter)
         logger.addHandler(handler)
 
-    logger.addFilter(RequestContextFilter())
+    # Handler-level so records propagated from module loggers get the field too
+    handler.addFilter(RequestContextFilter())
     return logger
\ No newline at end of file
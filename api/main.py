@@ -1,25 +1,107 @@
+from startup_utils import startup_profile
 from fastapi import FastAPI, UploadFile, HTTPException, File
+from typing import AsyncIterator
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.openapi.utils import get_openapi
 import aiofiles
-from pydantic_models import QueryInput, QueryResponse, DocumentInfo, DeleteFileRequest
-from langchain_utils import get_rag_chain
-from s3_utils import S3Client
-from db_utils import insert_application_logs, get_chat_history, insert_document_record, get_all_documents, get_document_by_id, delete_document_record
-from pinecone_utils import index_document_to_pinecone, delete_doc_from_pinecone
+from pydantic_models import QueryInput, QueryResponse, BatchQueryInput, BatchQueryResponse, DocumentInfo, DeleteFileRequest, DeleteFilesRequest, DeleteFileResult, UploadResponse, JobStage, JobStatus
+from langchain_utils import chain_registry, rewrite_cache, source_metadata
+from speculative_utils import SpeculativeRetrieval
+from context_utils import CONTEXT_ASSEMBLY_ENABLED, assemble_context
+from batch_utils import answer_batch, CHAT_BATCH_MAX_ITEMS
+from cache_utils import semantic_cache
+from memory_utils import conversation_memory
+from log_sink_utils import application_log_sink
+from s3_utils import get_s3_client, UploadTooLargeError
+from db_utils import insert_document_record, get_all_documents, get_document_by_id, get_document_by_hash, get_documents_by_ids, delete_document_record
+from pinecone_utils import delete_doc_from_pinecone
+from embedding_cache_utils import get_embedding_cache
+from chunk_store_utils import get_chunk_store
+from ingestion_utils import ingestion_pool
+from parsing_utils import shutdown_parser_pool
+from metrics_utils import metrics, span, chain_callbacks, TracingMiddleware
+from admission_utils import SingleFlight, limiter_stats
 import os
 import uuid
+import asyncio
+import hashlib
+import json
+import time
 from logger_config import setup_logger
 from mangum import Mangum
 from datetime import datetime
+from contextlib import asynccontextmanager
 
 
 # logging.basicConfig(filename="app.log", level=logging.INFO)
 
 logger = setup_logger()
 
-s3_client = S3Client()
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await ingestion_pool.start()
+    await application_log_sink.start()
+    yield
+    await ingestion_pool.stop()
+    await application_log_sink.stop()
+    # Inline ingestion means Lambda, where this runs after every invocation; the container and
+    # its parser pool live on for the next one
+    if not ingestion_pool.inline:
+        shutdown_parser_pool()
+
+
+def _collect_cache_metrics():
+    """Export the counters the caches and background workers already keep"""
+    yield ("cache_lookups_total", "counter", "Cache lookups by cache and result", {
+        (("cache", "semantic"), ("result", "hit")): semantic_cache.hits,
+        (("cache", "semantic"), ("result", "miss")): semantic_cache.misses,
+        (("cache", "conversation_memory"), ("result", "hit")): conversation_memory.cache_hits,
+        (("cache", "conversation_memory"), ("result", "miss")): conversation_memory.cache_misses,
+    })
+    if get_embedding_cache.initialized():
+        cache = get_embedding_cache()
+        yield ("embedding_cache_lookups_total", "counter", "Chunk embedding cache lookups by result", {
+            (("result", "hit"),): cache.hits,
+            (("result", "miss"),): cache.misses,
+        })
+    if get_chunk_store.initialized():
+        store = get_chunk_store()
+        yield ("chunk_store_lookups_total", "counter", "Chunk text lookups by result (hit = in-process LRU)", {
+            (("result", "hit"),): store.hits,
+            (("result", "miss"),): store.misses,
+        })
+    log_stats = application_log_sink.stats()
+    yield ("application_log_rows_total", "counter", "Application log rows by outcome", {
+        (("outcome", "written"),): log_stats["rows_written"],
+        (("outcome", "dropped"),): log_stats["rows_dropped"],
+    })
+    yield ("application_log_buffered_rows", "gauge", "Application log rows waiting to be flushed", {
+        (): log_stats["buffered_rows"],
+    })
+    yield ("ingestion_queue_depth", "gauge", "Ingestion jobs waiting for a worker", {
+        (): ingestion_pool.stats()["queue_depth"],
+    })
+    limiters = limiter_stats()
+    yield ("openai_queue_depth", "gauge", "OpenAI calls waiting for admission by model and priority", {
+        (("model", model), ("priority", priority)): depth
+        for model, stats in limiters.items() for priority, depth in stats["queued"].items()
+    })
+    yield ("openai_in_flight", "gauge", "OpenAI calls in flight by model", {
+        (("model", model),): stats["in_flight"] for model, stats in limiters.items()
+    })
+    yield ("openai_concurrency_limit", "gauge", "Current per-model concurrency limit", {
+        (("model", model),): stats["concurrency_limit"] for model, stats in limiters.items()
+    })
+
+
+metrics.register_collector(_collect_cache_metrics)
+
 
 app = FastAPI(
     title="FastAPI RAG Chatbot",
@@ -27,7 +109,8 @@ app = FastAPI(
     version="2.0",
     docs_url=None,
     redoc_url=None,
-    root_path="/Prod" 
+    root_path="/Prod",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -39,6 +122,7 @@ app.add_middleware(
     expose_headers=["Content-Range", "Range"],
     max_age=600,
 )
+app.add_middleware(TracingMiddleware)
 
 @app.get("/docs", include_in_schema=False)
 async def custom_swagger_ui_html():
@@ -69,28 +153,190 @@ async def hello_world():
     return {"message": "Hello World!!"}
 
 
+@app.get("/stats")
+async def get_stats():
+    return {
+        "rag_chains": chain_registry.stats(),
+        "query_rewrites": rewrite_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "ingestion": ingestion_pool.stats(),
+        "conversation_memory": conversation_memory.stats(),
+        "application_logs": application_log_sink.stats(),
+        "chunk_store": get_chunk_store().stats() if get_chunk_store.initialized() else None,
+        "admission": limiter_stats(),
+        "startup": startup_profile.report(),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text exposition of request, stage, token and cache metrics"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+# Identical questions in flight (same model, question, conversation and corpus version) share one answer
+_chat_answers = SingleFlight("chat_answer")
+
+
+def _answer_key(model: str, question: str, standalone_question: str, chat_history: list, corpus_version) -> tuple:
+    """Coalescing key for a /chat answer. The answer is generated from the raw question and the
+    history as well as the standalone question, so requests only share one when all of them match;
+    first turns of different sessions have no history and still coalesce."""
+    history_digest = hashlib.sha256(json.dumps(chat_history, sort_keys=True).encode("utf-8")).hexdigest() if chat_history else None
+    return (model, " ".join(standalone_question.lower().split()), " ".join(question.lower().split()),
+            history_digest, corpus_version)
+
+
+def _sse_event(event: str, data: dict) -> str:
+    """Format a single Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def _lookup_cached_answer(retrieval: SpeculativeRetrieval, model: str):
+    """Return (query embedding, corpus version, cache entry or None) for the semantic cache"""
+    if not semantic_cache.enabled:
+        return None, None, None
+    corpus_version = await semantic_cache.refresh_corpus_version()
+    query_embedding = await retrieval.embedding()
+    return query_embedding, corpus_version, semantic_cache.lookup(model, query_embedding)
+
+
 @app.post("/chat", response_model=QueryResponse)
 async def chat(query_input: QueryInput):
     session_id = query_input.session_id or str(uuid.uuid4())
-    logger.info(f"Session ID: {session_id}, User Query: {query_input.question}, Model: {query_input.model.value}")
+    model = query_input.model.value
+    logger.info(f"Session ID: {session_id}, User Query: {query_input.question}, Model: {model}")
 
-    chat_history = await get_chat_history(session_id)
-    rag_chain = await get_rag_chain(model=query_input.model.value)
-    result = await rag_chain.ainvoke({
-            "input": query_input.question,
-            "chat_history": chat_history
-        })
-    answer = result["answer"]
+    with span("history"):
+        chat_history = await conversation_memory.get_history(session_id)
+    # Follow-ups are searched with the raw question while the rewrite runs
+    retrieval = SpeculativeRetrieval(query_input.question, chat_history, model)
+    with span("contextualize"):
+        standalone_question = await retrieval.contextualize()
+    with span("cache_lookup"):
+        query_embedding, corpus_version, cached = await _lookup_cached_answer(retrieval, model)
+
+    if cached:
+        retrieval.cancel()
+        answer = cached.answer
+    else:
+        async def generate() -> str:
+            start_time = time.perf_counter()
+            with span("retrieval"):
+                documents = await retrieval.documents()
+            if CONTEXT_ASSEMBLY_ENABLED:
+                with span("context_assembly"):
+                    documents = assemble_context(documents, model)
+            # The generation span comes from the chain's callbacks
+            answer = await chain_registry.get_qa_chain(model).ainvoke({
+                    "input": query_input.question,
+                    "chat_history": chat_history,
+                    "context": documents
+                }, config={"callbacks": chain_callbacks(model)})
+            if semantic_cache.enabled:
+                semantic_cache.store(model, standalone_question, query_embedding, answer, source_metadata(documents),
+                                     (time.perf_counter() - start_time) * 1000, corpus_version)
+            return answer
+
+        key = _answer_key(model, query_input.question, standalone_question, chat_history, semantic_cache.corpus_version)
+        answer = await _chat_answers.do(key, generate)
+        # A request that joined another's answer drops its own speculative search
+        retrieval.cancel()
 
-    await insert_application_logs(session_id, query_input.question, answer, query_input.model.value)
+    with span("log_write"):
+        await application_log_sink.write(session_id, query_input.question, answer, model)
+    conversation_memory.append_turn(session_id, query_input.question, answer)
     logger.info(f"Session ID: {session_id}, AI Response: {answer}")
 
     return QueryResponse(answer=answer, session_id=session_id, model=query_input.model)
 
 
-@app.post("/upload-doc")
-async def upload_and_index_document(file: UploadFile = File(...)):
-    logger.info(f"Starting document upload for file: {file.filename}")
+@app.post("/chat/batch", response_model=BatchQueryResponse)
+async def chat_batch(batch_input: BatchQueryInput):
+    if not batch_input.questions:
+        raise HTTPException(status_code=400, detail="No questions given")
+    if len(batch_input.questions) > CHAT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A batch may contain at most {CHAT_BATCH_MAX_ITEMS} questions")
+    logger.info(f"Batch of {len(batch_input.questions)} questions, Model: {batch_input.model.value}")
+
+    results, unique_questions, timings = await answer_batch(
+        batch_input.questions, batch_input.model.value, batch_input.max_concurrency
+    )
+    return BatchQueryResponse(model=batch_input.model, results=results, unique_questions=unique_questions, timings_ms=timings)
+
+
+@app.post("/chat/stream")
+async def chat_stream(query_input: QueryInput):
+    session_id = query_input.session_id or str(uuid.uuid4())
+    model = query_input.model.value
+    logger.info(f"Session ID: {session_id}, User Query (stream): {query_input.question}, Model: {model}")
+
+    chat_history = await conversation_memory.get_history(session_id)
+
+    async def event_stream():
+        answer_parts = []
+        sources = []
+        retrieval = SpeculativeRetrieval(query_input.question, chat_history, model)
+        try:
+            standalone_question = await retrieval.contextualize()
+            query_embedding, corpus_version, cached = await _lookup_cached_answer(retrieval, model)
+
+            if cached:
+                retrieval.cancel()
+                answer_parts.append(cached.answer)
+                sources = cached.sources
+                yield _sse_event("token", {"content": cached.answer})
+            else:
+                start_time = time.perf_counter()
+                with span("retrieval"):
+                    documents = await retrieval.documents()
+                if CONTEXT_ASSEMBLY_ENABLED:
+                    with span("context_assembly"):
+                        documents = assemble_context(documents, model)
+                sources = source_metadata(documents)
+                async for chunk in chain_registry.get_qa_chain(model).astream({
+                        "input": query_input.question,
+                        "chat_history": chat_history,
+                        "context": documents
+                    }, config={"callbacks": chain_callbacks(model)}):
+                    if chunk:
+                        answer_parts.append(chunk)
+                        yield _sse_event("token", {"content": chunk})
+                if semantic_cache.enabled:
+                    semantic_cache.store(model, standalone_question, query_embedding, "".join(answer_parts), sources,
+                                         (time.perf_counter() - start_time) * 1000, corpus_version)
+        except Exception as e:
+            retrieval.cancel()
+            logger.error(f"Error streaming chat response: {str(e)}", exc_info=True)
+            yield _sse_event("error", {"detail": str(e)})
+            return
+
+        answer = "".join(answer_parts)
+        await application_log_sink.write(session_id, query_input.question, answer, model)
+        conversation_memory.append_turn(session_id, query_input.question, answer)
+        logger.info(f"Session ID: {session_id}, AI Response (stream): {answer}")
+
+        yield _sse_event("end", {"session_id": session_id, "model": model, "sources": sources})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def _tee_upload(file: UploadFile, buffer) -> AsyncIterator[bytes]:
+    """Read an upload in chunks, copying each chunk to a local file for the parser"""
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        await buffer.write(chunk)
+        yield chunk
+
+
+def _check_upload(file: UploadFile) -> str:
+    """Validate an upload's type and declared size, returning its extension"""
     allowed_extensions = [".pdf", ".docx", ".html"]
     file_extension = os.path.splitext(file.filename)[1].lower()
 
@@ -100,56 +346,181 @@ async def upload_and_index_document(file: UploadFile = File(...)):
             status_code=400, 
             detail=f"Unsupported file type. Allowed types are: {', '.join(allowed_extensions)}"
         )
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"File exceeds the {MAX_UPLOAD_BYTES} byte upload limit")
+    return file_extension
+
+
+async def _stream_upload(file: UploadFile, unique_filename: str, temp_file_path: str, keep=None):
+    """Stream the upload to S3 and to a temporary file in one pass; the ingestion worker removes the file once indexed.
+
+    keep is checked with the content hash before the S3 object is written (S3Client.upload_stream).
+    """
+    logger.info(f"Streaming upload to S3 and {temp_file_path}")
+    async with aiofiles.open(temp_file_path, "wb") as buffer:
+        upload = await get_s3_client().upload_stream(_tee_upload(file, buffer), unique_filename, MAX_UPLOAD_BYTES,
+                                                     keep=keep)
+    logger.info(f"Uploaded {upload.size} bytes, sha256 {upload.sha256}")
+    return upload
+
+
+def _job_outcome(job) -> str:
+    return "indexed" if job.stage == JobStage.COMPLETED else "queued for indexing"
+
+
+def _remove_temp_file(temp_file_path: str):
+    if os.path.exists(temp_file_path):
+        try:
+            os.remove(temp_file_path)
+            logger.info(f"Cleaned up temporary file: {temp_file_path}")
+        except Exception as e:
+            logger.warning(f"Failed to cleanup temporary file: {str(e)}")
+
+
+@app.post("/upload-doc", response_model=UploadResponse, status_code=202)
+async def upload_and_index_document(file: UploadFile = File(...)):
+    logger.info(f"Starting document upload for file: {file.filename}")
+    file_extension = _check_upload(file)
     
     # Generate a unique filename to prevent collisions in S3
     unique_filename = f"{uuid.uuid4()}{file_extension}"
     temp_file_path = f"/tmp/{unique_filename}"
+    queued = False
+
+    existing = None
+
+    async def is_new(sha256: str) -> bool:
+        # Runs once the body is hashed, before S3 completes the upload, so a duplicate is never stored
+        nonlocal existing
+        with span("dedup_lookup"):
+            existing = await get_document_by_hash(sha256)
+        return not existing
 
     try:
-        # Save uploaded file temporarily
-        logger.info(f"Saving file temporarily to: {temp_file_path}")
-        async with aiofiles.open(temp_file_path, "wb") as buffer:
-            content = await file.read()
-            await buffer.write(content)
+        with span("s3_upload"):
+            upload = await _stream_upload(file, unique_filename, temp_file_path, keep=is_new)
+        s3_url = upload.url
 
-        logger.info("Uploading file to S3")
-        s3_url = await s3_client.upload_file(temp_file_path, unique_filename)
+        if existing:
+            # Identical content is already stored and indexed; keep the original copy only
+            logger.info(f"Upload of {file.filename} duplicates file_id {existing['id']}, skipping indexing")
+            return UploadResponse(
+                message=f"File {file.filename} is identical to an uploaded document ({existing['filename']}); reusing it.",
+                file_id=existing["id"],
+                s3_url=existing["s3_url"],
+                size_bytes=upload.size,
+                sha256=upload.sha256,
+                duplicate=True,
+                chunks_embedded=0,
+                chunks_reused=existing.get("chunk_count")
+            )
 
         logger.info("Inserting document record to database")
-        file_id = await insert_document_record(file.filename, s3_url)
+        with span("db_insert"):
+            file_id = await insert_document_record(file.filename, s3_url, upload.sha256)
 
         if not file_id:
             # If database insert fails, delete from S3
             logger.error("Failed to insert document record")
-            await s3_client.delete_file(unique_filename)
+            await get_s3_client().delete_file(unique_filename)
             raise HTTPException(status_code=500, detail="Failed to store document metadata")
         
-        logger.info(f"Indexing document to Pinecone with file_id: {file_id}")
-        pinecone_indexing_success = await index_document_to_pinecone(temp_file_path, file_id)
-
-        if pinecone_indexing_success:
-            logger.info(f"Successfully processed document: {file.filename}")
-            return {
-                "message": f"File {file.filename} has been successfully uploaded and indexed.",
-                "file_id": file_id,
-                "s3_url": s3_url
-            }
-        else:
-            # If indexing fails, clean up S3 and database
-            logger.error(f"Failed to index document: {file.filename}")
-            await s3_client.delete_file(unique_filename)
-            await delete_document_record(file_id)
-            raise HTTPException(status_code=500, detail="Failed to index document")
+        logger.info(f"Queueing document for indexing with file_id: {file_id}")
+        with span("enqueue"):
+            job = await ingestion_pool.submit(file_id, file.filename, temp_file_path, unique_filename)
+        queued = True
+        if job.stage == JobStage.FAILED:
+            # Indexed inline and already cleaned up like any failed job
+            raise HTTPException(status_code=500, detail=job.error or "Failed to index document")
+
+        return UploadResponse(
+            message=f"File {file.filename} has been uploaded and {_job_outcome(job)}.",
+            file_id=file_id,
+            s3_url=s3_url,
+            job_id=job.job_id,
+            size_bytes=upload.size,
+            sha256=upload.sha256
+        )
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error uploading and indexing document: {e}")
+        logger.error(f"Error uploading document: {e}")
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        if os.path.exists(temp_file_path):
-            try:
-                os.remove(temp_file_path)
-                logger.info(f"Cleaned up temporary file: {temp_file_path}")
-            except Exception as e:
-                logger.warning(f"Failed to cleanup temporary file: {str(e)}")
+        if not queued:
+            _remove_temp_file(temp_file_path)
+
+
+@app.put("/update-doc/{file_id}", response_model=UploadResponse, status_code=202)
+async def update_document(file_id: int, file: UploadFile = File(...)):
+    """Replace a document with a new version, re-indexing only the chunks that changed"""
+    logger.info(f"Starting document update for file_id {file_id}: {file.filename}")
+    file_extension = _check_upload(file)
+    document = await get_document_by_id(file_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    unique_filename = f"{uuid.uuid4()}{file_extension}"
+    temp_file_path = f"/tmp/{unique_filename}"
+    queued = False
+
+    try:
+        async def is_changed(sha256: str) -> bool:
+            return sha256 != document.get("content_hash")
+
+        upload = await _stream_upload(file, unique_filename, temp_file_path, keep=is_changed)
+
+        if not upload.stored:
+            logger.info(f"Update of file_id {file_id} is identical to the stored version, nothing to re-index")
+            return UploadResponse(
+                message=f"File {file.filename} is identical to the current version of document {file_id}.",
+                file_id=file_id,
+                s3_url=document["s3_url"],
+                size_bytes=upload.size,
+                sha256=upload.sha256,
+                duplicate=True,
+                chunks_embedded=0,
+                chunks_reused=document.get("chunk_count")
+            )
+
+        logger.info(f"Queueing incremental re-index for file_id: {file_id}")
+        job = await ingestion_pool.submit(
+            file_id, file.filename, temp_file_path, unique_filename,
+            replace=True, s3_url=upload.url, content_hash=upload.sha256,
+            previous_s3_key=document["s3_url"].split("/")[-1]
+        )
+        queued = True
+        if job.stage == JobStage.FAILED:
+            raise HTTPException(status_code=500, detail=job.error or "Failed to re-index document")
+
+        return UploadResponse(
+            message=f"File {file.filename} has been uploaded and {_job_outcome(job)} to replace document {file_id}.",
+            file_id=file_id,
+            s3_url=upload.url,
+            job_id=job.job_id,
+            size_bytes=upload.size,
+            sha256=upload.sha256
+        )
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error updating document: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if not queued:
+            _remove_temp_file(temp_file_path)
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job_status(job_id: str):
+    job = ingestion_pool.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.status()
 
 
 @app.get("/list-docs", response_model=list[DocumentInfo])
@@ -161,25 +532,35 @@ async def list_documents():
 async def delete_document(request: DeleteFileRequest):
     try:
         # Get document info from Supabase first
-        document = await get_document_by_id(request.file_id)
+        with span("db_lookup"):
+            document = await get_document_by_id(request.file_id)
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
         
         # Extract S3 key from URL
         s3_key = document["s3_url"].split("/")[-1]
 
+        # An indexing job still running for the document would upsert again after the delete
+        with span("jobs"):
+            if not await ingestion_pool.cancel_jobs(request.file_id):
+                raise HTTPException(status_code=409, detail="Document is still being indexed, try again shortly")
+
         # Delete form Pinecone
-        pinecone_delete_success = await delete_doc_from_pinecone(request.file_id)
+        with span("vectors"):
+            pinecone_delete_success = await delete_doc_from_pinecone(request.file_id, document.get("chunk_count"))
+        semantic_cache.bump_corpus_version()
         if not pinecone_delete_success:
             raise HTTPException(status_code=500, detail="Failed to delete document vectors from Pinecone")
         
         # Delete from S3
-        s3_delete_success = await s3_client.delete_file(s3_key)
+        with span("s3"):
+            s3_delete_success = await get_s3_client().delete_file(s3_key)
         if not s3_delete_success:
             raise HTTPException(status_code=500, detail="Failed to delete document from S3")
         
         # Delete from Supabase
-        db_delete_success = await delete_document_record(request.file_id)
+        with span("db"):
+            db_delete_success = await delete_document_record(request.file_id)
         if not db_delete_success:
             raise HTTPException(status_code=500, detail="Failed to delete document record from database")
         
@@ -191,5 +572,53 @@ async def delete_document(request: DeleteFileRequest):
         logger.error(f"Error in delete_document: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+
+async def _delete_document_everywhere(document: dict) -> DeleteFileResult:
+    """Delete a document's vectors, then its S3 object and database record concurrently.
+
+    The record is the only way to find the vectors again, so nothing else is
+    deleted if the vectors (or an indexing job still writing them) are not.
+    """
+    file_id = document["id"]
+    s3_key = document["s3_url"].split("/")[-1]
+    if not await ingestion_pool.cancel_jobs(file_id):
+        return DeleteFileResult(file_id=file_id, deleted=False, detail="Document is still being indexed")
+    try:
+        vectors_deleted = await delete_doc_from_pinecone(file_id, document.get("chunk_count"))
+    except Exception as e:
+        logger.error(f"Error deleting vectors of document {file_id}: {str(e)}", exc_info=True)
+        vectors_deleted = False
+    if not vectors_deleted:
+        return DeleteFileResult(file_id=file_id, deleted=False, detail="Failed to delete from vector store")
+    results = await asyncio.gather(
+        get_s3_client().delete_file(s3_key),
+        delete_document_record(file_id),
+        return_exceptions=True
+    )
+    failed = [store for store, result in zip(("S3", "database"), results) if result is not True]
+    if failed:
+        logger.error(f"Failed to delete document {file_id} from: {', '.join(failed)}")
+        return DeleteFileResult(file_id=file_id, deleted=False, detail=f"Failed to delete from {', '.join(failed)}")
+    return DeleteFileResult(file_id=file_id, deleted=True)
+
+
+@app.post("/delete-docs", response_model=list[DeleteFileResult])
+async def delete_documents(request: DeleteFilesRequest):
+    try:
+        documents = await get_documents_by_ids(request.file_ids)
+        found = {document["id"]: document for document in documents}
+
+        results = await asyncio.gather(*(_delete_document_everywhere(document) for document in found.values()))
+        semantic_cache.bump_corpus_version()
+
+        missing = [DeleteFileResult(file_id=file_id, deleted=False, detail="Document not found")
+                   for file_id in request.file_ids if file_id not in found]
+        return list(results) + missing
+    except Exception as e:
+        logger.error(f"Error in delete_documents: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
         
-handler = Mangum(app)
\ No newline at end of file
+handler = Mangum(app)
+
+startup_profile.mark_imported()
\ No newline at end of file
@@ -0,0 +1,208 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List
+from functools import lru_cache
+from db_utils import get_chat_history, count_chat_history, get_session_summary, upsert_session_summary
+from langchain_utils import chain_registry, get_output_parser
+from token_utils import count_tokens
+import asyncio
+import threading
+import time
+import os
+from dotenv import load_dotenv
+import logging
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+MEMORY_HISTORY_TOKEN_BUDGET = int(os.getenv("MEMORY_HISTORY_TOKEN_BUDGET", "2000"))
+MEMORY_SESSION_CACHE_SIZE = int(os.getenv("MEMORY_SESSION_CACHE_SIZE", "1024"))
+MEMORY_SESSION_TTL_SECONDS = float(os.getenv("MEMORY_SESSION_TTL_SECONDS", "1800"))
+# Check a cached session's turn count against the store before using it, so turns another
+# worker or Lambda container recorded are not missed. Costs a query per warm turn, so it is off
+# by default; turn it on when one session's turns can reach more than one process
+MEMORY_SESSION_CACHE_VALIDATE = os.getenv("MEMORY_SESSION_CACHE_VALIDATE", "false").lower() == "true"
+MEMORY_SUMMARY_MODEL = os.getenv("MEMORY_SUMMARY_MODEL", "gpt-4o-mini")
+
+@lru_cache(maxsize=1)
+def get_summary_prompt():
+    from langchain_core.prompts import ChatPromptTemplate
+    return ChatPromptTemplate.from_messages(
+        [
+            ("system", "You maintain a concise running summary of a conversation between a user and an AI assistant. "
+                       "Fold the new lines into the existing summary, keeping names, facts, figures and open questions. "
+                       "Return only the updated summary."),
+            ("human", "Existing summary:\n{summary}\n\nNew lines:\n{new_lines}")
+        ]
+    )
+
+
+@dataclass
+class SessionMemory:
+    messages: List[Dict]
+    summary: str = ""
+    summarized_turns: int = 0
+    loaded_at: float = field(default_factory=time.monotonic)
+    # Token count of each message, kept alongside so warm turns never re-tokenize the transcript
+    message_tokens: List[int] = field(default_factory=list)
+    total_tokens: int = 0
+
+    def __post_init__(self):
+        if not self.message_tokens:
+            self.message_tokens = [count_tokens(m["content"]) for m in self.messages]
+            self.total_tokens = sum(self.message_tokens)
+
+    @property
+    def turn_count(self) -> int:
+        return len(self.messages) // 2
+
+    def append(self, role: str, content: str):
+        tokens = count_tokens(content)
+        self.messages.append({"role": role, "content": content})
+        self.message_tokens.append(tokens)
+        self.total_tokens += tokens
+
+
+class ConversationMemory:
+    """Token-budgeted chat history with a rolling summary and an LRU cache of recent sessions.
+
+    The prompt history is the most recent turns that fit MEMORY_HISTORY_TOKEN_BUDGET,
+    preceded by a summary of the older turns. The summary is folded forward
+    incrementally in the background after each turn and stored in
+    session_summaries, so warm turns never re-read or re-summarize the transcript.
+    Turns that left the budget stay in the prompt until a summary covering them
+    has been written. With validate, a cached session is only used while its
+    turn count matches the store's; otherwise it is reloaded.
+    """
+
+    def __init__(self, token_budget: int = MEMORY_HISTORY_TOKEN_BUDGET, cache_size: int = MEMORY_SESSION_CACHE_SIZE,
+                 ttl_seconds: float = MEMORY_SESSION_TTL_SECONDS, validate: bool = MEMORY_SESSION_CACHE_VALIDATE):
+        self.token_budget = token_budget
+        self.cache_size = cache_size
+        self.ttl_seconds = ttl_seconds
+        self.validate = validate
+        self._sessions: "OrderedDict[str, SessionMemory]" = OrderedDict()
+        self._summarizing = set()
+        self._tasks = set()
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.stale_reloads = 0
+        self.full_history_tokens = 0
+        self.prompt_history_tokens = 0
+
+    async def _load(self, session_id: str) -> SessionMemory:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session and time.monotonic() - session.loaded_at > self.ttl_seconds:
+                session = None
+
+        if session and self.validate:
+            stored_turns = await count_chat_history(session_id)
+            # None: the store could not be read, keep what is cached
+            if stored_turns is not None and stored_turns != session.turn_count:
+                logger.info(f"Session ID: {session_id}, cached history is stale "
+                            f"({session.turn_count} turns cached, {stored_turns} stored), reloading")
+                self.stale_reloads += 1
+                session = None
+
+        if session:
+            with self._lock:
+                if session_id in self._sessions:
+                    self._sessions.move_to_end(session_id)
+            self.cache_hits += 1
+            return session
+
+        self.cache_misses += 1
+        messages, summary = await asyncio.gather(get_chat_history(session_id), get_session_summary(session_id))
+        session = SessionMemory(
+            messages=messages,
+            summary=(summary or {}).get("summary") or "",
+            summarized_turns=(summary or {}).get("summarized_turns") or 0
+        )
+        with self._lock:
+            self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.cache_size:
+                self._sessions.popitem(last=False)
+        return session
+
+    def _window_start(self, session: SessionMemory) -> int:
+        """Index of the first turn that fits in the token budget, counting back from the latest"""
+        used = 0
+        start = session.turn_count
+        for turn in range(session.turn_count - 1, -1, -1):
+            tokens = sum(session.message_tokens[2 * turn:2 * turn + 2])
+            if used + tokens > self.token_budget:
+                break
+            used += tokens
+            start = turn
+        return start
+
+    async def get_history(self, session_id: str) -> List[Dict]:
+        """Return the chat history to put in the prompt for the next turn"""
+        session = await self._load(session_id)
+        # Until the summary catches up (still running, or failed), older turns stay verbatim
+        start = min(self._window_start(session), session.summarized_turns)
+        history = list(session.messages[2 * start:])
+        used_tokens = sum(session.message_tokens[2 * start:])
+        if start > 0 and session.summary:
+            summary = {"role": "system", "content": f"Summary of the earlier conversation: {session.summary}"}
+            history.insert(0, summary)
+            used_tokens += count_tokens(summary["content"])
+
+        full_tokens = session.total_tokens
+        self.full_history_tokens += full_tokens
+        self.prompt_history_tokens += used_tokens
+        logger.info(f"Session ID: {session_id}, history tokens: {full_tokens} full transcript, "
+                    f"{used_tokens} in prompt ({session.turn_count - start} of {session.turn_count} turns)")
+        return history
+
+    def append_turn(self, session_id: str, user_query: str, gpt_response: str):
+        """Record a completed turn and fold turns that left the window into the summary"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            session.append("human", user_query)
+            session.append("ai", gpt_response)
+
+        if self._window_start(session) > session.summarized_turns and session_id not in self._summarizing:
+            self._summarizing.add(session_id)
+            task = asyncio.create_task(self._summarize(session_id, session))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _summarize(self, session_id: str, session: SessionMemory):
+        try:
+            end = self._window_start(session)
+            new_lines = "\n".join(
+                f"{'User' if m['role'] == 'human' else 'AI'}: {m['content']}"
+                for m in session.messages[2 * session.summarized_turns:2 * end]
+            )
+            summary = await (get_summary_prompt() | chain_registry.get_llm(MEMORY_SUMMARY_MODEL) | get_output_parser()).ainvoke({
+                "summary": session.summary or "(none)",
+                "new_lines": new_lines
+            })
+            session.summary = summary
+            session.summarized_turns = end
+            await upsert_session_summary(session_id, summary, end)
+            logger.info(f"Session ID: {session_id}, summarized {end} turns")
+        except Exception as e:
+            logger.error(f"Error summarizing session {session_id}: {str(e)}", exc_info=True)
+        finally:
+            self._summarizing.discard(session_id)
+
+    def stats(self) -> Dict:
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "sessions_cached": len(self._sessions),
+            "cache_hit_rate": self.cache_hits / lookups if lookups else 0.0,
+            "stale_reloads": self.stale_reloads,
+            "full_history_tokens": self.full_history_tokens,
+            "prompt_history_tokens": self.prompt_history_tokens,
+        }
+
+
+conversation_memory = ConversationMemory()
@@ -0,0 +1,287 @@
+from collections import defaultdict
+from contextlib import nullcontext
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import bisect
+import sys
+import threading
+import time
+import os
+from dotenv import load_dotenv
+import logging
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Spans recorded during the current request, or None outside a traced request
+_trace: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("trace", default=None)
+
+
+def _format_labels(labelnames: Tuple[str, ...], key: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, key)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, description: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] += amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (plus +Inf), sum, count
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Metrics exposed at /metrics in the Prometheus text format.
+
+    Collectors are called at scrape time and return (name, type, description, {labels: value})
+    for values that other modules already keep, such as cache hit counters.
+    """
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Dict]]]] = []
+
+    def counter(self, name: str, description: str, labelnames: Iterable[str] = ()) -> Counter:
+        metric = Counter(name, description, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, description: str, labelnames: Iterable[str] = ()) -> Histogram:
+        metric = Histogram(name, description, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, Dict]]]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                for name, kind, description, samples in collector():
+                    lines.append(f"# HELP {name} {description}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for labels, value in samples.items():
+                        label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+            except Exception as e:
+                logger.error(f"Error collecting metrics: {str(e)}", exc_info=True)
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+http_request_seconds = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route", "status"))
+stage_seconds = metrics.histogram(
+    "stage_duration_seconds", "Latency of request and ingestion stages", ("stage",))
+llm_tokens = metrics.counter("llm_tokens_total", "Chat model tokens", ("model", "kind"))
+ingested_chunks = metrics.counter(
+    "ingestion_chunks_total", "Chunks processed by ingestion, by how their vector was obtained", ("outcome",))
+
+
+def current_rss_mb() -> float:
+    """Resident set size of this process in MB, or the peak so far where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def record_span(name: str, seconds: float):
+    stage_seconds.observe(seconds, stage=name)
+    trace = _trace.get()
+    if trace is not None:
+        trace.append((name, seconds))
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_span(self.name, time.perf_counter() - self.start)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc_info):
+        return self.__exit__(*exc_info)
+
+
+_NOOP_SPAN = nullcontext()
+
+
+def span(name: str):
+    """Time a stage (``with span("retrieval"):``) into the request's Server-Timing header and the stage histogram"""
+    return _Span(name) if METRICS_ENABLED else _NOOP_SPAN
+
+
+def server_timing(spans: List[Tuple[str, float]], total: float) -> str:
+    durations: Dict[str, float] = {}
+    for name, seconds in spans:
+        durations[name] = durations.get(name, 0.0) + seconds
+    durations["total"] = total
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in durations.items())
+
+
+class TracingMiddleware:
+    """ASGI middleware that collects a request's spans into a Server-Timing header.
+
+    Only spans finished before the response starts make it into the header
+    (streamed responses report their setup); all spans feed the histograms.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        spans: List[Tuple[str, float]] = []
+        token = _trace.set(spans)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(spans, time.perf_counter() - start).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _trace.reset(token)
+            route = scope.get("route")
+            http_request_seconds.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status
+            )
+
+
+@lru_cache(maxsize=1)
+def _span_callback_handler_class():
+    # Built on first use so importing this module does not pull in langchain_core
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class SpanCallbackHandler(BaseCallbackHandler):
+        """LangChain callbacks that time retrieval and generation inside a chain and count LLM tokens"""
+
+        run_inline = True
+
+        def __init__(self, model: str):
+            self.model = model
+            self._starts: Dict = {}
+
+        def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+            self._starts[run_id] = time.perf_counter()
+
+        def on_retriever_end(self, documents, *, run_id, **kwargs):
+            start = self._starts.pop(run_id, None)
+            if start is not None:
+                record_span("retrieval", time.perf_counter() - start)
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+            self._starts[run_id] = time.perf_counter()
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            start = self._starts.pop(run_id, None)
+            if start is not None:
+                record_span("generation", time.perf_counter() - start)
+            for generations in response.generations:
+                for generation in generations:
+                    usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    if usage:
+                        llm_tokens.inc(usage.get("input_tokens", 0), model=self.model, kind="input")
+                        llm_tokens.inc(usage.get("output_tokens", 0), model=self.model, kind="output")
+
+    return SpanCallbackHandler
+
+
+def chain_callbacks(model: str) -> List:
+    """Callbacks to pass in a chain's config; empty when metrics are disabled"""
+    return [_span_callback_handler_class()(model)] if METRICS_ENABLED else []
@@ -0,0 +1,176 @@
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from typing import TYPE_CHECKING, AsyncIterator, Deque, Iterable, Iterator, List
+import multiprocessing
+import threading
+import asyncio
+import os
+from dotenv import load_dotenv
+import logging
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+# This module is imported by parser worker processes, so it must stay free of
+# network clients and other import-time side effects. Loaders and the splitter
+# are imported on first use to keep them off the API cold start.
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+PARSER_PROCESSES = int(os.getenv("PARSER_PROCESSES", str(min(4, os.cpu_count() or 1))))
+PARSER_START_METHOD = os.getenv("PARSER_START_METHOD", "spawn")
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "10"))
+# Page ranges parsed ahead of indexing; bounds the parsed chunks held in memory
+PARSER_PREFETCH = int(os.getenv("PARSER_PREFETCH", str(max(1, PARSER_PROCESSES))))
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+_pool: Executor = None
+_pool_lock = threading.Lock()
+
+
+def get_parser_pool() -> Executor:
+    """Return the shared parser pool, falling back to threads where processes are unavailable"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if PARSER_PROCESSES > 0:
+                    try:
+                        _pool = ProcessPoolExecutor(
+                            max_workers=PARSER_PROCESSES,
+                            mp_context=multiprocessing.get_context(PARSER_START_METHOD)
+                        )
+                        logger.info(f"Started parser process pool with {PARSER_PROCESSES} workers")
+                    except (OSError, NotImplementedError) as e:
+                        # e.g. AWS Lambda has no /dev/shm for multiprocessing semaphores
+                        logger.warning(f"Process pool unavailable ({str(e)}), parsing in threads instead")
+                if _pool is None:
+                    _pool = ThreadPoolExecutor(max_workers=max(1, PARSER_PROCESSES), thread_name_prefix="parser")
+    return _pool
+
+
+def shutdown_parser_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+@lru_cache(maxsize=1)
+def get_text_splitter():
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    # start_index lets context assembly strip the overlap between neighbouring hits
+    return RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=True)
+
+
+def _page_tail(text: str) -> str:
+    """End of a page carried into the next page's first chunk, cut at a word boundary"""
+    if len(text) <= CHUNK_OVERLAP:
+        return text
+    tail = text[-CHUNK_OVERLAP:]
+    space = tail.find(" ")
+    return tail[space + 1:] if 0 <= space < len(tail) - 1 else tail
+
+
+def split_pages(pages: Iterable["Document"], tail: str = "") -> Iterator["Document"]:
+    """Split pages one at a time, starting each page's first chunk with the end of the previous page.
+
+    start_index is the chunk's offset in its page; a chunk that starts in the carried text gets 0.
+    """
+    splitter = get_text_splitter()
+    for page in pages:
+        text = page.page_content
+        if not text.strip():
+            continue
+        prefix = tail + " " if tail else ""
+        for chunk in splitter.create_documents([prefix + text], [page.metadata]):
+            chunk.metadata["start_index"] = max(0, chunk.metadata["start_index"] - len(prefix))
+            yield chunk
+        tail = _page_tail(text)
+
+
+def _get_loader(file_path: str):
+    from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, UnstructuredHTMLLoader
+
+    if file_path.endswith(".pdf"):
+        return PyPDFLoader(file_path)
+    elif file_path.endswith(".docx"):
+        return Docx2txtLoader(file_path)
+    elif file_path.endswith(".html"):
+        return UnstructuredHTMLLoader(file_path)
+    raise ValueError(f"Unsupported file format: {file_path}")
+
+
+def _count_pdf_pages(file_path: str) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(file_path).pages)
+
+
+def _split_pdf_pages(file_path: str, start: int, end: int) -> List["Document"]:
+    """Extract and split pages [start, end) of a PDF page by page (runs in a parser worker)"""
+    from langchain_core.documents import Document
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    # The page before the range supplies the overlap of the range's first chunk
+    tail = _page_tail(reader.pages[start - 1].extract_text()) if start > 0 else ""
+    pages = (
+        Document(page_content=reader.pages[page].extract_text(), metadata={"source": file_path, "page": page})
+        for page in range(start, end)
+    )
+    return list(split_pages(pages, tail))
+
+
+def _load_and_split(file_path: str) -> List["Document"]:
+    """Lazily load and split a whole document (runs in a parser worker)"""
+    return list(split_pages(_get_loader(file_path).lazy_load()))
+
+
+async def iter_split_document(file_path: str) -> AsyncIterator[List["Document"]]:
+    """Yield a document's chunks in order, page range by page range, as parser workers finish them.
+
+    At most PARSER_PREFETCH page ranges are parsed ahead of the consumer, so memory
+    is bounded by the indexing batch size rather than the document size. Only PDFs
+    are read by page: the DOCX and HTML loaders return the whole text as one page,
+    so those documents are parsed and split in one piece and yielded as one batch.
+    """
+    if not file_path.endswith((".pdf", ".docx", ".html")):
+        raise ValueError(f"Unsupported file format: {file_path}")
+
+    loop = asyncio.get_running_loop()
+    pool = get_parser_pool()
+    if not file_path.endswith(".pdf"):
+        # Unbounded: slicing the returned chunks would not reduce what the parse already holds
+        yield await loop.run_in_executor(pool, _load_and_split, file_path)
+        return
+
+    page_count = await loop.run_in_executor(pool, _count_pdf_pages, file_path)
+    pending: Deque[asyncio.Future] = deque()
+    try:
+        for start in range(0, page_count, PDF_PAGES_PER_TASK):
+            pending.append(loop.run_in_executor(
+                pool, _split_pdf_pages, file_path, start, min(start + PDF_PAGES_PER_TASK, page_count)))
+            if len(pending) >= PARSER_PREFETCH:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+async def split_document(file_path: str) -> List["Document"]:
+    """Load and split a document off the event loop"""
+    chunks = []
+    async for batch in iter_split_document(file_path):
+        chunks.extend(batch)
+    return chunks
+
+
+async def split_documents(file_paths: List[str]) -> List[List["Document"]]:
+    """Load and split several documents in parallel"""
+    return list(await asyncio.gather(*(split_document(file_path) for file_path in file_paths)))
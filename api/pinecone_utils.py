@@ -1,130 +1,425 @@
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, UnstructuredHTMLLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_pinecone import PineconeVectorStore
-from langchain_core.documents import Document
-from pinecone import Pinecone, ServerlessSpec
-from typing import List
+from vectorstore_utils import DEFAULT_EMBEDDING_DIMENSION, EMBEDDING_DIMENSION, get_vector_store
+from bm25_utils import HYBRID_SEARCH_ENABLED, get_bm25_index
+from startup_utils import lazy_resource
+from embedding_cache_utils import content_hash, get_embedding_cache
+from chunk_store_utils import CHUNK_TEXT_IN_VECTOR_METADATA, get_chunk_store
+from db_utils import (update_document_chunk_count, update_document_record, get_document_chunk_ids,
+                      replace_document_chunk_ids, get_document_by_id)
+from parsing_utils import iter_split_document, split_document, split_documents
+from token_utils import count_tokens
+from metrics_utils import span, record_span, ingested_chunks
+from admission_utils import SingleFlight, background_calls
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Dict, Iterable, List, Optional, Set, Tuple
 import asyncio
+import random
 import os
 from dotenv import load_dotenv
 import time
 import logging
 
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
-INDEX_NAME = "fastapi-rag-chatbot"
 BATCH_SIZE = 100
+EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", "20000"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+UPSERT_CONCURRENCY = int(os.getenv("UPSERT_CONCURRENCY", "2"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+EMBED_RETRY_BASE_DELAY = float(os.getenv("EMBED_RETRY_BASE_DELAY", "1.0"))
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Chunk metadata that depends on where the chunk sits in the document
+POSITION_FIELDS = ("page", "start_index", "chunk_index")
+# Embedding cache scope: shortened vectors are not interchangeable with full-length ones
+EMBEDDING_CACHE_MODEL = EMBEDDING_MODEL if EMBEDDING_DIMENSION == DEFAULT_EMBEDDING_DIMENSION \
+    else f"{EMBEDDING_MODEL}:{EMBEDDING_DIMENSION}"
 
-pc = Pinecone(api_key=PINECONE_API_KEY)
-
-existing_indexes = [index_info["name"] for index_info in pc.list_indexes()]
-
-if INDEX_NAME not in existing_indexes:
-    pc.create_index(name = INDEX_NAME,
-                    dimension = 1536,
-                    metric = "cosine",
-                    spec = ServerlessSpec(cloud = "aws", region = "us-east-1"))
-    while not pc.describe_index(INDEX_NAME).status["ready"]:
-        time.sleep(1)
-
-index = pc.Index(INDEX_NAME)
+@lazy_resource("embeddings")
+def get_embeddings():
+    from langchain_openai import OpenAIEmbeddings
+    # langchain_utils imports this module, so the shared client registry is imported here
+    from langchain_utils import chain_registry
+    http_client, http_async_client = chain_registry.http_clients(EMBEDDING_MODEL)
+    return OpenAIEmbeddings(model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSION,
+                            http_client=http_client, http_async_client=http_async_client)
 
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+_query_embeddings = SingleFlight("query_embedding")
 
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+async def embed_query(text: str) -> List[float]:
+    """Embed a query, sharing one API call among concurrent requests for the same text"""
+    return await _query_embeddings.do(text, lambda: get_embeddings().aembed_query(text))
 
-vectorstore = PineconeVectorStore(index=index, embedding=embeddings)
-
-async def load_and_split_document(file_path: str) -> List[Document]:
+async def load_and_split_document(file_path: str) -> List["Document"]:
     try:
         logger.info(f"Loading document: {file_path}")
-        if file_path.endswith(".pdf"):
-            loader = PyPDFLoader(file_path)
-        elif file_path.endswith(".docx"):
-            loader = Docx2txtLoader(file_path)
-        elif file_path.endswith(".html"):
-            loader = UnstructuredHTMLLoader(file_path)
-        else:
-            raise ValueError(f"Unsupported file format: {file_path}")
-        
-        # Use synchronous operations
-        documents = loader.load()
-        split_docs = text_splitter.split_documents(documents)
+        # Parsing and splitting run in the parser process pool, off the event loop
+        split_docs = await split_document(file_path)
         logger.info(f"Document split into {len(split_docs)} chunks")
         return split_docs
     except Exception as e:
         logger.error(f"Error loading document: {str(e)}", exc_info=True)
         raise
 
-async def index_document_to_pinecone(file_path: str, file_id: int) -> bool:
+async def load_and_split_documents(file_paths: List[str]) -> List[List["Document"]]:
+    """Load and split several documents in parallel"""
     try:
-        logger.info(f"Starting document indexing for file_id: {file_id}")
-        documents = await load_and_split_document(file_path)
-        logger.info(f"Split document into {len(documents)} chunks")
-        
-        # Process in batches
-        for i in range(0, len(documents), BATCH_SIZE):
-            batch = documents[i:i + BATCH_SIZE]
+        logger.info(f"Loading {len(file_paths)} documents")
+        return await split_documents(file_paths)
+    except Exception as e:
+        logger.error(f"Error loading documents: {str(e)}", exc_info=True)
+        raise
+
+def _is_rate_limit_error(error: Exception) -> bool:
+    try:
+        import openai
+        if isinstance(error, openai.RateLimitError):
+            return True
+    except ImportError:
+        pass
+    return getattr(error, "status_code", None) == 429
+
+async def embed_with_backoff(texts: List[str]) -> List[List[float]]:
+    """Embed texts with the async API, retrying rate-limit errors with jittered exponential backoff"""
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        try:
+            return await get_embeddings().aembed_documents(texts)
+        except Exception as e:
+            if attempt == EMBED_MAX_RETRIES or not _is_rate_limit_error(e):
+                raise
+            delay = EMBED_RETRY_BASE_DELAY * (2 ** attempt) * (0.5 + random.random())
+            logger.warning(f"Embedding rate limited, retrying in {delay:.1f}s (attempt {attempt + 1})")
+            await asyncio.sleep(delay)
+
+async def embed_with_cache(texts: List[str]) -> Tuple[List[List[float]], int]:
+    """Embed texts, reusing cached embeddings of identical chunk text; returns (embeddings, reused count)"""
+    hashes = [content_hash(text) for text in texts]
+    cache = get_embedding_cache()
+    cached = await asyncio.to_thread(cache.get_many, EMBEDDING_CACHE_MODEL, hashes)
+
+    # Embed each distinct missing text once, even if it repeats within the batch
+    missing = {h: text for h, text in zip(hashes, texts) if h not in cached}
+    if missing:
+        embs = await embed_with_backoff(list(missing.values()))
+        fresh = dict(zip(missing.keys(), embs))
+        await asyncio.to_thread(cache.put_many, EMBEDDING_CACHE_MODEL, fresh)
+        cached.update(fresh)
+    return [cached[h] for h in hashes], len(texts) - len(missing)
+
+async def token_batches(chunk_stream: AsyncIterator[List["Document"]]) -> AsyncIterator[List["Document"]]:
+    """Regroup streamed chunks into batches bounded by BATCH_SIZE chunks and EMBED_BATCH_MAX_TOKENS tokens"""
+    batch: List["Document"] = []
+    batch_tokens = 0
+    async for chunks in chunk_stream:
+        for doc in chunks:
+            tokens = count_tokens(doc.page_content)
+            if batch and (len(batch) >= BATCH_SIZE or batch_tokens + tokens > EMBED_BATCH_MAX_TOKENS):
+                yield batch
+                batch, batch_tokens = [], 0
+            batch.append(doc)
+            batch_tokens += tokens
+    if batch:
+        yield batch
+
+async def timed_batches(batches: AsyncIterator[List["Document"]]) -> AsyncIterator[List["Document"]]:
+    """Record the time spent waiting on the parser for each batch as an index_parse span"""
+    start = time.perf_counter()
+    async for batch in batches:
+        record_span("index_parse", time.perf_counter() - start)
+        yield batch
+        start = time.perf_counter()
+
+def chunk_vector_id(file_id: int, text: str) -> str:
+    """Content-based vector id: the same chunk text keeps its id across versions of a document"""
+    return f"{file_id}-{content_hash(text)[:32]}"
+
+class PipelinedIndexer:
+    """Embeds batch N+1 while batch N is being upserted, with bounded requests in flight.
+
+    Chunks whose id is in existing_ids (unchanged since the previous version)
+    or that repeat an earlier chunk of the same document are not upserted again;
+    the position fields of unchanged chunks are collected in kept_positions.
+    """
+
+    def __init__(self, file_id: int, file_path: str, report: Callable[..., None],
+                 existing_ids: Optional[Set[str]] = None):
+        self.file_id = file_id
+        self.file_path = file_path
+        self.report = report
+        self.existing_ids = existing_ids or set()
+        self.chunk_ids: List[str] = []
+        self.new_ids: List[str] = []
+        self.kept_positions: Dict[str, Dict] = {}
+        self.chunks_total = 0
+        self.chunks_done = 0
+        self.chunks_embedded = 0
+        self.chunks_reused = 0
+        self.chunks_unchanged = 0
+        self._seen: Set[str] = set()
+        self._embed_slots = asyncio.Semaphore(EMBED_CONCURRENCY)
+        self._upsert_slots = asyncio.Semaphore(UPSERT_CONCURRENCY)
+        # Bounds the batches held in memory while parsing runs ahead
+        self._inflight = asyncio.Semaphore(EMBED_CONCURRENCY + UPSERT_CONCURRENCY)
+        self._tasks: List[asyncio.Task] = []
+        self._error: Optional[BaseException] = None
+
+    def _report(self, stage: str):
+        self.report(stage, self.chunks_done, self.chunks_total, chunks_embedded=self.chunks_embedded,
+                    chunks_reused=self.chunks_reused, chunks_unchanged=self.chunks_unchanged)
+
+    async def submit(self, batch: List["Document"]):
+        if self._error:
+            raise self._error
+        offset = self.chunks_total
+        self.chunks_total += len(batch)
+
+        changed = []
+        for position, doc in enumerate(batch, start=offset):
+            doc.metadata["chunk_index"] = position
+            vector_id = chunk_vector_id(self.file_id, doc.page_content)
+            if vector_id in self._seen:
+                self.chunks_done += 1
+                continue
+            self._seen.add(vector_id)
+            self.chunk_ids.append(vector_id)
+            if vector_id in self.existing_ids:
+                self.kept_positions[vector_id] = {key: doc.metadata[key] for key in POSITION_FIELDS if key in doc.metadata}
+                self.chunks_unchanged += 1
+                self.chunks_done += 1
+                ingested_chunks.inc(outcome="unchanged")
+            else:
+                changed.append((vector_id, doc))
+        if not changed:
+            self._report("upserting")
+            return
+        self.new_ids.extend(vector_id for vector_id, _ in changed)
+
+        await self._inflight.acquire()
+        self._tasks.append(asyncio.create_task(self._process(changed, offset)))
+
+    async def _process(self, changed: List[Tuple[str, "Document"]], offset: int):
+        try:
+            ids = [vector_id for vector_id, _ in changed]
+            batch = [doc for _, doc in changed]
             texts = [doc.page_content for doc in batch]
-            # Add text content to metadata
             metadatas = [{
-                "file_id": file_id,
-                "text": doc.page_content,  # Add the text content
-                "source": os.path.basename(file_path),  # Add source filename
+                "file_id": self.file_id,
+                "source": os.path.basename(self.file_path),  # Add source filename
                 **doc.metadata
             } for doc in batch]
-            
-            # Generate embeddings
-            logger.info(f"Generating embeddings for batch {i//BATCH_SIZE + 1}")
-            embs = embeddings.embed_documents(texts)
-
-            # Prepare vectors for upsert
-            vectors = []
-            for j, (text, metadata, emb) in enumerate(zip(texts, metadatas, embs)):
-                vectors.append({
-                    'id': f"{file_id}-{i+j}",
-                    'values': emb,
-                    'metadata': metadata
-                })
-            
-            # Upsert to Pinecone
-            logger.info(f"Upserting batch {i//BATCH_SIZE + 1} to Pinecone")
-            index.upsert(vectors=vectors)
-            
-        logger.info(f"Successfully indexed document {file_id}")
+            if CHUNK_TEXT_IN_VECTOR_METADATA:
+                for metadata, text in zip(metadatas, texts):
+                    metadata["text"] = text
+
+            async with self._embed_slots:
+                logger.info(f"Generating embeddings for {len(batch)} new chunks from chunk {offset}")
+                self._report("embedding")
+                # Ingestion embeddings queue behind chat traffic for the same model
+                with span("index_embed"), background_calls():
+                    embs, reused = await embed_with_cache(texts)
+                self.chunks_reused += reused
+                self.chunks_embedded += len(batch) - reused
+                ingested_chunks.inc(reused, outcome="reused")
+                ingested_chunks.inc(len(batch) - reused, outcome="embedded")
+
+            vectors = [{
+                'id': vector_id,
+                'values': emb,
+                'metadata': metadata
+            } for vector_id, metadata, emb in zip(ids, metadatas, embs)]
+
+            async with self._upsert_slots:
+                logger.info(f"Upserting {len(batch)} new chunks from chunk {offset} to the vector store")
+                self._report("upserting")
+                with span("index_upsert"):
+                    if not CHUNK_TEXT_IN_VECTOR_METADATA:
+                        # Texts first, so a vector is never retrievable without its text
+                        await asyncio.to_thread(get_chunk_store().put_many, dict(zip(ids, texts)))
+                    await asyncio.to_thread(get_vector_store().upsert, vectors)
+
+            if HYBRID_SEARCH_ENABLED:
+                await asyncio.to_thread(get_bm25_index().add_documents, [
+                    (vector["id"], text, {k: v for k, v in vector["metadata"].items() if k != "text"})
+                    for vector, text in zip(vectors, texts)
+                ])
+
+            self.chunks_done += len(batch)
+            self._report("upserting")
+        except BaseException as e:
+            self._error = self._error or e
+            raise
+        finally:
+            self._inflight.release()
+
+    async def drain(self):
+        """Wait for every submitted batch, cancelling the rest on the first failure"""
+        try:
+            await asyncio.gather(*self._tasks)
+        except BaseException:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            raise
+
+async def index_document_to_pinecone(file_path: str, file_id: int,
+                                     progress: Optional[Callable[..., None]] = None) -> bool:
+    """Parse, split, embed and upsert a document.
+
+    Progress is reported as (stage, chunks_done, chunks_total, **counts), where counts
+    are chunks_embedded, chunks_reused (embedding taken from the chunk-hash cache)
+    and chunks_unchanged.
+    """
+    report = progress or (lambda stage, done, total, **counts: None)
+    try:
+        logger.info(f"Starting document indexing for file_id: {file_id}")
+        report("parsing", 0, 0)
+        start_time = time.perf_counter()
+
+        # Page ranges stream back from the parser pool, so batches are
+        # embedded and upserted while later pages are still being parsed
+        indexer = PipelinedIndexer(file_id, file_path, report)
+        try:
+            async for batch in timed_batches(token_batches(iter_split_document(file_path))):
+                await indexer.submit(batch)
+        finally:
+            await indexer.drain()
+            if HYBRID_SEARCH_ENABLED:
+                await asyncio.to_thread(get_bm25_index().save)
+
+        if not await replace_document_chunk_ids(file_id, indexer.chunk_ids):
+            raise RuntimeError("Failed to record the document's chunk ids")
+        await update_document_chunk_count(file_id, len(indexer.chunk_ids))
+
+        elapsed = time.perf_counter() - start_time
+        rate = indexer.chunks_done / elapsed if elapsed > 0 else 0.0
+        logger.info(f"Successfully indexed document {file_id}: {indexer.chunks_done} chunks in {elapsed:.2f}s ({rate:.1f} chunks/sec), "
+                    f"{indexer.chunks_embedded} embedded, {indexer.chunks_reused} reused")
         return True
     except Exception as e:
         logger.error(f"Indexing error for file {file_id}: {str(e)}", exc_info=True)
         return False
     
-async def delete_doc_from_pinecone(file_id: int) -> bool:
+def chunk_ids(file_id: int, chunk_count: int) -> List[str]:
+    """Positional vector ids given to a document's chunks before ids were content-based"""
+    return [f"{file_id}-{i}" for i in range(chunk_count)]
+
+async def document_vector_ids(file_id: int, chunk_count: Optional[int] = None) -> List[str]:
+    """Find a document's vector ids without scanning the index where possible.
+
+    Tries the document_chunks registry, then listing the index by the file_id
+    prefix, which finds both content-based and positional ids. The positional
+    ids implied by chunk_count are only used where the index cannot be listed
+    (e.g. Pinecone pod-based indexes).
+    """
+    vector_ids = await get_document_chunk_ids(file_id)
+    if not vector_ids:
+        try:
+            vector_ids = await asyncio.to_thread(get_vector_store().list_ids, f"{file_id}-")
+        except Exception as e:
+            if chunk_count is None:
+                raise
+            logger.warning(f"Could not list vector ids of file {file_id} ({str(e)}), "
+                           f"using the positional ids of its {chunk_count} chunks")
+            vector_ids = chunk_ids(file_id, chunk_count)
+    return vector_ids
+
+async def _delete_vectors(vector_ids: Iterable[str]):
+    vector_ids = list(vector_ids)
+    await asyncio.to_thread(get_vector_store().delete, vector_ids)
+    if not CHUNK_TEXT_IN_VECTOR_METADATA:
+        await asyncio.to_thread(get_chunk_store().delete_many, vector_ids)
+    if HYBRID_SEARCH_ENABLED:
+        await asyncio.to_thread(get_bm25_index().remove_ids, vector_ids)
+        await asyncio.to_thread(get_bm25_index().save)
+
+async def reindex_document_in_pinecone(file_path: str, file_id: int, filename: str, s3_url: str, file_hash: str,
+                                       progress: Optional[Callable[..., None]] = None) -> bool:
+    """Replace an indexed document with a new version, touching only the chunks that changed.
+
+    The new version is split and each chunk is given its content-based id; chunks
+    already indexed under that id are kept, new ones are embedded and upserted,
+    and ids that no longer occur are deleted once the new version is complete.
+    Kept chunks whose page or offsets moved get a metadata-only update. On
+    failure the new chunks are removed and the previous version's chunks stay
+    indexed, though kept chunks may already carry their new positions.
+    """
+    report = progress or (lambda stage, done, total, **counts: None)
+    indexer = None
+    try:
+        logger.info(f"Starting incremental re-index for file_id: {file_id}")
+        report("parsing", 0, 0)
+        start_time = time.perf_counter()
+        # A document indexed with no chunks has no ids to find, even where the index cannot be listed
+        document = await get_document_by_id(file_id)
+        old_ids = set(await document_vector_ids(file_id, (document or {}).get("chunk_count")))
+
+        indexer = PipelinedIndexer(file_id, file_path, report, existing_ids=old_ids)
+        try:
+            async for batch in timed_batches(token_batches(iter_split_document(file_path))):
+                await indexer.submit(batch)
+        finally:
+            await indexer.drain()
+
+        # Text inserted earlier in the document shifts the pages and offsets of kept chunks
+        moved = 0
+        if indexer.kept_positions:
+            moved = await asyncio.to_thread(get_vector_store().update_metadata, indexer.kept_positions)
+            if HYBRID_SEARCH_ENABLED:
+                await asyncio.to_thread(get_bm25_index().update_metadata, indexer.kept_positions)
+
+        removed = old_ids - set(indexer.chunk_ids)
+        if removed:
+            await _delete_vectors(removed)
+        elif HYBRID_SEARCH_ENABLED:
+            await asyncio.to_thread(get_bm25_index().save)
+
+        if not await replace_document_chunk_ids(file_id, indexer.chunk_ids):
+            raise RuntimeError("Failed to record the document's chunk ids")
+        await update_document_chunk_count(file_id, len(indexer.chunk_ids))
+        await update_document_record(file_id, filename, s3_url, file_hash)
+        report("upserting", indexer.chunks_done, indexer.chunks_total, chunks_embedded=indexer.chunks_embedded,
+               chunks_reused=indexer.chunks_reused, chunks_unchanged=indexer.chunks_unchanged, chunks_removed=len(removed))
+
+        elapsed = time.perf_counter() - start_time
+        logger.info(f"Re-indexed document {file_id} in {elapsed:.2f}s: {indexer.chunks_unchanged} unchanged "
+                    f"({moved} moved), {len(indexer.new_ids)} added ({indexer.chunks_embedded} embedded), "
+                    f"{len(removed)} removed")
+        return True
+    except Exception as e:
+        logger.error(f"Re-indexing error for file {file_id}: {str(e)}", exc_info=True)
+        await _rollback_reindex(file_id, indexer)
+        return False
+    except asyncio.CancelledError:
+        logger.error(f"Re-index of file {file_id} was cancelled")
+        await _rollback_reindex(file_id, indexer)
+        raise
+
+async def _rollback_reindex(file_id: int, indexer: Optional[PipelinedIndexer]):
+    """Delete the chunks a failed re-index added, leaving the previous version as it was"""
+    if indexer is None or not indexer.new_ids:
+        return
+    try:
+        await _delete_vectors(indexer.new_ids)
+    except Exception as cleanup_error:
+        logger.error(f"Error rolling back re-index of {file_id}: {str(cleanup_error)}", exc_info=True)
+
+async def delete_doc_from_pinecone(file_id: int, chunk_count: Optional[int] = None) -> bool:
     try:
-        # First, get the vector IDs associated with the file_id
         logger.info(f"Deleting document with file_id: {file_id}")
-        # Use synchronous operations
-        results = index.query(
-            vector=[0] * 1536,
-            top_k=10000,
-            filter={"file_id": file_id},
-            include_metadata=True
-        )
-        
-        # Extract vector IDs to delete
-        vector_ids = [match.id for match in results.matches]
-        
+        vector_ids = await document_vector_ids(file_id, chunk_count)
+
         if vector_ids:
             # Delete the vectors by their IDs
-            index.delete(ids=vector_ids)
+            await _delete_vectors(vector_ids)
+            await replace_document_chunk_ids(file_id, [])
             logger.info(f"Successfully deleted {len(vector_ids)} document chunks with file_id {file_id}")
-            return True
         else:
-            logger.warning(f"No documents found with file_id {file_id}")
-            return False
+            # A document that produced no chunks, or whose vectors are already gone, has nothing to delete
+            logger.info(f"No vectors found with file_id {file_id}, nothing to delete")
+        return True
         
     except Exception as e:
         logger.error(f"Error deleting document: {str(e)}", exc_info=True)
@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
+from typing import Dict, List, Optional
 from enum import Enum
 
 class ModelName(str, Enum):
@@ -16,11 +17,83 @@ class QueryResponse(BaseModel):
     session_id: str
     model: ModelName
 
+class BatchQuestion(BaseModel):
+    question: str
+    session_id: Optional[str] = None
+
+class BatchQueryInput(BaseModel):
+    questions: List[BatchQuestion]
+    model: ModelName = Field(default=ModelName.GPT4_O_MINI)
+    max_concurrency: Optional[int] = Field(default=None, ge=1)
+
+class BatchItemResult(BaseModel):
+    question: str
+    session_id: str
+    answer: Optional[str] = None
+    cached: bool = False
+    deduplicated: bool = False
+    error: Optional[str] = None
+    timings_ms: Dict[str, float] = {}
+
+class BatchQueryResponse(BaseModel):
+    model: ModelName
+    results: List[BatchItemResult]
+    unique_questions: int
+    timings_ms: Dict[str, float]
+
 class DocumentInfo(BaseModel):
     id: int
     filename: str
     s3_url: str
     upload_timestamp: datetime
+    chunk_count: Optional[int] = None
+    content_hash: Optional[str] = None
 
 class DeleteFileRequest(BaseModel):
-    file_id: int
\ No newline at end of file
+    file_id: int
+
+class DeleteFilesRequest(BaseModel):
+    file_ids: List[int]
+
+class DeleteFileResult(BaseModel):
+    file_id: int
+    deleted: bool
+    detail: Optional[str] = None
+
+class JobStage(str, Enum):
+    QUEUED = "queued"
+    PARSING = "parsing"
+    EMBEDDING = "embedding"
+    UPSERTING = "upserting"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+class UploadResponse(BaseModel):
+    message: str
+    file_id: int
+    s3_url: str
+    job_id: Optional[str] = None
+    size_bytes: Optional[int] = None
+    sha256: Optional[str] = None
+    duplicate: bool = False
+    chunks_embedded: Optional[int] = None
+    chunks_reused: Optional[int] = None
+
+class JobStatus(BaseModel):
+    job_id: str
+    file_id: int
+    filename: str
+    stage: JobStage
+    chunks_done: int = 0
+    chunks_total: int = 0
+    chunks_embedded: int = 0
+    chunks_reused: int = 0
+    chunks_unchanged: int = 0
+    chunks_removed: int = 0
+    chunks_per_second: float = 0.0
+    peak_rss_mb: float = 0.0
+    peak_rss_increase_mb: float = 0.0
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
\ No newline at end of file
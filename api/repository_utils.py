@@ -0,0 +1,551 @@
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+from startup_utils import lazy_resource
+import threading
+import asyncio
+import sqlite3
+import os
+from dotenv import load_dotenv
+import logging
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+METADATA_STORE_BACKEND = os.getenv("METADATA_STORE_BACKEND", "postgres" if DATABASE_URL else "supabase")
+DATABASE_POOL_MIN_SIZE = int(os.getenv("DATABASE_POOL_MIN_SIZE", "1"))
+DATABASE_POOL_MAX_SIZE = int(os.getenv("DATABASE_POOL_MAX_SIZE", "10"))
+# Prepared statements cached per connection; set to 0 behind a transaction-mode pooler (e.g. Supabase port 6543)
+DATABASE_STATEMENT_CACHE_SIZE = int(os.getenv("DATABASE_STATEMENT_CACHE_SIZE", "100"))
+DATABASE_COMMAND_TIMEOUT = float(os.getenv("DATABASE_COMMAND_TIMEOUT", "10"))
+SQLITE_DATABASE_PATH = os.getenv("SQLITE_DATABASE_PATH", ":memory:")
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS application_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    user_query TEXT,
+    gpt_response TEXT,
+    model TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS application_logs_session_idx ON application_logs (session_id, created_at);
+CREATE TABLE IF NOT EXISTS document_store (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT NOT NULL,
+    s3_url TEXT,
+    upload_timestamp TEXT NOT NULL,
+    chunk_count INTEGER,
+    content_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS document_store_hash_idx ON document_store (content_hash);
+CREATE TABLE IF NOT EXISTS document_chunks (
+    file_id INTEGER NOT NULL,
+    chunk_id TEXT NOT NULL,
+    PRIMARY KEY (file_id, chunk_id)
+);
+CREATE TABLE IF NOT EXISTS session_summaries (
+    session_id TEXT PRIMARY KEY,
+    summary TEXT,
+    summarized_turns INTEGER,
+    updated_at TEXT
+);
+"""
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# Every upload, (re)index and delete changes one of these: a delete the count, an upload the last
+# id, an index the chunk total and a replacement the last upload_timestamp
+CORPUS_VERSION_QUERY = ("SELECT count(*) AS documents, max(id) AS last_id, max(upload_timestamp) AS last_update, "
+                        "sum(chunk_count) AS chunks FROM document_store")
+
+
+def _corpus_version(row: Dict) -> str:
+    return f"{row['documents']}:{row['last_id']}:{row['last_update']}:{row['chunks']}"
+
+
+class MetadataRepository:
+    """Chat logs, document records and session summaries.
+
+    Every method is a coroutine that does not block the event loop; failures
+    raise and are handled by the wrappers in db_utils.
+    """
+
+    async def get_all_documents(self) -> List[Dict]:
+        raise NotImplementedError
+
+    async def get_document_by_id(self, file_id: int) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def get_documents_by_ids(self, file_ids: List[int]) -> List[Dict]:
+        raise NotImplementedError
+
+    async def get_document_by_hash(self, content_hash: str) -> Optional[Dict]:
+        """Return the oldest document with this SHA-256 of its file content"""
+        raise NotImplementedError
+
+    async def insert_document_record(self, filename: str, s3_url: str, content_hash: Optional[str] = None) -> int:
+        raise NotImplementedError
+
+    async def update_document_chunk_count(self, file_id: int, chunk_count: int):
+        raise NotImplementedError
+
+    async def update_document_record(self, file_id: int, filename: str, s3_url: str, content_hash: Optional[str]):
+        """Point an existing document at a new version of its file"""
+        raise NotImplementedError
+
+    async def delete_document_record(self, file_id: int):
+        raise NotImplementedError
+
+    async def get_corpus_version(self) -> str:
+        """Fingerprint of document_store that changes whenever a document is added, indexed, replaced or deleted"""
+        raise NotImplementedError
+
+    async def get_document_chunk_ids(self, file_id: int) -> List[str]:
+        """Vector ids of a document's chunks, as recorded by the last (re)index"""
+        raise NotImplementedError
+
+    async def replace_document_chunk_ids(self, file_id: int, chunk_ids: List[str]):
+        raise NotImplementedError
+
+    async def insert_application_logs(self, session_id: str, user_query: str, gpt_response: str, model: str):
+        raise NotImplementedError
+
+    async def insert_application_logs_batch(self, rows: List[Dict]):
+        """Insert many log rows (session_id, user_query, gpt_response, model, created_at) in one round trip"""
+        raise NotImplementedError
+
+    async def get_chat_history(self, session_id: str) -> List[Dict]:
+        """Return the session's (user_query, gpt_response) rows, oldest first"""
+        raise NotImplementedError
+
+    async def count_chat_history(self, session_id: str) -> int:
+        """Number of application_logs rows (turns) stored for the session"""
+        raise NotImplementedError
+
+    async def get_session_summary(self, session_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def upsert_session_summary(self, session_id: str, summary: str, summarized_turns: int):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class PostgresRepository(MetadataRepository):
+    """asyncpg connection pool; statements are prepared once per connection and reused"""
+
+    def __init__(self, dsn: str = DATABASE_URL, min_size: int = DATABASE_POOL_MIN_SIZE,
+                 max_size: int = DATABASE_POOL_MAX_SIZE, statement_cache_size: int = DATABASE_STATEMENT_CACHE_SIZE,
+                 command_timeout: float = DATABASE_COMMAND_TIMEOUT):
+        if not dsn:
+            raise ValueError("DATABASE_URL is required for the postgres metadata store")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.statement_cache_size = statement_cache_size
+        self.command_timeout = command_timeout
+        self._pool = None
+        self._pool_loop = None
+        self._pool_lock = None
+
+    async def _get_pool(self):
+        # The pool is bound to the loop it was created on; rebuild it if the handler runs a new loop
+        loop = asyncio.get_running_loop()
+        if self._pool is not None and self._pool_loop is loop:
+            return self._pool
+        if self._pool_lock is None or self._pool_loop is not loop:
+            self._pool_lock = asyncio.Lock()
+            self._pool_loop = loop
+            self._pool = None
+        async with self._pool_lock:
+            if self._pool is None:
+                import asyncpg
+                self._pool = await asyncpg.create_pool(
+                    self.dsn,
+                    min_size=self.min_size,
+                    max_size=self.max_size,
+                    statement_cache_size=self.statement_cache_size,
+                    command_timeout=self.command_timeout
+                )
+                logger.info(f"Opened Postgres pool ({self.min_size}-{self.max_size} connections)")
+        return self._pool
+
+    async def _fetch(self, query: str, *args) -> List[Dict]:
+        pool = await self._get_pool()
+        return [dict(row) for row in await pool.fetch(query, *args)]
+
+    async def _fetchrow(self, query: str, *args) -> Optional[Dict]:
+        pool = await self._get_pool()
+        row = await pool.fetchrow(query, *args)
+        return dict(row) if row is not None else None
+
+    async def _execute(self, query: str, *args):
+        pool = await self._get_pool()
+        await pool.execute(query, *args)
+
+    async def get_all_documents(self) -> List[Dict]:
+        return await self._fetch("SELECT * FROM document_store ORDER BY upload_timestamp DESC")
+
+    async def get_document_by_id(self, file_id: int) -> Optional[Dict]:
+        return await self._fetchrow("SELECT * FROM document_store WHERE id = $1", file_id)
+
+    async def get_documents_by_ids(self, file_ids: List[int]) -> List[Dict]:
+        return await self._fetch("SELECT * FROM document_store WHERE id = ANY($1::bigint[])", list(file_ids))
+
+    async def get_document_by_hash(self, content_hash: str) -> Optional[Dict]:
+        return await self._fetchrow(
+            "SELECT * FROM document_store WHERE content_hash = $1 ORDER BY id LIMIT 1", content_hash
+        )
+
+    async def insert_document_record(self, filename: str, s3_url: str, content_hash: Optional[str] = None) -> int:
+        row = await self._fetchrow(
+            "INSERT INTO document_store (filename, s3_url, upload_timestamp, content_hash) VALUES ($1, $2, $3, $4) "
+            "RETURNING id",
+            filename, s3_url, _now(), content_hash
+        )
+        return row["id"]
+
+    async def update_document_chunk_count(self, file_id: int, chunk_count: int):
+        await self._execute("UPDATE document_store SET chunk_count = $2 WHERE id = $1", file_id, chunk_count)
+
+    async def update_document_record(self, file_id: int, filename: str, s3_url: str, content_hash: Optional[str]):
+        await self._execute(
+            "UPDATE document_store SET filename = $2, s3_url = $3, content_hash = $4, upload_timestamp = $5 WHERE id = $1",
+            file_id, filename, s3_url, content_hash, _now()
+        )
+
+    async def delete_document_record(self, file_id: int):
+        await self._execute("DELETE FROM document_store WHERE id = $1", file_id)
+
+    async def get_corpus_version(self) -> str:
+        return _corpus_version(await self._fetchrow(CORPUS_VERSION_QUERY))
+
+    async def get_document_chunk_ids(self, file_id: int) -> List[str]:
+        rows = await self._fetch("SELECT chunk_id FROM document_chunks WHERE file_id = $1", file_id)
+        return [row["chunk_id"] for row in rows]
+
+    async def replace_document_chunk_ids(self, file_id: int, chunk_ids: List[str]):
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("DELETE FROM document_chunks WHERE file_id = $1", file_id)
+                await conn.executemany(
+                    "INSERT INTO document_chunks (file_id, chunk_id) VALUES ($1, $2)",
+                    [(file_id, chunk_id) for chunk_id in chunk_ids]
+                )
+
+    async def insert_application_logs(self, session_id: str, user_query: str, gpt_response: str, model: str):
+        await self._execute(
+            "INSERT INTO application_logs (session_id, user_query, gpt_response, model, created_at) "
+            "VALUES ($1, $2, $3, $4, $5)",
+            session_id, user_query, gpt_response, model, _now()
+        )
+
+    async def insert_application_logs_batch(self, rows: List[Dict]):
+        pool = await self._get_pool()
+        await pool.executemany(
+            "INSERT INTO application_logs (session_id, user_query, gpt_response, model, created_at) "
+            "VALUES ($1, $2, $3, $4, $5)",
+            [(row["session_id"], row["user_query"], row["gpt_response"], row["model"], row["created_at"]) for row in rows]
+        )
+
+    async def get_chat_history(self, session_id: str) -> List[Dict]:
+        return await self._fetch(
+            "SELECT user_query, gpt_response FROM application_logs WHERE session_id = $1 ORDER BY created_at",
+            session_id
+        )
+
+    async def count_chat_history(self, session_id: str) -> int:
+        row = await self._fetchrow("SELECT count(*) AS turns FROM application_logs WHERE session_id = $1", session_id)
+        return row["turns"]
+
+    async def get_session_summary(self, session_id: str) -> Optional[Dict]:
+        return await self._fetchrow(
+            "SELECT summary, summarized_turns FROM session_summaries WHERE session_id = $1", session_id
+        )
+
+    async def upsert_session_summary(self, session_id: str, summary: str, summarized_turns: int):
+        await self._execute(
+            "INSERT INTO session_summaries (session_id, summary, summarized_turns, updated_at) VALUES ($1, $2, $3, $4) "
+            "ON CONFLICT (session_id) DO UPDATE SET summary = EXCLUDED.summary, "
+            "summarized_turns = EXCLUDED.summarized_turns, updated_at = EXCLUDED.updated_at",
+            session_id, summary, summarized_turns, _now()
+        )
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+
+class SQLiteRepository(MetadataRepository):
+    """SQLite file, or an in-memory database with the default ":memory:" path, for local runs.
+
+    A single connection is shared and serialized with a lock; queries run in a
+    worker thread so they stay off the event loop.
+    """
+
+    def __init__(self, path: str = SQLITE_DATABASE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript(SQLITE_SCHEMA)
+        logger.info(f"Opened SQLite metadata store at {path}")
+
+    def _run(self, query: str, args: tuple = (), fetch: bool = True):
+        with self._lock:
+            cursor = self._conn.execute(query, args)
+            rows = [dict(row) for row in cursor.fetchall()] if fetch else cursor.lastrowid
+            self._conn.commit()
+            return rows
+
+    async def _fetch(self, query: str, *args) -> List[Dict]:
+        return await asyncio.to_thread(self._run, query, args)
+
+    async def _fetchrow(self, query: str, *args) -> Optional[Dict]:
+        rows = await self._fetch(query, *args)
+        return rows[0] if rows else None
+
+    async def _execute(self, query: str, *args) -> int:
+        return await asyncio.to_thread(self._run, query, args, False)
+
+    def _run_many(self, query: str, rows: List[tuple]):
+        with self._lock:
+            self._conn.executemany(query, rows)
+            self._conn.commit()
+
+    async def get_all_documents(self) -> List[Dict]:
+        return await self._fetch("SELECT * FROM document_store ORDER BY upload_timestamp DESC")
+
+    async def get_document_by_id(self, file_id: int) -> Optional[Dict]:
+        return await self._fetchrow("SELECT * FROM document_store WHERE id = ?", file_id)
+
+    async def get_documents_by_ids(self, file_ids: List[int]) -> List[Dict]:
+        if not file_ids:
+            return []
+        placeholders = ", ".join("?" for _ in file_ids)
+        return await self._fetch(f"SELECT * FROM document_store WHERE id IN ({placeholders})", *file_ids)
+
+    async def get_document_by_hash(self, content_hash: str) -> Optional[Dict]:
+        return await self._fetchrow(
+            "SELECT * FROM document_store WHERE content_hash = ? ORDER BY id LIMIT 1", content_hash
+        )
+
+    async def insert_document_record(self, filename: str, s3_url: str, content_hash: Optional[str] = None) -> int:
+        return await self._execute(
+            "INSERT INTO document_store (filename, s3_url, upload_timestamp, content_hash) VALUES (?, ?, ?, ?)",
+            filename, s3_url, _now().isoformat(), content_hash
+        )
+
+    async def update_document_chunk_count(self, file_id: int, chunk_count: int):
+        await self._execute("UPDATE document_store SET chunk_count = ? WHERE id = ?", chunk_count, file_id)
+
+    async def update_document_record(self, file_id: int, filename: str, s3_url: str, content_hash: Optional[str]):
+        await self._execute(
+            "UPDATE document_store SET filename = ?, s3_url = ?, content_hash = ?, upload_timestamp = ? WHERE id = ?",
+            filename, s3_url, content_hash, _now().isoformat(), file_id
+        )
+
+    async def delete_document_record(self, file_id: int):
+        await self._execute("DELETE FROM document_store WHERE id = ?", file_id)
+
+    async def get_corpus_version(self) -> str:
+        return _corpus_version(await self._fetchrow(CORPUS_VERSION_QUERY))
+
+    async def get_document_chunk_ids(self, file_id: int) -> List[str]:
+        rows = await self._fetch("SELECT chunk_id FROM document_chunks WHERE file_id = ?", file_id)
+        return [row["chunk_id"] for row in rows]
+
+    def _replace_chunk_ids(self, file_id: int, chunk_ids: List[str]):
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM document_chunks WHERE file_id = ?", (file_id,))
+                self._conn.executemany(
+                    "INSERT INTO document_chunks (file_id, chunk_id) VALUES (?, ?)",
+                    [(file_id, chunk_id) for chunk_id in chunk_ids]
+                )
+
+    async def replace_document_chunk_ids(self, file_id: int, chunk_ids: List[str]):
+        await asyncio.to_thread(self._replace_chunk_ids, file_id, chunk_ids)
+
+    async def insert_application_logs(self, session_id: str, user_query: str, gpt_response: str, model: str):
+        await self._execute(
+            "INSERT INTO application_logs (session_id, user_query, gpt_response, model, created_at) VALUES (?, ?, ?, ?, ?)",
+            session_id, user_query, gpt_response, model, _now().isoformat()
+        )
+
+    async def insert_application_logs_batch(self, rows: List[Dict]):
+        await asyncio.to_thread(
+            self._run_many,
+            "INSERT INTO application_logs (session_id, user_query, gpt_response, model, created_at) VALUES (?, ?, ?, ?, ?)",
+            [(row["session_id"], row["user_query"], row["gpt_response"], row["model"], row["created_at"].isoformat())
+             for row in rows]
+        )
+
+    async def get_chat_history(self, session_id: str) -> List[Dict]:
+        return await self._fetch(
+            "SELECT user_query, gpt_response FROM application_logs WHERE session_id = ? ORDER BY created_at, id",
+            session_id
+        )
+
+    async def count_chat_history(self, session_id: str) -> int:
+        row = await self._fetchrow("SELECT count(*) AS turns FROM application_logs WHERE session_id = ?", session_id)
+        return row["turns"]
+
+    async def get_session_summary(self, session_id: str) -> Optional[Dict]:
+        return await self._fetchrow(
+            "SELECT summary, summarized_turns FROM session_summaries WHERE session_id = ?", session_id
+        )
+
+    async def upsert_session_summary(self, session_id: str, summary: str, summarized_turns: int):
+        await self._execute(
+            "INSERT INTO session_summaries (session_id, summary, summarized_turns, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (session_id) DO UPDATE SET summary = excluded.summary, "
+            "summarized_turns = excluded.summarized_turns, updated_at = excluded.updated_at",
+            session_id, summary, summarized_turns, _now().isoformat()
+        )
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SupabaseRepository(MetadataRepository):
+    """Supabase REST client, for deployments without a direct Postgres connection.
+
+    The client is synchronous, so each request runs in a worker thread.
+    """
+
+    def __init__(self, url: str = None, key: str = None):
+        from supabase import create_client
+        self.client = create_client(url or os.getenv("SUPABASE_URL"), key or os.getenv("SUPABASE_KEY"))
+
+    async def _data(self, request) -> List[Dict]:
+        response = await asyncio.to_thread(request.execute)
+        return response.data
+
+    async def get_all_documents(self) -> List[Dict]:
+        return await self._data(self.client.table("document_store").select("*").order("upload_timestamp", desc=True))
+
+    async def get_document_by_id(self, file_id: int) -> Optional[Dict]:
+        data = await self._data(self.client.table("document_store").select("*").eq("id", file_id))
+        return data[0] if data else None
+
+    async def get_documents_by_ids(self, file_ids: List[int]) -> List[Dict]:
+        return await self._data(self.client.table("document_store").select("*").in_("id", file_ids))
+
+    async def get_document_by_hash(self, content_hash: str) -> Optional[Dict]:
+        data = await self._data(
+            self.client.table("document_store").select("*").eq("content_hash", content_hash).order("id").limit(1)
+        )
+        return data[0] if data else None
+
+    async def insert_document_record(self, filename: str, s3_url: str, content_hash: Optional[str] = None) -> int:
+        data = await self._data(self.client.table("document_store").insert({
+            "filename": filename,
+            "s3_url": s3_url,
+            "upload_timestamp": _now().isoformat(),
+            "content_hash": content_hash
+        }))
+        return data[0]["id"]
+
+    async def update_document_chunk_count(self, file_id: int, chunk_count: int):
+        await self._data(self.client.table("document_store").update({"chunk_count": chunk_count}).eq("id", file_id))
+
+    async def update_document_record(self, file_id: int, filename: str, s3_url: str, content_hash: Optional[str]):
+        await self._data(self.client.table("document_store").update({
+            "filename": filename,
+            "s3_url": s3_url,
+            "content_hash": content_hash,
+            "upload_timestamp": _now().isoformat()
+        }).eq("id", file_id))
+
+    async def delete_document_record(self, file_id: int):
+        await self._data(self.client.table("document_store").delete().eq("id", file_id))
+
+    async def get_corpus_version(self) -> str:
+        # PostgREST has no aggregates without an RPC; the document table is small enough to scan
+        data = await self._data(self.client.table("document_store").select("id, upload_timestamp, chunk_count"))
+        return _corpus_version({
+            "documents": len(data),
+            "last_id": max((row["id"] for row in data), default=None),
+            "last_update": max((row["upload_timestamp"] for row in data), default=None),
+            "chunks": sum(row["chunk_count"] or 0 for row in data) if data else None,
+        })
+
+    async def get_document_chunk_ids(self, file_id: int) -> List[str]:
+        data = await self._data(self.client.table("document_chunks").select("chunk_id").eq("file_id", file_id))
+        return [row["chunk_id"] for row in data]
+
+    async def replace_document_chunk_ids(self, file_id: int, chunk_ids: List[str]):
+        # Not transactional over REST; a failure in between leaves the delete fallbacks to find the ids
+        await self._data(self.client.table("document_chunks").delete().eq("file_id", file_id))
+        if chunk_ids:
+            await self._data(self.client.table("document_chunks").insert(
+                [{"file_id": file_id, "chunk_id": chunk_id} for chunk_id in chunk_ids]
+            ))
+
+    async def insert_application_logs(self, session_id: str, user_query: str, gpt_response: str, model: str):
+        await self._data(self.client.table("application_logs").insert({
+            "session_id": session_id,
+            "user_query": user_query,
+            "gpt_response": gpt_response,
+            "model": model,
+            "created_at": _now().isoformat()
+        }))
+
+    async def insert_application_logs_batch(self, rows: List[Dict]):
+        await self._data(self.client.table("application_logs").insert(
+            [dict(row, created_at=row["created_at"].isoformat()) for row in rows]
+        ))
+
+    async def get_chat_history(self, session_id: str) -> List[Dict]:
+        return await self._data(
+            self.client.table("application_logs").select("user_query, gpt_response")
+            .eq("session_id", session_id).order("created_at")
+        )
+
+    async def count_chat_history(self, session_id: str) -> int:
+        request = self.client.table("application_logs").select("id", count="exact").eq("session_id", session_id).limit(1)
+        response = await asyncio.to_thread(request.execute)
+        return response.count or 0
+
+    async def get_session_summary(self, session_id: str) -> Optional[Dict]:
+        data = await self._data(
+            self.client.table("session_summaries").select("summary, summarized_turns").eq("session_id", session_id)
+        )
+        return data[0] if data else None
+
+    async def upsert_session_summary(self, session_id: str, summary: str, summarized_turns: int):
+        await self._data(self.client.table("session_summaries").upsert({
+            "session_id": session_id,
+            "summary": summary,
+            "summarized_turns": summarized_turns,
+            "updated_at": _now().isoformat()
+        }))
+
+
+METADATA_STORE_BACKENDS: Dict[str, Callable[[], MetadataRepository]] = {
+    "postgres": PostgresRepository,
+    "sqlite": SQLiteRepository,
+    "supabase": SupabaseRepository,
+}
+
+
+def create_repository(name: str = METADATA_STORE_BACKEND) -> MetadataRepository:
+    if name not in METADATA_STORE_BACKENDS:
+        raise ValueError(f"Unknown metadata store backend: {name}")
+    logger.info(f"Using {name} metadata store backend")
+    return METADATA_STORE_BACKENDS[name]()
+
+
+@lazy_resource("metadata_store")
+def get_repository() -> MetadataRepository:
+    return create_repository()
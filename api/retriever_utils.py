@@ -0,0 +1,90 @@
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun, AsyncCallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from typing import Any, Dict, List, Optional
+from vectorstore_utils import VectorMatch
+from bm25_utils import reciprocal_rank_fusion
+import asyncio
+
+# LangChain retriever classes live here rather than next to the indexes they
+# wrap, so importing the indexes does not pull in langchain_core.retrievers.
+
+
+class VectorStoreBackendRetriever(BaseRetriever):
+    """LangChain retriever over a VectorStoreBackend.
+
+    Chunk text is read from the "text" metadata field, or for vectors without
+    one, from the chunk store in a single bulk read. Each document carries its
+    similarity to the query as metadata["score"].
+    """
+
+    backend: Any
+    embeddings: Any
+    chunk_store: Any = None
+    k: int = 4
+    filter: Optional[Dict] = None
+
+    def _to_documents(self, matches: List[VectorMatch]) -> List[Document]:
+        missing = [match.id for match in matches if "text" not in match.metadata]
+        texts = self.chunk_store.get_many(missing) if missing and self.chunk_store is not None else {}
+        documents = []
+        for match in matches:
+            metadata = dict(match.metadata)
+            text = metadata.pop("text", None)
+            metadata["score"] = match.score
+            documents.append(Document(id=match.id, page_content=text if text is not None else texts.get(match.id, ""),
+                                      metadata=metadata))
+        return documents
+
+    def _search(self, vector: List[float], k: int) -> List[Document]:
+        return self._to_documents(self.backend.query(vector, k, self.filter))
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self._search(self.embeddings.embed_query(query), self.k)
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        vector = await self.embeddings.aembed_query(query)
+        return await self.aretrieve(query, vector)
+
+    async def aretrieve(self, query: str, vector: List[float], k: Optional[int] = None) -> List[Document]:
+        """Retrieve with a query embedding the caller already has, optionally overriding k"""
+        return await asyncio.to_thread(self._search, vector, k or self.k)
+
+
+class HybridRetriever(BaseRetriever):
+    """Fans out to dense and BM25 search concurrently and fuses the rankings with RRF"""
+
+    dense: Any
+    sparse: Any
+    k: int = 4
+    fetch_k: int = 20
+
+    def _sparse_documents(self, query: str, fetch_k: Optional[int] = None) -> List[Document]:
+        scores = dict(self.sparse.search(query, fetch_k or self.fetch_k))
+        documents = self.sparse.get_documents(list(scores))
+        for doc in documents:
+            doc.metadata["bm25_score"] = scores[doc.id]
+        return documents
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        dense_docs = self.dense.invoke(query)
+        return reciprocal_rank_fusion([dense_docs, self._sparse_documents(query)])[:self.k]
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        dense_docs, sparse_docs = await asyncio.gather(
+            self.dense.ainvoke(query),
+            asyncio.to_thread(self._sparse_documents, query)
+        )
+        return reciprocal_rank_fusion([dense_docs, sparse_docs])[:self.k]
+
+    async def aretrieve(self, query: str, vector: List[float], k: Optional[int] = None) -> List[Document]:
+        """Retrieve with a query embedding the caller already has, optionally overriding k"""
+        k = k or self.k
+        fetch_k = max(self.fetch_k, k)
+        dense_docs, sparse_docs = await asyncio.gather(
+            self.dense.aretrieve(query, vector, fetch_k),
+            asyncio.to_thread(self._sparse_documents, query, fetch_k)
+        )
+        return reciprocal_rank_fusion([dense_docs, sparse_docs])[:k]
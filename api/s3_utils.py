@@ -1,5 +1,9 @@
-import boto3
-from botocore.exceptions import ClientError
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from startup_utils import lazy_resource
+import aiofiles
+import asyncio
+import hashlib
 import os
 from dotenv import load_dotenv
 import logging
@@ -12,29 +16,55 @@ AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_REGION = os.getenv("AWS_REGION")
 AWS_BUCKET_NAME = os.getenv("AWS_BUCKET_NAME")
+S3_PART_SIZE = int(os.getenv("S3_PART_SIZE", str(8 * 1024 * 1024)))  # S3 minimum is 5 MiB
+S3_UPLOAD_CONCURRENCY = int(os.getenv("S3_UPLOAD_CONCURRENCY", "4"))
+S3_DOWNLOAD_CHUNK_SIZE = int(os.getenv("S3_DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+@dataclass
+class UploadResult:
+    url: str
+    key: str
+    size: int
+    sha256: str
+    # False when upload_stream's keep check discarded the upload
+    stored: bool = True
+
 
 class S3Client:
-    def __init__(self):
+    def __init__(self, s3_client=None, bucket_name: Optional[str] = None):
+        """Wrap a boto3 S3 client; pass s3_client to use a preconfigured or local stand-in client"""
         logger.info("Initializing S3 client")
         try:
-            self.s3_client = boto3.client(
-                "s3",
-                aws_access_key_id=os.environ.get("CUSTOM_AWS_ACCESS_KEY"),
-                aws_secret_access_key=os.environ.get("CUSTOM_AWS_SECRET_KEY"),
-                region_name=os.environ.get("CUSTOM_AWS_REGION")
-            )
-            self.bucket_name = os.environ.get("AWS_BUCKET_NAME")
+            if s3_client is None:
+                import boto3
+                s3_client = boto3.client(
+                    "s3",
+                    aws_access_key_id=os.environ.get("CUSTOM_AWS_ACCESS_KEY"),
+                    aws_secret_access_key=os.environ.get("CUSTOM_AWS_SECRET_KEY"),
+                    region_name=os.environ.get("CUSTOM_AWS_REGION")
+                )
+            self.s3_client = s3_client
+            self.bucket_name = bucket_name or os.environ.get("AWS_BUCKET_NAME")
             logger.info(f"S3 client initialized with bucket: {self.bucket_name}")
         except Exception as e:
             logger.error(f"Failed to initialize S3 client: {str(e)}", exc_info=True)
             raise
 
+    def url_for(self, filename: str) -> str:
+        return f"https://{self.bucket_name}.s3.{AWS_REGION}.amazonaws.com/{filename}"
+
     async def upload_file(self, file_path: str, filename: str) -> str:
         """Upload a file to S3 bucket and return its URL"""
+        from botocore.exceptions import ClientError
         try:
             logger.info(f"Uploading file to S3: {filename}")
-            self.s3_client.upload_file(file_path, self.bucket_name, filename)
-            url = f"https://{self.bucket_name}.s3.{AWS_REGION}.amazonaws.com/{filename}"
+            await asyncio.to_thread(self.s3_client.upload_file, file_path, self.bucket_name, filename)
+            url = self.url_for(filename)
             logger.info(f"Successfully uploaded file to S3: {url}")
             return url
         except ClientError as e:
@@ -43,9 +73,11 @@ class S3Client:
 
     async def delete_file(self, filename: str) -> bool:
         """Delete a file from S3 bucket"""
+        from botocore.exceptions import ClientError
         try:
             logger.info(f"Deleting file from S3: {filename}")
-            self.s3_client.delete_object(
+            await asyncio.to_thread(
+                self.s3_client.delete_object,
                 Bucket=self.bucket_name,
                 Key=filename
             )
@@ -53,4 +85,128 @@ class S3Client:
             return True
         except ClientError as e:
             logger.error(f"Error deleting file {filename} from S3: {str(e)}", exc_info=True)
-            raise
\ No newline at end of file
+            raise
+
+    async def upload_stream(self, chunks: AsyncIterator[bytes], filename: str, max_bytes: Optional[int] = None,
+                            keep: Optional[Callable[[str], Awaitable[bool]]] = None) -> UploadResult:
+        """Upload a stream of byte chunks, hashing it on the way through.
+
+        Chunks are gathered into S3_PART_SIZE parts that are uploaded in parallel
+        (S3_UPLOAD_CONCURRENCY at a time) with a multipart upload, so at most
+        that many parts are held in memory. Streams smaller than one part use a
+        single put_object. Raises UploadTooLargeError once more than max_bytes
+        have been read; a failed multipart upload is aborted. Once the whole
+        stream is hashed, and before the object is written, keep is called with
+        the sha256; if it returns False nothing is stored (stored=False).
+        """
+        digest = hashlib.sha256()
+        size = 0
+        buffer = bytearray()
+        upload_id = None
+        tasks: List[asyncio.Task] = []
+        slots = asyncio.Semaphore(S3_UPLOAD_CONCURRENCY)
+
+        async def upload_part(number: int, body: bytes) -> Dict:
+            try:
+                response = await asyncio.to_thread(
+                    self.s3_client.upload_part,
+                    Bucket=self.bucket_name, Key=filename, UploadId=upload_id, PartNumber=number, Body=body
+                )
+                return {"PartNumber": number, "ETag": response["ETag"]}
+            finally:
+                slots.release()
+
+        async def submit_part(body: bytes):
+            await slots.acquire()
+            for task in tasks:
+                if task.done() and task.exception():
+                    slots.release()
+                    raise task.exception()
+            tasks.append(asyncio.create_task(upload_part(len(tasks) + 1, body)))
+
+        async def abort():
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if upload_id is not None:
+                try:
+                    await asyncio.to_thread(
+                        self.s3_client.abort_multipart_upload, Bucket=self.bucket_name, Key=filename, UploadId=upload_id
+                    )
+                except Exception as abort_error:
+                    logger.warning(f"Failed to abort multipart upload for {filename}: {str(abort_error)}")
+
+        try:
+            logger.info(f"Streaming file to S3: {filename}")
+            async for chunk in chunks:
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise UploadTooLargeError(f"File exceeds the {max_bytes} byte upload limit")
+                digest.update(chunk)
+                buffer.extend(chunk)
+                if len(buffer) >= S3_PART_SIZE:
+                    if upload_id is None:
+                        response = await asyncio.to_thread(
+                            self.s3_client.create_multipart_upload, Bucket=self.bucket_name, Key=filename
+                        )
+                        upload_id = response["UploadId"]
+                    await submit_part(bytes(buffer))
+                    buffer = bytearray()
+
+            stored = keep is None or await keep(digest.hexdigest())
+            if not stored:
+                await abort()
+            elif upload_id is None:
+                await asyncio.to_thread(self.s3_client.put_object, Bucket=self.bucket_name, Key=filename, Body=bytes(buffer))
+            else:
+                if buffer:
+                    await submit_part(bytes(buffer))
+                parts = await asyncio.gather(*tasks)
+                await asyncio.to_thread(
+                    self.s3_client.complete_multipart_upload,
+                    Bucket=self.bucket_name, Key=filename, UploadId=upload_id, MultipartUpload={"Parts": parts}
+                )
+        except BaseException as e:
+            await abort()
+            if not isinstance(e, UploadTooLargeError):
+                logger.error(f"S3 streaming upload error for file {filename}: {str(e)}", exc_info=True)
+            raise
+
+        result = UploadResult(url=self.url_for(filename), key=filename, size=size, sha256=digest.hexdigest(),
+                              stored=stored)
+        if stored:
+            logger.info(f"Successfully streamed {size} bytes to S3: {result.url} ({len(tasks) or 1} parts)")
+        else:
+            logger.info(f"Discarded {size} byte upload {filename} before storing it")
+        return result
+
+    async def download_stream(self, filename: str, chunk_size: int = S3_DOWNLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """Yield an object's bytes chunk by chunk, reading the body off the event loop"""
+        response = await asyncio.to_thread(self.s3_client.get_object, Bucket=self.bucket_name, Key=filename)
+        body = response["Body"]
+        try:
+            while True:
+                chunk = await asyncio.to_thread(body.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+    async def download_file(self, filename: str, file_path: str):
+        """Download an object to a local file with constant memory"""
+        from botocore.exceptions import ClientError
+        try:
+            logger.info(f"Downloading file from S3: {filename}")
+            async with aiofiles.open(file_path, "wb") as f:
+                async for chunk in self.download_stream(filename):
+                    await f.write(chunk)
+            logger.info(f"Successfully downloaded file from S3 to {file_path}")
+        except ClientError as e:
+            logger.error(f"S3 download error for file {filename}: {str(e)}", exc_info=True)
+            raise
+
+
+@lazy_resource("s3")
+def get_s3_client() -> S3Client:
+    return S3Client()
\ No newline at end of file
@@ -0,0 +1,128 @@
+from typing import TYPE_CHECKING, List, Optional, Tuple
+from langchain_utils import RETRIEVAL_K, get_retriever, get_standalone_question, known_standalone_question
+from context_utils import CONTEXT_ASSEMBLY_ENABLED, CONTEXT_FETCH_K
+from pinecone_utils import embed_query
+from bm25_utils import reciprocal_rank_fusion
+from metrics_utils import metrics
+from pydantic_models import ModelName
+import asyncio
+import os
+from dotenv import load_dotenv
+import logging
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "true").lower() == "true"
+
+speculative_retrievals = metrics.counter(
+    "speculative_retrieval_total",
+    "Follow-ups whose raw-question retrieval was used as is (identical), covered the rewritten "
+    "question's results (sufficient) or was merged with them (merged)",
+    ("outcome",)
+)
+
+
+def _normalize(question: str) -> str:
+    return " ".join(question.lower().split()).rstrip("?.! ")
+
+
+class SpeculativeRetrieval:
+    """Contextualize a question and retrieve its context, overlapping the two for follow-ups.
+
+    When a follow-up needs an LLM rewrite, retrieval on the raw question starts
+    at the same time. If the rewrite comes back unchanged the speculative results
+    are used as they are; otherwise the rewritten question is searched too and
+    both rankings are fused with RRF. Questions with no history, self-contained
+    questions and memoized rewrites skip the LLM call and the speculation.
+    """
+
+    def __init__(self, question: str, chat_history: List, model = ModelName.GPT4_O_MINI):
+        self.question = question
+        self.chat_history = chat_history
+        self.model = model
+        # Context assembly picks from a larger candidate set than it puts in the prompt
+        self.k = CONTEXT_FETCH_K if CONTEXT_ASSEMBLY_ENABLED else RETRIEVAL_K
+        self.standalone_question: Optional[str] = None
+        self._raw_search: Optional[asyncio.Task] = None
+        self._embedding: Optional[List[float]] = None
+
+    async def _search(self, query: str, vector: Optional[List[float]] = None) -> Tuple[List[float], List["Document"]]:
+        if vector is None:
+            vector = await embed_query(query)
+        return vector, await get_retriever().aretrieve(query, vector, self.k)
+
+    async def contextualize(self) -> str:
+        """Return the standalone question, searching with the raw question while an LLM rewrites it"""
+        known = known_standalone_question(self.question, self.chat_history, self.model)
+        if known is not None:
+            self.standalone_question = known
+            return known
+
+        if SPECULATIVE_RETRIEVAL:
+            self._raw_search = asyncio.create_task(self._search(self.question))
+        try:
+            self.standalone_question = await get_standalone_question(self.question, self.chat_history, self.model)
+        except BaseException:
+            self.cancel()
+            raise
+        return self.standalone_question
+
+    @property
+    def _rewrite_unchanged(self) -> bool:
+        return _normalize(self.standalone_question) == _normalize(self.question)
+
+    async def _raw_results(self) -> Optional[Tuple[List[float], List["Document"]]]:
+        if self._raw_search is None:
+            return None
+        try:
+            return await self._raw_search
+        except Exception as e:
+            # Speculation is best effort; the rewritten question is still searched
+            logger.error(f"Error in speculative retrieval: {str(e)}", exc_info=True)
+            self._raw_search = None
+            return None
+
+    async def embedding(self) -> List[float]:
+        """Embedding of the standalone question, shared by the semantic cache and retrieval"""
+        if self._embedding is None:
+            raw = await self._raw_results() if self._raw_search is not None and self._rewrite_unchanged else None
+            if raw is not None:
+                self._embedding = raw[0]
+            else:
+                self._embedding = await embed_query(self.standalone_question)
+        return self._embedding
+
+    async def documents(self) -> List["Document"]:
+        """Retrieve the context for the standalone question, merged with the speculative results"""
+        vector = await self.embedding()
+        raw = await self._raw_results()
+        if raw is None:
+            _, documents = await self._search(self.standalone_question, vector)
+            return documents
+
+        _, raw_documents = raw
+        if self._rewrite_unchanged:
+            speculative_retrievals.inc(outcome="identical")
+            return raw_documents
+
+        _, documents = await self._search(self.standalone_question, vector)
+        raw_ids = {doc.id or doc.page_content for doc in raw_documents}
+        found_new = any((doc.id or doc.page_content) not in raw_ids for doc in documents)
+        speculative_retrievals.inc(outcome="merged" if found_new else "sufficient")
+        return reciprocal_rank_fusion([documents, raw_documents])[:self.k]
+
+    def cancel(self):
+        """Drop the speculative search, e.g. when the answer came from the semantic cache"""
+        if self._raw_search is None:
+            return
+        if self._raw_search.done():
+            if not self._raw_search.cancelled():
+                self._raw_search.exception()
+        else:
+            self._raw_search.cancel()
+        self._raw_search = None
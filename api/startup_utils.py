@@ -0,0 +1,79 @@
+from typing import Callable, Dict, TypeVar
+import functools
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Imported first by main, so this approximates the start of the cold start
+PROCESS_START = time.perf_counter()
+
+
+class StartupProfile:
+    """Records how long the app took to import and how long each lazy client took to initialize"""
+
+    def __init__(self):
+        self.import_seconds = None
+        self.inits: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def mark_imported(self):
+        self.import_seconds = time.perf_counter() - PROCESS_START
+        logger.info(f"App imported in {self.import_seconds * 1000:.0f} ms")
+
+    def record_init(self, name: str, seconds: float):
+        with self._lock:
+            self.inits[name] = {
+                "init_ms": round(seconds * 1000, 1),
+                "after_start_ms": round((time.perf_counter() - PROCESS_START) * 1000, 1),
+            }
+        logger.info(f"Initialized {name} in {seconds * 1000:.0f} ms")
+
+    def report(self) -> Dict:
+        return {
+            "import_ms": round(self.import_seconds * 1000, 1) if self.import_seconds is not None else None,
+            "inits": dict(self.inits),
+        }
+
+
+startup_profile = StartupProfile()
+
+
+def lazy_resource(name: str) -> Callable[[Callable[[], T]], Callable[[], T]]:
+    """Turn a factory into a thread-safe accessor that builds its resource once, on first use.
+
+    The accessor gets an ``override(instance)`` hook for local stand-ins, a
+    ``reset()`` hook to force a rebuild and ``initialized()`` to check without building.
+    """
+    def decorator(factory: Callable[[], T]) -> Callable[[], T]:
+        lock = threading.Lock()
+        holder = []
+
+        @functools.wraps(factory)
+        def accessor() -> T:
+            if holder:
+                return holder[0]
+            with lock:
+                if not holder:
+                    start = time.perf_counter()
+                    instance = factory()
+                    startup_profile.record_init(name, time.perf_counter() - start)
+                    holder.append(instance)
+            return holder[0]
+
+        def override(instance: T):
+            with lock:
+                holder[:] = [instance]
+
+        def reset():
+            with lock:
+                holder.clear()
+
+        accessor.override = override
+        accessor.reset = reset
+        accessor.initialized = lambda: bool(holder)
+        return accessor
+    return decorator
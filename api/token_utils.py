@@ -0,0 +1,26 @@
+from functools import lru_cache
+import logging
+
+logger = logging.getLogger(__name__)
+
+ENCODING_NAME = "cl100k_base"
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(ENCODING_NAME)
+    except Exception as e:
+        logger.warning(f"tiktoken unavailable ({str(e)}), estimating token counts from text length")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens in a text, estimating ~4 characters per token without tiktoken"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
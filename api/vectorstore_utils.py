@@ -0,0 +1,520 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+from startup_utils import lazy_resource
+import threading
+import json
+import time
+import os
+from dotenv import load_dotenv
+import logging
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
+INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "fastapi-rag-chatbot")
+DEFAULT_EMBEDDING_DIMENSION = 1536
+# text-embedding-3 models can return shortened vectors; the index must be created with the same dimension
+EMBEDDING_DIMENSION = int(os.getenv("EMBEDDING_DIMENSION", str(DEFAULT_EMBEDDING_DIMENSION)))
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "pinecone")
+LOCAL_VECTOR_DIR = os.getenv("LOCAL_VECTOR_DIR", "/tmp/vector_index")
+LOCAL_VECTOR_DTYPE = os.getenv("LOCAL_VECTOR_DTYPE", "float32")
+LOCAL_VECTOR_COMPACT_RATIO = float(os.getenv("LOCAL_VECTOR_COMPACT_RATIO", "0.25"))
+LOCAL_VECTOR_QUANTIZATION = os.getenv("LOCAL_VECTOR_QUANTIZATION", "none")
+LOCAL_VECTOR_RESCORE_FACTOR = int(os.getenv("LOCAL_VECTOR_RESCORE_FACTOR", "4"))
+QUANTIZATIONS = ("none", "int8", "binary")
+SCORE_BLOCK_ROWS = 1024
+DELETE_BATCH_SIZE = 1000
+FETCH_BATCH_SIZE = 100
+
+
+@lru_cache(maxsize=1)
+def _popcount():
+    """Set bits per byte, counted by np.bitwise_count on NumPy 2 or a lookup table before that"""
+    import numpy as np
+    table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    return getattr(np, "bitwise_count", None) or table.__getitem__
+
+
+def _bit_count(values):
+    return _popcount()(values)
+
+
+@dataclass
+class VectorMatch:
+    id: str
+    score: float
+    metadata: Dict[str, Any]
+
+
+class VectorStoreBackend:
+    """Minimal vector index interface used for ingestion, retrieval and deletion.
+
+    Vectors are dicts with "id", "values" and "metadata", as accepted by Pinecone.
+    Methods are synchronous; async callers run them with asyncio.to_thread.
+    """
+
+    def upsert(self, vectors: List[Dict]):
+        raise NotImplementedError
+
+    def delete(self, ids: List[str]):
+        raise NotImplementedError
+
+    def query(self, vector: List[float], top_k: int, filter: Optional[Dict] = None) -> List[VectorMatch]:
+        raise NotImplementedError
+
+    def find_ids(self, filter: Dict, limit: int = 10000) -> List[str]:
+        """Return the ids of vectors whose metadata matches a filter"""
+        raise NotImplementedError
+
+    def list_ids(self, prefix: str) -> List[str]:
+        """Return every vector id starting with prefix"""
+        raise NotImplementedError
+
+    def fetch(self, ids: List[str]) -> Dict[str, Dict]:
+        """Return the stored vectors among ids as {id: {"values": ..., "metadata": ...}}"""
+        raise NotImplementedError
+
+    def update_metadata(self, updates: Dict[str, Dict]) -> int:
+        """Set metadata fields of stored vectors, keeping their values; returns how many vectors changed.
+
+        Vectors are fetched and re-upserted in batches, and only those whose
+        fields differ are written.
+        """
+        ids = list(updates)
+        changed = 0
+        for i in range(0, len(ids), FETCH_BATCH_SIZE):
+            vectors = [
+                {"id": vector_id, "values": vector["values"], "metadata": {**vector["metadata"], **updates[vector_id]}}
+                for vector_id, vector in self.fetch(ids[i:i + FETCH_BATCH_SIZE]).items()
+                if any(vector["metadata"].get(key) != value for key, value in updates[vector_id].items())
+            ]
+            if vectors:
+                self.upsert(vectors)
+                changed += len(vectors)
+        return changed
+
+    def as_retriever(self, embeddings, k: int = 4, chunk_store=None):
+        from retriever_utils import VectorStoreBackendRetriever
+        return VectorStoreBackendRetriever(backend=self, embeddings=embeddings, chunk_store=chunk_store, k=k)
+
+
+# Indexes already known to exist; survives across warm invocations of a container
+_verified_indexes = set()
+
+
+class PineconeBackend(VectorStoreBackend):
+    def __init__(self, api_key: str = PINECONE_API_KEY, index_name: str = INDEX_NAME,
+                 dimension: int = EMBEDDING_DIMENSION):
+        from pinecone import Pinecone
+
+        pc = Pinecone(api_key=api_key)
+        if index_name not in _verified_indexes:
+            self._ensure_index(pc, index_name, dimension)
+            _verified_indexes.add(index_name)
+
+        self.dimension = dimension
+        self.index = pc.Index(index_name)
+
+    @staticmethod
+    def _ensure_index(pc, index_name: str, dimension: int):
+        from pinecone import ServerlessSpec
+
+        existing_indexes = {index_info["name"]: index_info for index_info in pc.list_indexes()}
+        if index_name in existing_indexes:
+            existing_dimension = existing_indexes[index_name]["dimension"]
+            if existing_dimension != dimension:
+                raise ValueError(f"Pinecone index {index_name} has dimension {existing_dimension}, but "
+                                 f"EMBEDDING_DIMENSION is {dimension}; use a new PINECONE_INDEX_NAME")
+        else:
+            pc.create_index(name = index_name,
+                            dimension = dimension,
+                            metric = "cosine",
+                            spec = ServerlessSpec(cloud = "aws", region = "us-east-1"))
+            while not pc.describe_index(index_name).status["ready"]:
+                time.sleep(1)
+
+    def upsert(self, vectors: List[Dict]):
+        self.index.upsert(vectors=vectors)
+
+    def delete(self, ids: List[str]):
+        for i in range(0, len(ids), DELETE_BATCH_SIZE):
+            self.index.delete(ids=ids[i:i + DELETE_BATCH_SIZE])
+
+    def query(self, vector: List[float], top_k: int, filter: Optional[Dict] = None) -> List[VectorMatch]:
+        results = self.index.query(
+            vector=list(vector),
+            top_k=top_k,
+            filter=filter,
+            include_metadata=True
+        )
+        return [VectorMatch(id=match.id, score=match.score, metadata=match.metadata or {}) for match in results.matches]
+
+    def find_ids(self, filter: Dict, limit: int = 10000) -> List[str]:
+        results = self.index.query(
+            vector=[0] * self.dimension,
+            top_k=limit,
+            filter=filter,
+            include_metadata=False
+        )
+        return [match.id for match in results.matches]
+
+    def list_ids(self, prefix: str) -> List[str]:
+        ids = []
+        for page in self.index.list(prefix=prefix):
+            ids.extend(page)
+        return ids
+
+    def fetch(self, ids: List[str]) -> Dict[str, Dict]:
+        response = self.index.fetch(ids=ids)
+        return {vector_id: {"values": vector.values, "metadata": vector.metadata or {}}
+                for vector_id, vector in response.vectors.items()}
+
+
+def _matches_filter(metadata: Dict, filter: Dict) -> bool:
+    """Evaluate a Pinecone-style metadata filter ($eq, $ne, $in, $nin, $and, $or)"""
+    for key, condition in filter.items():
+        if key == "$and":
+            if not all(_matches_filter(metadata, sub) for sub in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(_matches_filter(metadata, sub) for sub in condition):
+                return False
+            continue
+
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, expected in condition.items():
+            if op == "$eq" and value != expected:
+                return False
+            if op == "$ne" and value == expected:
+                return False
+            if op == "$in" and value not in expected:
+                return False
+            if op == "$nin" and value in expected:
+                return False
+    return True
+
+
+class LocalVectorBackend(VectorStoreBackend):
+    """Memory-mapped NumPy vector index for offline runs and small to medium corpora.
+
+    Layout of the index directory:
+      index.json      dimension, dtype and quantization the index was built with
+      vectors.bin     normalized vectors, one row per upsert, float32 or float16
+      codes.bin       quantized rows (int8 with a per-row scale, or sign bits), if enabled
+      meta.jsonl      one {"id", "metadata"} line per row (the id/metadata sidecar)
+      deleted.jsonl   tombstoned row numbers, appended on delete or overwrite
+
+    Rows are only ever appended; compaction rewrites the live rows once the
+    tombstoned fraction passes LOCAL_VECTOR_COMPACT_RATIO.
+
+    With quantization, queries scan the codes (4x smaller than float32 for int8,
+    32x for binary) and re-score the best top_k * rescore_factor candidates
+    against the full-precision rows, so only those rows of vectors.bin are read.
+    """
+
+    def __init__(self, directory: str = LOCAL_VECTOR_DIR, dimension: int = EMBEDDING_DIMENSION,
+                 dtype: str = LOCAL_VECTOR_DTYPE, compact_ratio: float = LOCAL_VECTOR_COMPACT_RATIO,
+                 quantization: str = LOCAL_VECTOR_QUANTIZATION, rescore_factor: int = LOCAL_VECTOR_RESCORE_FACTOR):
+        import numpy as np
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown vector quantization: {quantization}")
+        self.directory = directory
+        self.dimension = dimension
+        self.dtype = np.dtype(dtype)
+        self.compact_ratio = compact_ratio
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.directory, "vectors.bin")
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.directory, "meta.jsonl")
+
+    @property
+    def _deleted_path(self) -> str:
+        return os.path.join(self.directory, "deleted.jsonl")
+
+    @property
+    def _codes_path(self) -> str:
+        return os.path.join(self.directory, "codes.bin")
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, "index.json")
+
+    @property
+    def _code_dtype(self) -> Optional["np.dtype"]:
+        import numpy as np
+        if self.quantization == "int8":
+            return np.dtype([("codes", np.int8, (self.dimension,)), ("scale", np.float32)])
+        if self.quantization == "binary":
+            return np.dtype([("bits", np.uint8, ((self.dimension + 7) // 8,))])
+        return None
+
+    def _encode(self, vectors: "np.ndarray") -> "np.ndarray":
+        """Quantize normalized float32 rows"""
+        import numpy as np
+        codes = np.zeros(len(vectors), dtype=self._code_dtype)
+        if self.quantization == "int8":
+            scale = np.abs(vectors).max(axis=1)
+            scale[scale == 0] = 1.0
+            codes["codes"] = np.round(vectors / scale[:, None] * 127)
+            codes["scale"] = scale / 127
+        else:
+            codes["bits"] = np.packbits(vectors > 0, axis=1)
+        return codes
+
+    def _check_manifest(self) -> bool:
+        """Validate the index against the configured dimension and dtype; returns whether the codes are stale"""
+        manifest = {"dimension": self.dimension, "dtype": self.dtype.name, "quantization": self.quantization}
+        stale = True
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path) as f:
+                existing = json.load(f)
+            for key in ("dimension", "dtype"):
+                if existing[key] != manifest[key]:
+                    raise ValueError(f"Local vector index in {self.directory} has {key} {existing[key]}, "
+                                     f"but {manifest[key]} is configured; use a new LOCAL_VECTOR_DIR")
+            stale = existing.get("quantization", "none") != self.quantization
+        if stale:
+            with open(self._manifest_path, "w") as f:
+                json.dump(manifest, f)
+        return stale
+
+    def _rebuild_codes(self):
+        """Quantize every stored row, e.g. after quantization was switched on for an existing index"""
+        import numpy as np
+        logger.info(f"Quantizing {len(self._ids)} vectors in {self.directory} to {self.quantization}")
+        vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode="r", shape=(len(self._ids), self.dimension))
+        with open(self._codes_path, "wb") as f:
+            for i in range(0, len(vectors), SCORE_BLOCK_ROWS):
+                f.write(self._encode(np.asarray(vectors[i:i + SCORE_BLOCK_ROWS], dtype=np.float32)).tobytes())
+
+    def _load(self):
+        import numpy as np
+        stale_codes = self._check_manifest()
+        self._ids: List[str] = []
+        self._metadata: List[Dict] = []
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                for line in f:
+                    row = json.loads(line)
+                    self._ids.append(row["id"])
+                    self._metadata.append(row["metadata"])
+
+        self._live = np.ones(len(self._ids), dtype=bool)
+        if os.path.exists(self._deleted_path):
+            with open(self._deleted_path) as f:
+                for line in f:
+                    self._live[json.loads(line)] = False
+
+        self._rows: Dict[str, int] = {}
+        for row, vector_id in enumerate(self._ids):
+            if self._live[row]:
+                self._rows[vector_id] = row
+        if self._code_dtype is not None and self._ids:
+            code_rows = os.path.getsize(self._codes_path) // self._code_dtype.itemsize \
+                if os.path.exists(self._codes_path) else 0
+            if stale_codes or code_rows != len(self._ids):
+                self._rebuild_codes()
+        self._remap()
+        logger.info(f"Loaded local vector index with {len(self._rows)} live vectors from {self.directory}")
+
+    def _remap(self):
+        import numpy as np
+        count = len(self._ids)
+        self._codes = None
+        if count == 0:
+            self._vectors = np.zeros((0, self.dimension), dtype=self.dtype)
+            if self._code_dtype is not None:
+                self._codes = np.zeros(0, dtype=self._code_dtype)
+            return
+        self._vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode="r", shape=(count, self.dimension))
+        if self._code_dtype is not None:
+            self._codes = np.memmap(self._codes_path, dtype=self._code_dtype, mode="r", shape=(count,))
+
+    def _normalize(self, values) -> "np.ndarray":
+        import numpy as np
+        vectors = np.asarray(values, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _tombstone(self, rows: List[int]):
+        if not rows:
+            return
+        with open(self._deleted_path, "a") as f:
+            for row in rows:
+                f.write(f"{row}\n")
+        self._live[rows] = False
+
+    def upsert(self, vectors: List[Dict]):
+        import numpy as np
+        if not vectors:
+            return
+        # The last entry for an id wins, as if the batch had been upserted one vector at a time
+        vectors = list({v["id"]: v for v in vectors}.values())
+        with self._lock:
+            replaced = [self._rows[v["id"]] for v in vectors if v["id"] in self._rows]
+            self._tombstone(replaced)
+
+            normalized = self._normalize([v["values"] for v in vectors])
+            if normalized.shape[1] != self.dimension:
+                raise ValueError(f"Expected {self.dimension}-dimensional vectors, got {normalized.shape[1]}")
+            with open(self._vectors_path, "ab") as f:
+                f.write(normalized.astype(self.dtype).tobytes())
+            if self._code_dtype is not None:
+                with open(self._codes_path, "ab") as f:
+                    f.write(self._encode(normalized).tobytes())
+            with open(self._meta_path, "a") as f:
+                for v in vectors:
+                    f.write(json.dumps({"id": v["id"], "metadata": v.get("metadata", {})}) + "\n")
+
+            start = len(self._ids)
+            for offset, v in enumerate(vectors):
+                self._ids.append(v["id"])
+                self._metadata.append(v.get("metadata", {}))
+                self._rows[v["id"]] = start + offset
+            self._live = np.concatenate([self._live, np.ones(len(vectors), dtype=bool)])
+            self._remap()
+
+    def delete(self, ids: List[str]):
+        with self._lock:
+            rows = [self._rows.pop(vector_id) for vector_id in ids if vector_id in self._rows]
+            self._tombstone(rows)
+            if self._ids and (1 - len(self._rows) / len(self._ids)) > self.compact_ratio:
+                self.compact()
+
+    def compact(self):
+        """Rewrite the index files with only the live rows"""
+        import numpy as np
+        with self._lock:
+            live_rows = np.flatnonzero(self._live)
+            logger.info(f"Compacting local vector index: {len(self._ids)} rows -> {len(live_rows)}")
+            vectors_tmp = self._vectors_path + ".tmp"
+            codes_tmp = self._codes_path + ".tmp"
+            meta_tmp = self._meta_path + ".tmp"
+            with open(vectors_tmp, "wb") as f:
+                for i in range(0, len(live_rows), 10000):
+                    f.write(np.ascontiguousarray(self._vectors[live_rows[i:i + 10000]]).tobytes())
+            if self._codes is not None:
+                with open(codes_tmp, "wb") as f:
+                    for i in range(0, len(live_rows), 10000):
+                        f.write(np.ascontiguousarray(self._codes[live_rows[i:i + 10000]]).tobytes())
+            with open(meta_tmp, "w") as f:
+                for row in live_rows:
+                    f.write(json.dumps({"id": self._ids[row], "metadata": self._metadata[row]}) + "\n")
+
+            self._vectors = self._codes = None
+            os.replace(vectors_tmp, self._vectors_path)
+            if os.path.exists(codes_tmp):
+                os.replace(codes_tmp, self._codes_path)
+            os.replace(meta_tmp, self._meta_path)
+            if os.path.exists(self._deleted_path):
+                os.remove(self._deleted_path)
+            self._load()
+
+    def _filter_mask(self, filter: Optional[Dict]) -> "np.ndarray":
+        import numpy as np
+        if not filter:
+            return self._live
+        matches = np.fromiter((_matches_filter(metadata, filter) for metadata in self._metadata),
+                              dtype=bool, count=len(self._metadata))
+        return self._live & matches
+
+    def _approximate_scores(self, codes: "np.ndarray", query: "np.ndarray") -> "np.ndarray":
+        """Scores against the quantized rows, computed in blocks to bound temporary memory"""
+        import numpy as np
+        scores = np.empty(len(codes), dtype=np.float32)
+        query_bits = np.packbits(query > 0) if self.quantization == "binary" else None
+        for i in range(0, len(codes), SCORE_BLOCK_ROWS):
+            block = codes[i:i + SCORE_BLOCK_ROWS]
+            if query_bits is None:
+                scores[i:i + len(block)] = (block["codes"].astype(np.float32) @ query) * block["scale"]
+            else:
+                # Fewer differing sign bits means a smaller angle
+                scores[i:i + len(block)] = -_bit_count(block["bits"] ^ query_bits).sum(axis=1, dtype=np.int32)
+        return scores
+
+    @staticmethod
+    def _top(scores: "np.ndarray", k: int) -> "np.ndarray":
+        import numpy as np
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])]
+
+    def query(self, vector: List[float], top_k: int, filter: Optional[Dict] = None) -> List[VectorMatch]:
+        import numpy as np
+        with self._lock:
+            vectors, codes, ids, metadata = self._vectors, self._codes, self._ids, self._metadata
+            mask = self._filter_mask(filter)
+        if not mask.any():
+            return []
+
+        k = min(top_k, int(mask.sum()))
+        if codes is None:
+            query = self._normalize(vector).astype(self.dtype)
+            scores = (vectors @ query).astype(np.float32)
+            scores[~mask[:len(scores)]] = -np.inf
+            top = self._top(scores, k)
+            return [VectorMatch(id=ids[row], score=float(scores[row]), metadata=metadata[row]) for row in top]
+
+        query = self._normalize(vector)
+        approximate = self._approximate_scores(codes, query)
+        approximate[~mask[:len(approximate)]] = -np.inf
+        candidates = np.sort(self._top(approximate, min(k * self.rescore_factor, int(mask.sum()))))
+        # Re-score the candidates against the full-precision rows
+        exact = (np.asarray(vectors[candidates], dtype=np.float32) @ query)
+        top = self._top(exact, k)
+        return [VectorMatch(id=ids[candidates[i]], score=float(exact[i]), metadata=metadata[candidates[i]])
+                for i in top]
+
+    def find_ids(self, filter: Dict, limit: int = 10000) -> List[str]:
+        import numpy as np
+        with self._lock:
+            rows = np.flatnonzero(self._filter_mask(filter))[:limit]
+            return [self._ids[row] for row in rows]
+
+    def list_ids(self, prefix: str) -> List[str]:
+        with self._lock:
+            return [vector_id for vector_id in self._rows if vector_id.startswith(prefix)]
+
+    def fetch(self, ids: List[str]) -> Dict[str, Dict]:
+        import numpy as np
+        with self._lock:
+            rows = {vector_id: self._rows[vector_id] for vector_id in ids if vector_id in self._rows}
+            return {vector_id: {"values": np.asarray(self._vectors[row], dtype=np.float32),
+                                "metadata": dict(self._metadata[row])}
+                    for vector_id, row in rows.items()}
+
+
+VECTOR_STORE_BACKENDS: Dict[str, Callable[[], VectorStoreBackend]] = {
+    "pinecone": PineconeBackend,
+    "local": LocalVectorBackend,
+}
+
+
+def create_vector_store(name: str = VECTOR_STORE_BACKEND) -> VectorStoreBackend:
+    if name not in VECTOR_STORE_BACKENDS:
+        raise ValueError(f"Unknown vector store backend: {name}")
+    logger.info(f"Using {name} vector store backend")
+    return VECTOR_STORE_BACKENDS[name]()
+
+
+@lazy_resource("vector_store")
+def get_vector_store() -> VectorStoreBackend:
+    return create_vector_store()
@@ -2,6 +2,7 @@ import requests
 import streamlit as st
 from dotenv import load_dotenv
 import os
+import json
 
 load_dotenv()
 
@@ -24,11 +25,38 @@ def get_chat_response(question, session_id, model):
         st.error(f"An error occurred: {str(e)}")
         return None
     
+def stream_chat_response(question, session_id, model):
+    """Yield (event, data) pairs from the /chat/stream Server-Sent Events endpoint"""
+    headers = {'accept': 'text/event-stream', 'Content-Type': 'application/json'}
+    data = {"question" : question, "model" : model}
+    if session_id:
+        data["session_id"] = session_id
+
+    try:
+        with requests.post(f"{API_BASE_URL}/chat/stream", headers = headers, json = data, stream = True) as response:
+            if response.status_code != 200:
+                st.error(f"API request failed with status code {response.status_code}: {response.text}")
+                return
+
+            event, data_lines = "message", []
+            for line in response.iter_lines(decode_unicode = True):
+                if line:
+                    if line.startswith("event:"):
+                        event = line[len("event:"):].strip()
+                    elif line.startswith("data:"):
+                        data_lines.append(line[len("data:"):].strip())
+                    continue
+                if data_lines:
+                    yield event, json.loads("\n".join(data_lines))
+                event, data_lines = "message", []
+    except Exception as e:
+        st.error(f"An error occurred: {str(e)}")
+    
 def upload_document(file):
     try:
         files = {"file" : (file.name, file, file.type)}
         response = requests.post(f"{API_BASE_URL}/upload-doc", files = files)
-        if response.status_code == 200:
+        if response.status_code in (200, 202):
             return response.json()
         else:
             st.error(f"Failed to upload file. Error: {response.status_code} - {response.text}")
@@ -37,6 +65,18 @@ def upload_document(file):
         st.error(f"An error occurred while uploading the file: {str(e)}")
         return None
     
+def get_job_status(job_id):
+    try:
+        response = requests.get(f"{API_BASE_URL}/jobs/{job_id}")
+        if response.status_code == 200:
+            return response.json()
+        else:
+            st.error(f"Failed to get job status. Error: {response.status_code} - {response.text}")
+            return None
+    except Exception as e:
+        st.error(f"An error occurred while fetching the job status: {str(e)}")
+        return None
+    
 def list_documents():
     try:
         response = requests.get(f"{API_BASE_URL}/list-docs")
@@ -1,5 +1,39 @@
 import streamlit as st
-from api_utils import get_chat_response
+from api_utils import get_chat_response, stream_chat_response
+
+def display_response_details(answer, model, session_id, sources=None):
+    with st.expander("Details"):
+        st.subheader("Generated Answer")
+        st.code(answer)
+        st.subheader("Model Used")
+        st.code(model)
+        st.subheader("Session ID")
+        st.code(session_id)
+        if sources:
+            st.subheader("Sources")
+            st.json(sources)
+
+def display_streaming_response(prompt):
+    final_event = {}
+
+    def token_stream():
+        for event, data in stream_chat_response(prompt, st.session_state.session_id, st.session_state.model):
+            if event == "token":
+                yield data["content"]
+            elif event == "end":
+                final_event.update(data)
+            elif event == "error":
+                st.error(f"Streaming failed: {data.get('detail')}")
+
+    with st.chat_message("assistant"):
+        answer = st.write_stream(token_stream())
+
+    if final_event:
+        st.session_state.session_id = final_event.get("session_id")
+        st.session_state.messages.append({"role" : "assistant", "content" : answer})
+        display_response_details(answer, final_event.get("model"), final_event.get("session_id"), final_event.get("sources"))
+    else:
+        st.error("Failed to get a response from the API. Please try again.")
 
 def display_chat_interface():
     for message in st.session_state.messages:
@@ -11,6 +45,10 @@ def display_chat_interface():
         with st.chat_message("user"):
             st.markdown(prompt)
 
+        if st.session_state.get("stream_responses", True):
+            display_streaming_response(prompt)
+            return
+
         with st.spinner("Generating Response..."):
             response = get_chat_response(prompt, st.session_state.session_id, st.session_state.model)
 
@@ -21,12 +59,6 @@ def display_chat_interface():
                 with st.chat_message("assistant"):
                     st.markdown(response["answer"])
 
-                with st.expander("Details"):
-                    st.subheader("Generated Answer")
-                    st.code(response["answer"]) 
-                    st.subheader("Model Used")
-                    st.code(response["model"])
-                    st.subheader("Session ID")
-                    st.code(response["session_id"])
+                display_response_details(response["answer"], response["model"], response["session_id"])
             else:
                 st.error("Failed to get a response from the API. Please try again.")
\ No newline at end of file
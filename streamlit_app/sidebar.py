@@ -1,20 +1,35 @@
 import streamlit as st
-from api_utils import upload_document, list_documents, delete_document
+from api_utils import upload_document, list_documents, delete_document, get_job_status
 
 def display_sidebar():
     # Model Selection
     model_options = ["gpt-4o-mini", "gpt-4o"]
     st.sidebar.selectbox("Select Model", options=model_options, key="model")
+    st.sidebar.checkbox("Stream responses", value=True, key="stream_responses")
 
     # Document Upload
     uploaded_file = st.sidebar.file_uploader("Choose a file", type=["pdf", "docx", "html"])
     if uploaded_file and st.sidebar.button("Upload"):
         with st.spinner("Uploading..."):
             upload_response = upload_document(uploaded_file)
-            if upload_response:
-                st.sidebar.success(f"File uploaded successfully with ID {upload_response['file_id']}.")
+            if upload_response and upload_response.get("duplicate"):
+                # Nothing was stored or queued; point at the document that has this content
+                st.sidebar.info(f"This file is already uploaded as document ID {upload_response['file_id']}.")
+                st.session_state.job_id = None
+            elif upload_response:
+                # The API's message says whether the document was indexed already or queued
+                st.sidebar.success(f"{upload_response['message']} (ID {upload_response['file_id']})")
+                st.session_state.job_id = upload_response.get("job_id")
                 st.session_state.documents = list_documents()
 
+    # Indexing Job Status
+    if st.session_state.get("job_id") and st.sidebar.button("Refresh Indexing Status"):
+        job = get_job_status(st.session_state.job_id)
+        if job:
+            st.sidebar.text(f"{job['filename']}: {job['stage']} ({job['chunks_done']}/{job['chunks_total']} chunks)")
+            if job.get("error"):
+                st.sidebar.error(job["error"])
+
     # List and Delete Documents
     st.sidebar.header("Uploaded Documents")
     if st.sidebar.button("Refresh Document List"):